@@ -1,12 +1,16 @@
 from app.extensions import db, jwt 
 from flask import Flask
 from app.logger import init_app
+from app import database, metrics
+from app.cache import TTLCache
+from app.hot_window import HotWindow
+from app.passwords import PasswordPool
+from app.rate_limit import RateLimiter, MemoryStore, SQLiteStore
 from app.config import Config, ProductionConfig, DevelopmentConfig
 import os
 
 def create_app():
     app = Flask(__name__)
-    init_app(app) # Logging
 
     # Choose config based on environment
     env = os.environ.get("FLASK_ENV", "development")
@@ -14,9 +18,49 @@ def create_app():
         app.config.from_object(ProductionConfig)
     else:
         app.config.from_object(DevelopmentConfig)
+    init_app(app) # Logging
 
+    database.configure(app) # Pool, timeout and replica settings
     db.init_app(app) # Connect database 
+    database.init_app(app, db) # SQLite pragmas
     jwt.init_app(app) # Connect JWT
+    if app.config['METRICS_ENABLED']:
+        metrics.init_app(app, db) # Request, query and pool metrics
+
+    # Short-lived cache of users and sensor ownership shared by all requests in the process
+    app.extensions['identity_cache'] = TTLCache(ttl=app.config['IDENTITY_CACHE_TTL'], maxsize=app.config['IDENTITY_CACHE_SIZE'])
+
+    # Recent readings of the most read sensors, see HotWindow
+    if app.config['HOT_WINDOW_ENABLED']:
+        app.extensions['hot_window'] = HotWindow(
+            max_age=app.config['HOT_WINDOW_SECONDS'],
+            max_readings=app.config['HOT_WINDOW_MAX_READINGS'],
+            max_sensors=app.config['HOT_WINDOW_MAX_SENSORS'],
+            refresh_seconds=app.config['HOT_WINDOW_REFRESH_SECONDS'],
+            reseed_seconds=app.config['HOT_WINDOW_RESEED_SECONDS'],
+            refresh_overlap=app.config['HOT_WINDOW_REFRESH_OVERLAP'],
+        )
+
+    # Ingest budgets per user and sensor, see RateLimiter
+    if app.config['RATE_LIMIT_ENABLED']:
+        store_path = app.config['RATE_LIMIT_STORE_PATH']
+        app.extensions['rate_limiter'] = RateLimiter(
+            store=SQLiteStore(store_path) if store_path else MemoryStore(),
+            requests_per_second=app.config['RATE_LIMIT_REQUESTS_PER_SECOND'],
+            request_burst=app.config['RATE_LIMIT_REQUEST_BURST'],
+            rows_per_second=app.config['RATE_LIMIT_ROWS_PER_SECOND'],
+            row_burst=app.config['RATE_LIMIT_ROW_BURST'],
+            sensor_rows_per_second=app.config['RATE_LIMIT_SENSOR_ROWS_PER_SECOND'],
+            sensor_row_burst=app.config['RATE_LIMIT_SENSOR_ROW_BURST'],
+        )
+
+    # bcrypt runs on worker processes so login bursts don't stall other requests
+    app.extensions['password_pool'] = PasswordPool(
+        workers=app.config['PASSWORD_POOL_WORKERS'],
+        max_pending=app.config['PASSWORD_POOL_MAX_PENDING'],
+        rounds=app.config['BCRYPT_ROUNDS'],
+        timeout=app.config['PASSWORD_POOL_TIMEOUT'],
+    )
 
     # Connect blueprints 
     from app.routes.auth import auth_bp
@@ -25,5 +69,14 @@ def create_app():
     app.register_blueprint(alert_bp)
     from app.routes.sensors import sensor_bp
     app.register_blueprint(sensor_bp)
+    from app.routes.health import health_bp
+    app.register_blueprint(health_bp)
+    if app.config['METRICS_ENABLED']:
+        from app.routes.metrics import metrics_bp
+        app.register_blueprint(metrics_bp)
+
+    # Background job commands
+    from app.tasks import init_app as init_tasks
+    init_tasks(app)
 
     return app
\ No newline at end of file
@@ -0,0 +1,355 @@
+from app import create_app
+from app.services import async_sensor_service, sensor_service, stream_service
+from app.routes.sensors import parse_data_filters
+from app.database import apply_sqlite_pragmas
+from app import packed, metrics, compression
+from app.logger import logger
+from flask import current_app
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import ExpiredSignatureError, PyJWTError
+from sqlalchemy.engine import make_url
+from urllib.parse import parse_qsl
+import asyncio
+import json
+import re
+import time
+
+# Async drivers used for each database backend when ASYNC_DATABASE_URL isn't set
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def async_database_url(url):
+    """Swap the driver of a sync database URL for its async counterpart."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}, set ASYNC_DATABASE_URL")
+    return url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+def create_async_engine_for(app):
+    """Create the pooled AsyncEngine described by the app's config."""
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    config = app.config
+    url = make_url(config["ASYNC_DATABASE_URL"] or async_database_url(config["SQLALCHEMY_DATABASE_URI"]))
+    options = {"pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    if url.get_backend_name() != "sqlite":
+        options.update(pool_size=config["ASYNC_POOL_SIZE"], max_overflow=config["ASYNC_MAX_OVERFLOW"],
+                       pool_timeout=config["DB_POOL_TIMEOUT"], pool_recycle=config["DB_POOL_RECYCLE"])
+    if url.get_backend_name() == "postgresql" and config["DB_STATEMENT_TIMEOUT_MS"]:
+        options["connect_args"] = {"server_settings": {"statement_timeout": str(config["DB_STATEMENT_TIMEOUT_MS"])}}
+    engine = create_async_engine(url, **options)
+    apply_sqlite_pragmas(engine.sync_engine, config)
+    if config["METRICS_ENABLED"]:
+        metrics.instrument_engine(engine.sync_engine, "async")
+    return engine
+
+
+class Request:
+    """The parts of an ASGI HTTP scope the async routes need."""
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self.headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+
+    async def body(self, limit=None):
+        chunks, size = [], 0
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            size += len(chunks[-1])
+            if limit and size > limit:
+                raise ValueError("Request body too large")
+            if not message.get("more_body"):
+                break
+        return b"".join(chunks)
+
+    async def lines(self, max_line, decoder=None):
+        """Yield raw body lines, or None in place of a line longer than max_line, decompressing through decoder if given."""
+        pending, oversized = b"", False
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                return
+            body = message.get("body", b"")
+            for chunk in decoder.decode(body) if decoder else (body,):
+                pending += chunk
+                while True:
+                    end = pending.find(b"\n")
+                    if end < 0:
+                        break
+                    line, pending = pending[:end + 1], pending[end + 1:]
+                    if oversized:
+                        oversized = False
+                        continue
+                    yield line if len(line) <= max_line else None
+                if len(pending) > max_line:
+                    # Oversized line, discard the remainder so the next line starts fresh
+                    if not oversized:
+                        yield None
+                    pending, oversized = b"", True
+            if not message.get("more_body"):
+                if decoder:
+                    decoder.close()
+                if pending and not oversized:
+                    yield pending
+                return
+
+    def encoding(self):
+        """The body's Content-Encoding, "" when uncompressed."""
+        encoding = self.headers.get("content-encoding", "").strip().lower()
+        return "" if encoding == "identity" else encoding
+
+
+async def send_json(send, body, status=200, headers=()):
+    payload = current_app.json.dumps(body).encode("utf-8") + b"\n"
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())] + list(headers)})
+    await send({"type": "http.response.body", "body": payload})
+
+async def send_rate_limited(send, result):
+    """Async rate_limited_response."""
+    body = {"error": result["error"], "retry_after": result["retry_after"]}
+    await send_json(send, body, status=result["code"], headers=[(b"retry-after", str(result["retry_after"]).encode())])
+
+
+class AsyncAPI:
+    """
+    ASGI app that serves the ingest and read hot paths natively on asyncio with an
+    async database driver, and hands every other request to the regular Flask app
+    through a WSGI adapter so the blueprints behave exactly as they do under WSGI.
+
+    An idle connected device costs a coroutine rather than a worker thread, and
+    database connections are only held while a query is running.
+    """
+
+    def __init__(self, app, engine):
+        from asgiref.wsgi import WsgiToAsgi
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        self.app = app
+        self.engine = engine
+        self.sessions = async_sessionmaker(engine, expire_on_commit=False)
+        self.fallback = WsgiToAsgi(app)
+        # (method, Flask rule used as the metrics route label, pattern, handler)
+        self.routes = [
+            ("POST", "/api/sensors/data", re.compile(r"^/api/sensors/data/?$"), self.add_sensor_data),
+            ("POST", "/api/sensors/data/stream", re.compile(r"^/api/sensors/data/stream/?$"), self.stream_sensor_data),
+            ("GET", "/api/sensors/<sensor_id>/data", re.compile(r"^/api/sensors/(?P<sensor_id>[^/]+)/data/?$"), self.get_sensor_data),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http":
+            for method, rule, pattern, handler in self.routes:
+                match = pattern.match(scope["path"])
+                if match and scope["method"] == method:
+                    with self.app.app_context():
+                        if not self.app.config["METRICS_ENABLED"]:
+                            return await handler(Request(scope, receive), send, **match.groupdict())
+                        return await self.timed(rule, handler, Request(scope, receive), send, **match.groupdict())
+        return await self.fallback(scope, receive, send)
+
+    async def timed(self, rule, handler, request, send, **kwargs):
+        """Run a handler, recording its latency and database queries like metrics.init_app does for Flask routes."""
+        started, status = time.perf_counter(), [500]
+        stats, token = metrics.track_request_db()
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+        try:
+            return await handler(request, send_status, **kwargs)
+        finally:
+            metrics.reset_request_db(token)
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=rule, status=status[0])
+            metrics.HTTP_REQUEST_DB_QUERIES.observe(stats["queries"], route=rule)
+            metrics.HTTP_REQUEST_DB_SECONDS.observe(stats["seconds"], route=rule)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def authenticate(self, session, request, send):
+        """Async user_required, returning the user dict or None once an error response is sent."""
+        authorization = request.headers.get("authorization", "")
+        if not authorization.startswith("Bearer "):
+            await send_json(send, {"msg": "Missing Authorization Header"}, status=401)
+            return None
+        try:
+            claims = decode_token(authorization[len("Bearer "):])
+        except ExpiredSignatureError:
+            await send_json(send, {"msg": "Token has expired"}, status=401)
+            return None
+        except (PyJWTError, JWTExtendedException) as e:
+            await send_json(send, {"msg": str(e)}, status=422)
+            return None
+
+        user = await async_sensor_service.get_user(session, claims[current_app.config["JWT_IDENTITY_CLAIM"]])
+        if not user:
+            await send_json(send, {"error": "User does not exist"})
+        return user
+
+    async def add_sensor_data(self, request, send):
+        async with self.sessions() as session:
+            user = await self.authenticate(session, request, send)
+            if not user:
+                return
+            is_packed = request.headers.get("content-type", "").split(";")[0].strip() == packed.CONTENT_TYPE
+            encoding = request.encoding()
+            if encoding and encoding not in compression.ENCODINGS:
+                return await send_json(send, {"error": f"Unsupported Content-Encoding {encoding}"}, status=415)
+            try:
+                body = await request.body(limit=current_app.config.get("MAX_CONTENT_LENGTH"))
+                if encoding:
+                    body = compression.decompress(body, max_size=current_app.config["MAX_DECOMPRESSED_LENGTH"])
+                data = {"readings": packed.decode_readings(body)} if is_packed else json.loads(body or b"null")
+            except compression.EncodedBodyError as e:
+                return await send_json(send, {"error": str(e)}, status=e.status)
+            except ValueError as e:
+                return await send_json(send, {"error": str(e) if is_packed else "No readings provided"}, status=400)
+
+            if not isinstance(data, dict) or not data.get("readings"):
+                return await send_json(send, {"error": "No readings provided"})
+            if not isinstance(data["readings"], list):
+                return await send_json(send, {"error": "Readings must be a list"})
+
+            idempotency_key = request.headers.get("idempotency-key")
+            if idempotency_key is not None and not 0 < len(idempotency_key) <= 128:
+                return await send_json(send, {"error": "Idempotency-Key must be 1 to 128 characters"}, status=400)
+
+            limited = sensor_service.check_rate_limit(user["id"])
+            if limited:
+                return await send_rate_limited(send, limited)
+
+            data_log = await async_sensor_service.log_sensor_data(session, user_id=user["id"], data=data["readings"], idempotency_key=idempotency_key)
+            if data_log.get("code") == 429:
+                return await send_rate_limited(send, data_log)
+            status = 500 if "error" in data_log else 202 if data_log.get("queued") else 200
+            if is_packed and status != 500:
+                ack = packed.encode_ack(data_log)
+                await send({"type": "http.response.start", "status": status,
+                            "headers": [(b"content-type", packed.CONTENT_TYPE.encode()), (b"content-length", str(len(ack)).encode())]})
+                return await send({"type": "http.response.body", "body": ack})
+            await send_json(send, data_log, status=status)
+
+    async def stream_sensor_data(self, request, send):
+        """Async stream_service.ingest_stream, one NDJSON ack per flush."""
+        config = current_app.config
+        async with self.sessions() as session:
+            user = await self.authenticate(session, request, send)
+            if not user:
+                return
+            limited = sensor_service.check_rate_limit(user["id"])
+            if limited:
+                return await send_rate_limited(send, limited)
+            encoding = request.encoding()
+            if encoding and encoding not in compression.ENCODINGS:
+                return await send_json(send, {"error": f"Unsupported Content-Encoding {encoding}"}, status=415)
+
+            # Lines are read into a bounded queue so a slow database applies backpressure to the client
+            lines = asyncio.Queue(maxsize=config["INGEST_STREAM_QUEUE_SIZE"])
+            async def read_lines():
+                try:
+                    async for line in request.lines(config["INGEST_STREAM_MAX_LINE"], decoder=compression.GzipDecoder() if encoding else None):
+                        await lines.put(line)
+                except compression.EncodedBodyError as e:
+                    await lines.put(e)
+                finally:
+                    await lines.put(stream_service._EOF)
+            reader = asyncio.create_task(read_lines())
+
+            await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/x-ndjson")]})
+            async def flush():
+                readings, indexes, errors = buffer.take()
+                result = await async_sensor_service.log_sensor_data(session, user["id"], readings, pace=True) if readings else {"accepted": 0, "errors": []}
+                ack = buffer.acknowledge(readings, indexes, errors, result)
+                await send({"type": "http.response.body", "body": json.dumps(ack).encode() + b"\n", "more_body": True})
+
+            buffer = stream_service.ReadingBuffer(user_id=user["id"], max_size=config["INGEST_STREAM_BATCH_SIZE"], max_age=config["INGEST_STREAM_FLUSH_SECONDS"])
+            index = 0
+            error = None
+            try:
+                while True:
+                    try:
+                        line = await asyncio.wait_for(lines.get(), timeout=buffer.time_until_due())
+                    except asyncio.TimeoutError:
+                        await flush()
+                        continue
+
+                    if line is stream_service._EOF:
+                        break
+                    if isinstance(line, compression.EncodedBodyError):
+                        error = line
+                        break
+                    if line is None:
+                        buffer.reject(index, "line_too_long")
+                    elif line.strip():
+                        try:
+                            buffer.add(index, json.loads(line))
+                        except ValueError:
+                            buffer.reject(index, "invalid_json")
+                    else:
+                        continue
+                    index += 1
+
+                    if buffer.full or buffer.time_until_due() == 0:
+                        await flush()
+
+                if len(buffer):
+                    await flush()
+            finally:
+                reader.cancel()
+
+            if error:
+                logger.warning(f"Ingest stream for user {user['id']} ended on a bad body after {index} lines: {error}")
+            else:
+                logger.info(f"Ingest stream for user {user['id']} closed after {index} lines, {buffer.accepted} accepted")
+            await send({"type": "http.response.body", "body": json.dumps(buffer.summary(index, error)).encode() + b"\n"})
+
+    async def get_sensor_data(self, request, send, sensor_id):
+        # Summaries and NDJSON/packed exports stay on the Flask route
+        if request.args.get("summary_only") or request.args.get("format") or packed.CONTENT_TYPE in request.headers.get("accept", ""):
+            return await self.fallback(request.scope, request.receive, send)
+
+        async with self.sessions() as session:
+            user = await self.authenticate(session, request, send)
+            if not user:
+                return
+            if not sensor_id.isnumeric():
+                return await send_json(send, {"error": "Invalid sensor id"})
+
+            filters = parse_data_filters(request.args)
+            if "error" in filters:
+                return await send_json(send, filters, status=400)
+
+            config = current_app.config
+            limit = min(filters["limit"] or config["SENSOR_DATA_PAGE_SIZE"], config["SENSOR_DATA_MAX_PAGE_SIZE"])
+            sensor_data = await async_sensor_service.get_sensor_data(session, user["id"], int(sensor_id), filters, limit=limit)
+            if sensor_data.get("code") == 404:
+                return await send_json(send, {"error": "Sensor does not exist"})
+            await send_json(send, sensor_data, status=sensor_data.get("code", 200))
+
+
+def create_asgi_app():
+    """
+    Build the ASGI app, requires asgiref and an async driver (asyncpg or aiosqlite).
+
+    Usage:
+        uvicorn asgi:app --workers 4
+    """
+    app = create_app()
+    return AsyncAPI(app, create_async_engine_for(app))
@@ -0,0 +1,95 @@
+"""
+Decoding of gzip request bodies (Content-Encoding: gzip) as they are read, so batching
+clients can compress uploads without the server holding both copies in memory.
+
+The decompressed size is bounded separately from the compressed size, since a few KB of
+gzip can expand to gigabytes.
+"""
+
+import io
+import zlib
+
+# zlib window bits that accept only the gzip container
+GZIP_WBITS = zlib.MAX_WBITS | 16
+ENCODINGS = ("gzip", "x-gzip")
+
+class EncodedBodyError(ValueError):
+    """
+    Raised for a compressed request body that can't be decoded: status is 400 for a
+    corrupt or truncated body and 413 when it decompresses past its size limit.
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class GzipDecoder:
+    """Incremental decompression of a gzip body, which may hold several concatenated members."""
+
+    def __init__(self, max_size=None, chunk_size=64 * 1024):
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+
+    def decode(self, data):
+        """Yield the decompressed chunks of the next compressed bytes, each at most chunk_size long."""
+        while data:
+            if self._decompressor.eof:
+                self._decompressor = zlib.decompressobj(GZIP_WBITS)
+            try:
+                chunk = self._decompressor.decompress(data, self.chunk_size)
+            except zlib.error as e:
+                raise EncodedBodyError(f"Invalid gzip request body: {e}", 400)
+            self.size += len(chunk)
+            if self.max_size and self.size > self.max_size:
+                raise EncodedBodyError(f"Request body larger than {self.max_size} bytes once decompressed", 413)
+            if chunk:
+                yield chunk
+            data = self._decompressor.unused_data if self._decompressor.eof else self._decompressor.unconsumed_tail
+
+    def close(self):
+        """Check the body ended on a complete gzip member."""
+        if not self._decompressor.eof:
+            raise EncodedBodyError("Truncated gzip request body", 400)
+
+
+class GzipReader(io.RawIOBase):
+    """Readable file object decompressing a gzip stream, see decoded_stream."""
+
+    def __init__(self, raw, decoder):
+        self.raw = raw
+        self.decoder = decoder
+        self._chunks = self._decode()
+        self._pending = b""
+
+    def _decode(self):
+        while True:
+            data = self.raw.read(self.decoder.chunk_size)
+            if not data:
+                self.decoder.close()
+                return
+            yield from self.decoder.decode(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            self._pending = next(self._chunks, b"")
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+def decoded_stream(raw, max_size=None):
+    """Buffered file object (read, readline) over the decompressed contents of a gzip stream."""
+    return io.BufferedReader(GzipReader(raw, GzipDecoder(max_size)))
+
+def decompress(body, max_size=None):
+    """Decompress a whole gzip body."""
+    decoder = GzipDecoder(max_size)
+    data = b"".join(decoder.decode(body))
+    decoder.close()
+    return data
@@ -11,15 +11,139 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = os.environ.get(
         "SQLALCHEMY_TRACK_MODIFICATIONS", False
     )
+    DATABASE_READ_URL = os.environ.get("DATABASE_READ_URL")  # optional replica for sensor GET routes
+
+    # Connection pool, sized per worker process
+    DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 10))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))  # seconds
+    DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 0))  # PostgreSQL only, 0 disables
+
+    # SQLite pragmas for edge deployments
+    SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5000))
+
+    # Async serving (asgi.py), defaults to DATABASE_URL with its async driver
+    ASYNC_DATABASE_URL = os.environ.get("ASYNC_DATABASE_URL")
+    ASYNC_POOL_SIZE = int(os.environ.get("ASYNC_POOL_SIZE", 10))
+    ASYNC_MAX_OVERFLOW = int(os.environ.get("ASYNC_MAX_OVERFLOW", 20))
 
     # JWT
     JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "dev_jwt_secret")
     JWT_ACCESS_TOKEN_EXPIRES = 3600  # 1 hour
 
+    # Password hashing, run on a process pool off the request threads
+    BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+    PASSWORD_POOL_WORKERS = int(os.environ.get("PASSWORD_POOL_WORKERS", 2))  # 0 hashes inline
+    PASSWORD_POOL_MAX_PENDING = int(os.environ.get("PASSWORD_POOL_MAX_PENDING", 32))
+    PASSWORD_POOL_TIMEOUT = float(os.environ.get("PASSWORD_POOL_TIMEOUT", 5))  # seconds
+
+    # Logging, records are written by a background thread from a bounded queue
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+    LOG_MODULE_LEVELS = os.environ.get("LOG_MODULE_LEVELS", "")  # e.g. "sensor_service=WARNING,alert_jobs=DEBUG"
+    LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")  # text or json
+    LOG_FILE = os.environ.get("LOG_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "service.log"))
+    LOG_QUEUE_ENABLED = os.environ.get("LOG_QUEUE_ENABLED", "true").lower() == "true"
+    LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))  # records, lower levels are dropped when full
+    LOG_SUMMARY_SECONDS = float(os.environ.get("LOG_SUMMARY_SECONDS", 10))  # ingest summary interval, 0 logs every batch
+
+    # Prometheus metrics on /metrics
+    METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+    # User/sensor ownership cache
+    IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", 30))  # seconds
+    IDENTITY_CACHE_SIZE = 10000
+
+    # Recent readings per sensor kept in memory for last-hour reads and /latest
+    HOT_WINDOW_ENABLED = os.environ.get("HOT_WINDOW_ENABLED", "true").lower() == "true"
+    HOT_WINDOW_SECONDS = int(os.environ.get("HOT_WINDOW_SECONDS", 3600))
+    HOT_WINDOW_MAX_READINGS = int(os.environ.get("HOT_WINDOW_MAX_READINGS", 3600))  # per sensor
+    HOT_WINDOW_MAX_SENSORS = int(os.environ.get("HOT_WINDOW_MAX_SENSORS", 500))
+    HOT_WINDOW_REFRESH_SECONDS = float(os.environ.get("HOT_WINDOW_REFRESH_SECONDS", 2))  # picks up other workers' writes
+    HOT_WINDOW_RESEED_SECONDS = 300
+    HOT_WINDOW_REFRESH_OVERLAP = 1000  # trailing ids re-read on refresh, catches rows committed out of id order
+
+    # Ingest rate limits per user and sensor, 0 disables a budget; bursts default to one second's worth
+    RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_STORE_PATH = os.environ.get("RATE_LIMIT_STORE_PATH")  # SQLite file shared by workers, unset keeps buckets in process
+    RATE_LIMIT_REQUESTS_PER_SECOND = float(os.environ.get("RATE_LIMIT_REQUESTS_PER_SECOND", 20))  # per user
+    RATE_LIMIT_REQUEST_BURST = float(os.environ.get("RATE_LIMIT_REQUEST_BURST", 100))
+    RATE_LIMIT_ROWS_PER_SECOND = float(os.environ.get("RATE_LIMIT_ROWS_PER_SECOND", 5000))  # per user
+    RATE_LIMIT_ROW_BURST = float(os.environ.get("RATE_LIMIT_ROW_BURST", 50000))
+    RATE_LIMIT_SENSOR_ROWS_PER_SECOND = float(os.environ.get("RATE_LIMIT_SENSOR_ROWS_PER_SECOND", 1000))
+    RATE_LIMIT_SENSOR_ROW_BURST = float(os.environ.get("RATE_LIMIT_SENSOR_ROW_BURST", 10000))
+
+    # gzip request bodies (Content-Encoding: gzip) on the sensor routes
+    MAX_DECOMPRESSED_LENGTH = int(os.environ.get("MAX_DECOMPRESSED_LENGTH", 64 * 1024 * 1024))  # bytes, streams are bounded per line instead
+
+    # Streaming ingest
+    INGEST_STREAM_BATCH_SIZE = int(os.environ.get("INGEST_STREAM_BATCH_SIZE", 500))
+    INGEST_STREAM_FLUSH_SECONDS = float(os.environ.get("INGEST_STREAM_FLUSH_SECONDS", 0.25))
+    INGEST_STREAM_QUEUE_SIZE = int(os.environ.get("INGEST_STREAM_QUEUE_SIZE", 10000))
+    INGEST_STREAM_MAX_LINE = 4096  # bytes
+
+    # Client timestamps further ahead of the server clock than this are rejected
+    INGEST_MAX_CLOCK_SKEW_SECONDS = int(os.environ.get("INGEST_MAX_CLOCK_SKEW_SECONDS", 300))
+
+    # Durable ingest queue, readings are acked once queued and written by a drainer
+    INGEST_QUEUE_ENABLED = os.environ.get("INGEST_QUEUE_ENABLED", "false").lower() == "true"
+    INGEST_QUEUE_PATH = os.environ.get("INGEST_QUEUE_PATH", "ingest_queue.db")
+    INGEST_QUEUE_LEASE_SECONDS = 60
+    INGEST_QUEUE_DRAIN_BATCHES = int(os.environ.get("INGEST_QUEUE_DRAIN_BATCHES", 200))
+    INGEST_QUEUE_DRAIN_INTERVAL = 0.5  # seconds between polls of an empty queue
+    INGEST_QUEUE_DRAIN_IN_PROCESS = os.environ.get("INGEST_QUEUE_DRAIN_IN_PROCESS", "true").lower() == "true"
+    INGEST_QUEUE_MAX_ATTEMPTS = 5  # failed writes before a batch is moved to the queue's dead_batches table
+    INGEST_KEY_RETENTION_HOURS = int(os.environ.get("INGEST_KEY_RETENTION_HOURS", 72))
+
+    # Sensor data reads
+    SENSOR_DATA_PAGE_SIZE = int(os.environ.get("SENSOR_DATA_PAGE_SIZE", 1000))
+    SENSOR_DATA_MAX_PAGE_SIZE = int(os.environ.get("SENSOR_DATA_MAX_PAGE_SIZE", 10000))
+    SENSOR_DATA_STREAM_CHUNK = int(os.environ.get("SENSOR_DATA_STREAM_CHUNK", 1000))
+    SENSOR_FANOUT_PAGE_SIZE = int(os.environ.get("SENSOR_FANOUT_PAGE_SIZE", 100))  # readings per sensor
+    SENSOR_FANOUT_MAX_SENSORS = int(os.environ.get("SENSOR_FANOUT_MAX_SENSORS", 1000))
+    EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", 10000))  # rows per CSV chunk / Arrow batch / Parquet row group
+    LTTB_DEFAULT_POINTS = 1000
+    LTTB_MAX_POINTS = int(os.environ.get("LTTB_MAX_POINTS", 5000))
+
+    # Spatial sensor lookups
+    GEO_MAX_CELLS = 32  # geohash cells covering a bbox, coarser cells beyond this
+    GEO_KNN_START_KM = float(os.environ.get("GEO_KNN_START_KM", 5))  # first nearest-k search radius, doubled until k are found
+    GEO_MAX_K = 1000
+
+    # Pre-aggregated rollups
+    ROLLUPS_ENABLED = os.environ.get("ROLLUPS_ENABLED", "true").lower() == "true"
+    ROLLUP_MINUTE_RETENTION_DAYS = int(os.environ.get("ROLLUP_MINUTE_RETENTION_DAYS", 7))
+    ROLLUP_HOUR_RETENTION_DAYS = int(os.environ.get("ROLLUP_HOUR_RETENTION_DAYS", 0)) or None  # None keeps forever
+
+    # Raw data retention, overridden per user/sensor by retention_days
+    SENSOR_DATA_RETENTION_DAYS = int(os.environ.get("SENSOR_DATA_RETENTION_DAYS", 0)) or None  # None keeps forever
+    SENSOR_DATA_DELETE_BATCH = int(os.environ.get("SENSOR_DATA_DELETE_BATCH", 5000))
+    # Set when "Sensor_Data" is a PostgreSQL table partitioned by created_at (see ensure_partitions). Its
+    # client_seq unique index then includes created_at, so only retries that resend the device timestamp are deduplicated
+    SENSOR_DATA_PARTITIONED = os.environ.get("SENSOR_DATA_PARTITIONED", "false").lower() == "true"
+
+    # Alert engine
+    ALERTS_ENABLED = os.environ.get("ALERTS_ENABLED", "true").lower() == "true"
+    ALERT_WORKERS = int(os.environ.get("ALERT_WORKERS", 2))
+    ALERT_QUEUE_SIZE = int(os.environ.get("ALERT_QUEUE_SIZE", 10000))
+    # Threshold and rate rules keep their state (hysteresis, cooldown) in the evaluating process, so
+    # they must be evaluated by a single process. In-process evaluation is only correct when one
+    # process handles all ingest; with several workers set this to false and run `flask alerts run`
+    ALERT_ENGINE_IN_PROCESS = os.environ.get("ALERT_ENGINE_IN_PROCESS", "true").lower() == "true"
+    ALERT_RULE_REFRESH_SECONDS = 30
+    ALERT_SWEEP_SECONDS = 5  # between no_data sweeps and reads of new readings in `flask alerts run`
+    ALERT_TAIL_OVERLAP = 1000  # trailing ids re-read by `flask alerts run` to catch out of order commits
+    ALERT_PAGE_SIZE = 100
+    ALERT_MAX_PAGE_SIZE = 1000
+
 
 class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get("DB_STATEMENT_TIMEOUT_MS", 30000))
 
 
 class DevelopmentConfig(Config):
@@ -0,0 +1,97 @@
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# Bind key of the optional read replica (DATABASE_READ_URL)
+REPLICA = "replica"
+
+class RoutingSession(Session):
+    """
+    Session that sends queries to the read replica while g.read_replica is set for the
+    request and nothing is being flushed, and to the primary otherwise. Without a
+    configured replica it behaves like the default session.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context() and g.get("read_replica"):
+            replica = self._db.engines.get(REPLICA)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def engine_options(config, url):
+    """
+    SQLAlchemy create_engine options for url from the DB_* settings in config.
+
+    Pool sizes are per process, so the total connections a deployment can open is
+    (DB_POOL_SIZE + DB_MAX_OVERFLOW) x worker processes, which must stay under the
+    server's max_connections.
+    """
+    url = make_url(url)
+    options = {"pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    if url.get_backend_name() == "sqlite":
+        # In-memory databases use a single shared connection, pool sizing doesn't apply
+        if url.database and url.database != ":memory:":
+            options.update(pool_size=config["DB_POOL_SIZE"], max_overflow=config["DB_MAX_OVERFLOW"],
+                           pool_timeout=config["DB_POOL_TIMEOUT"])
+        return options
+
+    options.update(
+        pool_size=config["DB_POOL_SIZE"],
+        max_overflow=config["DB_MAX_OVERFLOW"],
+        pool_timeout=config["DB_POOL_TIMEOUT"],
+        pool_recycle=config["DB_POOL_RECYCLE"],
+    )
+    if url.get_backend_name() == "postgresql" and config["DB_STATEMENT_TIMEOUT_MS"]:
+        options["connect_args"] = {"options": f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+def configure(app):
+    """Fill in engine options and the replica bind from the DB_* config before db.init_app."""
+    config = app.config
+    config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", engine_options(config, config["SQLALCHEMY_DATABASE_URI"]))
+    if config["DATABASE_READ_URL"]:
+        binds = dict(config.get("SQLALCHEMY_BINDS") or {})
+        binds.setdefault(REPLICA, dict(engine_options(config, config["DATABASE_READ_URL"]), url=config["DATABASE_READ_URL"]))
+        config["SQLALCHEMY_BINDS"] = binds
+
+def apply_sqlite_pragmas(engine, config):
+    """Set the SQLITE_* pragmas on every new connection of a SQLite engine."""
+    if engine.dialect.name != "sqlite":
+        return
+
+    def set_sqlite_pragmas(connection, record):
+        cursor = connection.cursor()
+        # WAL lets readers run alongside the single writer instead of failing with "database is locked"
+        cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        cursor.close()
+    event.listen(engine, "connect", set_sqlite_pragmas)
+
+def init_app(app, db):
+    """Apply SQLite pragmas to the app's engines, call after db.init_app."""
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, app.config)
+
+def pool_status(db):
+    """
+    Current connection pool usage of every engine, keyed by bind ("default" for the primary).
+
+    Returns:
+        dict: {bind: {"size", "checked_out", "checked_in", "overflow", "max_overflow"}}
+    """
+    status = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        stats = {"class": type(pool).__name__}
+        for name in ("size", "checkedout", "checkedin", "overflow"):
+            method = getattr(pool, name, None)
+            if method is not None:
+                stats[name.replace("checked", "checked_")] = method()
+        stats["max_overflow"] = getattr(pool, "_max_overflow", None)
+        status[key or "default"] = stats
+    return status
@@ -0,0 +1,41 @@
+from flask import g, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.services import auth_service
+from functools import wraps
+
+def load_user():
+    """Resolve the JWT identity to a user dict once per request, cached on g."""
+    if 'user' not in g:
+        g.user = auth_service.get_user(get_jwt_identity())
+    return g.user
+
+def user_required(fn):
+    """
+    Require a valid JWT for an existing user. The user dict is available as g.user.
+
+    Usage:
+        @sensor_bp.route('', methods=['GET'])
+        @user_required
+        def get_sensors():
+            user_id = g.user['id']
+    """
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if not load_user():
+            return jsonify({'error': 'User does not exist'})
+        return fn(*args, **kwargs)
+    return wrapper
+
+def sensor_owner_required(fn):
+    """Like user_required, and the sensor_id URL argument must be a sensor owned by the user."""
+    @wraps(fn)
+    @user_required
+    def wrapper(*args, **kwargs):
+        sensor_id = kwargs.get('sensor_id')
+        if not sensor_id or not str(sensor_id).isnumeric():
+            return jsonify({'error': 'Invalid sensor id'})
+        if not auth_service.owns_sensor(g.user['id'], int(sensor_id)):
+            return jsonify({'error': 'Sensor does not exist'})
+        return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,112 @@
+"""
+Geohash encoding and bounding box covers, so spatial lookups can run as a handful of
+range scans on an ordinary B-tree index over a geohash column.
+
+A geohash interleaves longitude and latitude bits, five per base32 character. Points
+in the same cell share the cell's geohash as a prefix, so "every point in cell c" is
+the string range [c, successor(c)).
+"""
+
+import math
+
+ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+def encode(latitude, longitude, precision=PRECISION):
+    """Geohash of a point, or None if either coordinate is missing or out of range."""
+    if latitude is None or longitude is None or not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        return None
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, bit_count, even = [], 0, 0, True
+    while len(chars) < precision:
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            bits = bits * 2 + 1
+            bounds[0] = middle
+        else:
+            bits *= 2
+            bounds[1] = middle
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(ALPHABET[bits])
+            bits, bit_count = 0, 0
+    return "".join(chars)
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell."""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+def successor(cell):
+    """The first geohash after every geohash starting with cell, or None past the last cell."""
+    chars = list(cell)
+    while chars:
+        position = ALPHABET.index(chars[-1])
+        if position + 1 < len(ALPHABET):
+            chars[-1] = ALPHABET[position + 1]
+            return "".join(chars)
+        chars.pop()
+    return None
+
+def _cover(min_lat, min_lon, max_lat, max_lon, precision):
+    height, width = cell_size(precision)
+    rows = range(int((min_lat + 90) // height), int(min((max_lat + 90) // height, 180 / height - 1)) + 1)
+    columns = range(int((min_lon + 180) // width), int(min((max_lon + 180) // width, 360 / width - 1)) + 1)
+    return {encode(-90 + (row + 0.5) * height, -180 + (column + 0.5) * width, precision) for row in rows for column in columns}
+
+def bbox_ranges(min_lat, min_lon, max_lat, max_lon, max_cells=32):
+    """
+    Geohash ranges covering a bounding box, using the finest precision that needs at most
+    max_cells cells. A box with min_lon > max_lon crosses the antimeridian.
+
+    Returns:
+        list: (start, end) string ranges, end is None for "to the end"
+    """
+    if min_lon > max_lon:
+        return bbox_ranges(min_lat, min_lon, max_lat, 180, max_cells) + bbox_ranges(min_lat, -180, max_lat, max_lon, max_cells)
+
+    cells = set()
+    for precision in range(PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        count = (math.floor((max_lat + 90) / height) - math.floor((min_lat + 90) / height) + 1) \
+            * (math.floor((max_lon + 180) / width) - math.floor((min_lon + 180) / width) + 1)
+        if count <= max_cells or precision == 1:
+            cells = _cover(min_lat, min_lon, max_lat, max_lon, precision)
+            break
+
+    # Cells next to each other in geohash order merge into one range
+    ranges = []
+    for cell in sorted(cells):
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = successor(cell)
+        else:
+            ranges.append([cell, successor(cell)])
+    return [tuple(bounds) for bounds in ranges]
+
+def radius_bbox(latitude, longitude, radius_km):
+    """
+    Bounding box (min_lat, min_lon, max_lat, max_lon) holding every point within
+    radius_km of a point, spanning all longitudes when the circle reaches a pole.
+    """
+    lat_delta = radius_km / _KM_PER_DEGREE
+    min_lat, max_lat = latitude - lat_delta, latitude + lat_delta
+    if min_lat <= -90 or max_lat >= 90 or radius_km >= math.pi * EARTH_RADIUS_KM:
+        return max(min_lat, -90), -180, min(max_lat, 90), 180
+
+    lon_delta = math.degrees(math.asin(min(math.sin(radius_km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)), 1)))
+    min_lon, max_lon = longitude - lon_delta, longitude + lon_delta
+    if lon_delta >= 180 or max_lon - min_lon >= 360:
+        return min_lat, -180, max_lat, 180
+    # Wrap into [-180, 180], leaving min_lon > max_lon across the antimeridian
+    return min_lat, (min_lon + 540) % 360 - 180, max_lat, (max_lon + 540) % 360 - 180
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle (haversine) distance between two points."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(math.sqrt(a), 1))
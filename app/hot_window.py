@@ -0,0 +1,190 @@
+from bisect import bisect_left
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from threading import Lock
+import time
+
+_TICK = timedelta(microseconds=1)
+
+class Reading(namedtuple("Reading", "created_at id sensor_id value unit client_seq")):
+    """A cached reading, ordered by (created_at, id) like the Sensor_Data reads."""
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, row):
+        """From a Sensor_Data row."""
+        return cls(row.created_at, row.id, row.sensor_id, row.value, row.unit.value, row.client_seq)
+
+    @classmethod
+    def from_dict(cls, row):
+        """From a row dict returned by sensor_service.write_sensor_data."""
+        return cls(row["created_at"], row["id"], row["sensor_id"], row["value"], row["unit"].value, row.get("client_seq"))
+
+    def to_dict(self):
+        """Same shape as Sensor_Data.to_dict."""
+        return {
+            "id": self.id,
+            "sensor_id": self.sensor_id,
+            "value": self.value,
+            "unit": self.unit,
+            "created_at": self.created_at.isoformat(),
+            "client_seq": self.client_seq,
+        }
+
+
+class _Series:
+    __slots__ = ("readings", "complete_since", "synced_id", "seeded_at", "synced_at", "latest")
+
+    def __init__(self, complete_since):
+        self.readings = []  # sorted oldest first
+        self.complete_since = complete_since
+        self.synced_id = 0
+        self.seeded_at = self.synced_at = time.monotonic()
+        self.latest = None
+
+
+class HotWindow:
+    """
+    Per-sensor ring buffers of the most recent readings, kept in process so the
+    "last N minutes" reads that make up most dashboard traffic are answered without
+    querying Sensor_Data.
+
+    A sensor's series is seeded from the database on its first read, then kept current
+    with the rows this process commits (add). It holds every reading created at or after
+    its complete_since: readings older than max_age seconds, or beyond max_readings, are
+    evicted from the old end, which moves complete_since forward. Each worker process has
+    its own window, so rows committed by other processes are picked up by refresh() once a
+    series is refresh_seconds old, and the series is seeded again after reseed_seconds so
+    deletes made elsewhere don't linger.
+
+    A refresh reads rows with an id above the highest seen less refresh_overlap: ids are
+    allocated before commit, so a concurrent transaction can commit a lower id after a
+    higher one was read, and rows already held are skipped.
+    """
+
+    def __init__(self, max_age=3600, max_readings=3600, max_sensors=500, refresh_seconds=2, reseed_seconds=300,
+                 refresh_overlap=1000):
+        self.max_age = max_age
+        self.max_readings = max_readings
+        self.max_sensors = max_sensors
+        self.refresh_seconds = refresh_seconds
+        self.reseed_seconds = reseed_seconds
+        self.refresh_overlap = refresh_overlap
+        self._series = OrderedDict()
+        self._lock = Lock()
+
+    def due(self, sensor_id):
+        """
+        What the series needs before it can be read.
+
+        Returns:
+            tuple: ("seed", None), ("refresh", id after which to read rows from the database) or (None, None)
+        """
+        series = self._series.get(sensor_id)
+        now = time.monotonic()
+        if series is None or now - series.seeded_at >= self.reseed_seconds:
+            return "seed", None
+        if now - series.synced_at >= self.refresh_seconds:
+            return "refresh", max(0, series.synced_id - self.refresh_overlap)
+        return None, None
+
+    def seed(self, sensor_id, cutoff, readings, latest=None):
+        """
+        Replace a sensor's series with readings, every reading created at or after cutoff
+        as read from the database. A query limited to max_readings + 1 rows is enough,
+        the oldest are evicted.
+        """
+        series = _Series(cutoff)
+        series.readings = sorted(readings)
+        series.synced_id = max((reading.id for reading in readings), default=latest.id if latest else 0)
+        series.latest = series.readings[-1] if series.readings else latest
+        self._trim(series)
+        with self._lock:
+            self._series[sensor_id] = series
+            self._series.move_to_end(sensor_id)
+            while len(self._series) > self.max_sensors:
+                self._series.popitem(last=False)
+
+    def refresh(self, sensor_id, readings):
+        """Merge readings read from the database after the id given by due() into a sensor's series."""
+        with self._lock:
+            series = self._series.get(sensor_id)
+            if series is None:
+                return
+            for reading in readings:
+                self._insert(series, reading)
+                series.synced_id = max(series.synced_id, reading.id)
+            series.synced_at = time.monotonic()
+            self._trim(series)
+
+    def add(self, readings):
+        """Add readings committed by this process to the series of their sensors."""
+        with self._lock:
+            changed = set()
+            for reading in readings:
+                series = self._series.get(reading.sensor_id)
+                # Sensors without a series will have these rows when seeded
+                if series is not None:
+                    self._insert(series, reading)
+                    changed.add(reading.sensor_id)
+            for sensor_id in changed:
+                self._trim(self._series[sensor_id])
+
+    def discard(self, sensor_id):
+        """Forget a sensor's series, e.g. after its readings were deleted."""
+        with self._lock:
+            self._series.pop(sensor_id, None)
+
+    def window(self, sensor_id, cutoff):
+        """
+        A sensor's readings created at or after cutoff, oldest first.
+
+        Returns:
+            list: Readings, or None if the series doesn't hold every reading since cutoff
+        """
+        with self._lock:
+            series = self._series.get(sensor_id)
+            if series is None:
+                return None
+            self._series.move_to_end(sensor_id)
+            self._trim(series)
+            if cutoff < series.complete_since:
+                return None
+            return series.readings[bisect_left(series.readings, (cutoff,)):]
+
+    def latest(self, sensor_id):
+        """
+        A sensor's newest reading, including one older than the window.
+
+        Returns:
+            tuple: (True, Reading or None if the sensor has no readings), or (False, None) without a series
+        """
+        series = self._series.get(sensor_id)
+        if series is None:
+            return False, None
+        return True, series.latest
+
+    def _insert(self, series, reading):
+        if series.latest is None or reading > series.latest:
+            series.latest = reading
+        if reading.created_at < series.complete_since:
+            return
+        readings = series.readings
+        position = bisect_left(readings, reading)
+        if position < len(readings) and readings[position].id == reading.id:
+            return
+        readings.insert(position, reading)
+
+    def _trim(self, series):
+        readings = series.readings
+        horizon = datetime.utcnow() - timedelta(seconds=self.max_age)
+        if series.complete_since < horizon:
+            series.complete_since = horizon
+        start = bisect_left(readings, (series.complete_since,))
+        if len(readings) - start > self.max_readings:
+            # Evict whole timestamps so every reading at or after complete_since stays cached
+            oldest = readings[len(readings) - self.max_readings - 1].created_at
+            series.complete_since = oldest + _TICK
+            start = bisect_left(readings, (series.complete_since,))
+        if start:
+            del readings[:start]
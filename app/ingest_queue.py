@@ -0,0 +1,159 @@
+from threading import local
+import json
+import sqlite3
+import time
+
+class IngestQueue:
+    """
+    Durable local queue of validated reading batches, backed by an embedded SQLite file
+    that survives restarts and is safe to share between worker processes.
+
+    Batches are appended and acknowledged to the client before they reach the main
+    database. A drainer claims batches under a lease, writes them, then deletes them
+    with ack(). Batches whose lease expires before ack() are handed out again, so
+    delivery is at-least-once and each batch carries an idempotency key for the
+    consumer to skip repeats.
+
+    A batch whose write keeps failing is moved to the dead_batches table by fail() after
+    max_attempts, so it can't hold up the batches queued after it. Dead batches are kept
+    for inspection and can be requeued by hand.
+
+    Client idempotency keys are also kept in client_keys after their batch is written,
+    until purge_client_keys, so a repeated batch is recognised without reading the main
+    database, which may be down while the queue keeps acknowledging.
+    """
+
+    def __init__(self, path, lease_seconds=60, synchronous="FULL"):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.synchronous = synchronous
+        self._local = local()
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL UNIQUE,
+                    user_id INTEGER NOT NULL,
+                    rows TEXT NOT NULL,
+                    queued_at REAL NOT NULL,
+                    claimed_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0
+                )""")
+            connection.execute("CREATE TABLE IF NOT EXISTS client_keys (key TEXT PRIMARY KEY, queued_at REAL NOT NULL)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS dead_batches (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    rows TEXT NOT NULL,
+                    queued_at REAL NOT NULL,
+                    failed_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    error TEXT
+                )""")
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(f"PRAGMA synchronous={self.synchronous}")
+            self._local.connection = connection
+        return _Transaction(connection)
+
+    def append(self, key, user_id, rows, client_key=False):
+        """
+        Durably queue a batch of rows. Appending a key that is already queued is a no-op,
+        as is a client_key seen before, even if its batch was already written.
+
+        Returns:
+            bool: True if the batch was queued, False if the key was already queued or seen
+        """
+        now = time.time()
+        with self._connect() as connection:
+            if client_key:
+                cursor = connection.execute("INSERT OR IGNORE INTO client_keys (key, queued_at) VALUES (?, ?)", (key, now))
+                if cursor.rowcount != 1:
+                    return False
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO batches (key, user_id, rows, queued_at) VALUES (?, ?, ?, ?)",
+                (key, user_id, json.dumps(rows, default=str), now),
+            )
+            return cursor.rowcount == 1
+
+    def claim(self, limit=100):
+        """
+        Lease up to limit of the oldest unclaimed (or lease-expired) batches.
+
+        Returns:
+            list: (id, key, user_id, rows, attempts) tuples, attempts being the failed writes so far
+        """
+        now = time.time()
+        with self._connect() as connection:
+            batches = connection.execute(
+                "SELECT id, key, user_id, rows, attempts FROM batches WHERE claimed_until IS NULL OR claimed_until < ? ORDER BY id LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE batches SET claimed_until = ? WHERE id = ?",
+                [(now + self.lease_seconds, batch[0]) for batch in batches],
+            )
+        return [(id, key, user_id, json.loads(rows), attempts) for id, key, user_id, rows, attempts in batches]
+
+    def ack(self, ids):
+        """Delete batches that have been written."""
+        with self._connect() as connection:
+            connection.executemany("DELETE FROM batches WHERE id = ?", [(id,) for id in ids])
+
+    def release(self, ids):
+        """Return claimed batches to the queue immediately, e.g. after a failed write."""
+        with self._connect() as connection:
+            connection.executemany("UPDATE batches SET claimed_until = NULL WHERE id = ?", [(id,) for id in ids])
+
+    def fail(self, id, error, max_attempts):
+        """
+        Count a failed write of a claimed batch and return it to the queue, or move it to
+        dead_batches once it has failed max_attempts times.
+
+        Returns:
+            bool: True if the batch was moved to dead_batches
+        """
+        with self._connect() as connection:
+            connection.execute("UPDATE batches SET claimed_until = NULL, attempts = attempts + 1 WHERE id = ?", (id,))
+            cursor = connection.execute(
+                "INSERT INTO dead_batches (id, key, user_id, rows, queued_at, failed_at, attempts, error) "
+                "SELECT id, key, user_id, rows, queued_at, ?, attempts, ? FROM batches WHERE id = ? AND attempts >= ?",
+                (time.time(), error, id, max_attempts),
+            )
+            if cursor.rowcount != 1:
+                return False
+            # Not written, so the client may send the batch again under the same key
+            connection.execute("DELETE FROM client_keys WHERE key = (SELECT key FROM batches WHERE id = ?)", (id,))
+            connection.execute("DELETE FROM batches WHERE id = ?", (id,))
+            return True
+
+    def purge_client_keys(self, before):
+        """Forget client keys queued before the given time.time(), returns the number removed."""
+        with self._connect() as connection:
+            return connection.execute("DELETE FROM client_keys WHERE queued_at < ?", (before,)).rowcount
+
+    def stats(self):
+        """Return {"batches", "oldest_seconds", "dead"} describing the backlog."""
+        with self._connect() as connection:
+            count, oldest = connection.execute("SELECT count(*), min(queued_at) FROM batches").fetchone()
+            dead = connection.execute("SELECT count(*) FROM dead_batches").fetchone()[0]
+        return {"batches": count, "oldest_seconds": round(time.time() - oldest, 3) if oldest else 0.0, "dead": dead}
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT around a block, so claims from concurrent drainers don't overlap."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -1,10 +1,18 @@
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from threading import Lock
+import atexit
+import json
 import os
+import queue
+import time
 
 # Log file location
 LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "service.log")
 
+# Log message format
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
 # Create a logger
 logger = logging.getLogger("service")
 logger.setLevel(logging.INFO)  # Default log level
@@ -14,30 +22,200 @@ if not logger.handlers:
     # Console handler (prints logs to stdout)
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    
+
     # File handler with rotation (1MB per file, keep 3 backups)
     file_handler = RotatingFileHandler(LOG_FILE, maxBytes=1_000_000, backupCount=3)
     file_handler.setLevel(logging.INFO)
-    
-    # Log message format
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
+
+    formatter = logging.Formatter(TEXT_FORMAT)
     console_handler.setFormatter(formatter)
     file_handler.setFormatter(formatter)
-    
+
     # Add handlers to logger
     logger.addHandler(console_handler)
     logger.addHandler(file_handler)
 
 
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with any fields passed as extra={"fields": {...}}."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """Per-module minimum levels, keyed by the module name of the call site (e.g. "sensor_service")."""
+
+    def __init__(self, level, levels):
+        super().__init__()
+        self.level = level
+        self.levels = levels
+
+    def filter(self, record):
+        return record.levelno >= self.levels.get(record.module, self.level)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler that writes to a bounded queue drained by its own QueueListener thread,
+    so logging on a request thread costs a queue put instead of a file write and a
+    rotation check.
+
+    When the queue is full, records below WARNING are dropped and records at WARNING or
+    above displace the oldest queued record. The number dropped is logged as a warning
+    at most every report_seconds. The listener is started on first use in each process,
+    so a logger configured before a fork keeps working in the workers.
+    """
+
+    def __init__(self, handlers, maxsize=10000, report_seconds=10):
+        super().__init__(queue.Queue(maxsize))
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.report_seconds = report_seconds
+        self.dropped = 0
+        self._reported_at = time.monotonic()
+        self._listener = None
+        self._pid = None
+        self._start_lock = Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # A queue inherited across fork may have its lock held by a thread that no longer exists
+                if self._pid is not None:
+                    self.queue = queue.Queue(self.maxsize)
+                self._listener = QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def enqueue(self, record):
+        self._ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            if record.levelno < logging.WARNING:
+                return
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass
+            return
+
+        if self.dropped and time.monotonic() - self._reported_at >= self.report_seconds:
+            dropped, self.dropped = self.dropped, 0
+            self._reported_at = time.monotonic()
+            warning = logger.makeRecord(logger.name, logging.WARNING, __file__, 0, f"Dropped {dropped} log records, log queue full", None, None)
+            warning.fields = {"dropped": dropped}
+            try:
+                self.queue.put_nowait(self.prepare(warning))
+            except queue.Full:
+                self.dropped += dropped
+
+    def stop(self):
+        """Write out queued records and stop the listener thread."""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+        self._listener, self._pid = None, None
+
+
+class LogSummary:
+    """
+    Counts accumulated across calls and logged as one line every interval seconds, for
+    hot paths where a line per call costs more than the work being logged. An interval
+    of 0 logs every call.
+    """
+
+    # Set from LOG_SUMMARY_SECONDS by init_app
+    interval = 10
+
+    def __init__(self, message, level=logging.INFO):
+        self.message = message
+        self.level = level
+        self._counts = {}
+        self._since = time.monotonic()
+        self._lock = Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for key, value in counts.items():
+                self._counts[key] = self._counts.get(key, 0) + value
+            now = time.monotonic()
+            if now - self._since < self.interval:
+                return
+            counts, self._counts = self._counts, {}
+            seconds, self._since = now - self._since, now
+        summary = ", ".join(f"{key}={value}" for key, value in counts.items())
+        suffix = f" in the last {seconds:.0f}s" if self.interval else ""
+        logger.log(self.level, f"{self.message}: {summary}{suffix}", extra={"fields": counts}, stacklevel=2)
+
+
+def parse_levels(levels):
+    """Parse "module=LEVEL,module=LEVEL" (or a dict) into {module: level number}."""
+    if isinstance(levels, dict):
+        items = levels.items()
+    else:
+        items = (item.split("=", 1) for item in str(levels or "").split(",") if "=" in item)
+    return {module.strip(): logging.getLevelName(str(level).strip().upper()) for module, level in items}
+
 def init_app(app):
     """
-    Integrate the logger with a Flask app's built-in logger.
-    
+    Configure the service logger from the app's LOG_* config and integrate it with the
+    Flask app's built-in logger. Call after the config is loaded.
+
     Usage:
         app = Flask(__name__)
+        app.config.from_object(Config)
         init_app(app)
     """
+    config = app.config
+    level = logging.getLevelName(config["LOG_LEVEL"].upper())
+    levels = parse_levels(config["LOG_MODULE_LEVELS"])
+
+    formatter = JsonFormatter() if config["LOG_FORMAT"] == "json" else logging.Formatter(TEXT_FORMAT)
+    console_handler = logging.StreamHandler()
+    file_handler = RotatingFileHandler(config["LOG_FILE"], maxBytes=1_000_000, backupCount=3)
+    handlers = [console_handler, file_handler]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    # Replace the handlers from import time or a previous init_app, writing out anything still queued
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        if isinstance(handler, BoundedQueueHandler):
+            handler.stop()
+        for closing in getattr(handler, "handlers", [handler]):
+            closing.close()
+    for log_filter in [f for f in logger.filters if isinstance(f, ModuleLevelFilter)]:
+        logger.removeFilter(log_filter)
+
+    if config["LOG_QUEUE_ENABLED"]:
+        queue_handler = BoundedQueueHandler(handlers, maxsize=config["LOG_QUEUE_SIZE"])
+        atexit.register(queue_handler.stop)
+        logger.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    # The logger lets through the lowest configured level, the filter applies each module's own
+    logger.setLevel(min([level, *levels.values()]))
+    logger.addFilter(ModuleLevelFilter(level, levels))
+    LogSummary.interval = config["LOG_SUMMARY_SECONDS"]
+
     app.logger.handlers = logger.handlers
     app.logger.setLevel(logger.level)
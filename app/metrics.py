@@ -0,0 +1,242 @@
+"""
+Process-local metrics rendered in the Prometheus text exposition format on /metrics.
+
+Counters and histograms are updated in place under a lock, so instrumenting a hot path
+costs a dict lookup and an addition. Gauges are read from callbacks when scraped. Each
+worker process exposes its own values, Prometheus sums them across targets.
+"""
+
+from app.database import pool_status
+from flask import g, request
+from sqlalchemy import event
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+import time
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, suited to request and query latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}"]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self, key, state):
+        counts, total, count = state
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = 'le="%s"' % _number(bound)
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [le])} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Gauge(Metric):
+    """A gauge whose samples come from callback() at scrape time, as {label values tuple: value}."""
+    type = "gauge"
+
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def render(self):
+        if self.callback is not None:
+            values = self.callback()
+            with self._lock:
+                self._values = dict(values)
+        return super().render()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def register(self, metric):
+        """Add a metric, returning the one already registered under its name if any."""
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route.", labels=("method", "route", "status")))
+HTTP_REQUEST_DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "Database queries made by one request.", labels=("route",),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)))
+HTTP_REQUEST_DB_SECONDS = registry.register(Histogram(
+    "http_request_db_seconds", "Time one request spent in database queries.", labels=("route",)))
+DB_QUERIES = registry.register(Counter("db_queries_total", "Database queries executed.", labels=("bind",)))
+DB_QUERY_SECONDS = registry.register(Histogram("db_query_duration_seconds", "Database query latency.", labels=("bind",)))
+INGEST_READINGS = registry.register(Counter(
+    "ingest_readings_total", "Readings received by ingest, by outcome.", labels=("outcome",)))
+INGEST_REJECTED = registry.register(Counter("ingest_rejected_total", "Rejected readings by reason.", labels=("reason",)))
+INGEST_BATCHES = registry.register(Counter("ingest_batches_total", "Ingest batches handled."))
+INGEST_DEAD_BATCHES = registry.register(Counter(
+    "ingest_dead_batches_total", "Queued ingest batches moved to the dead letter table after repeated write failures."))
+RATE_LIMITED = registry.register(Counter(
+    "rate_limited_total", "Ingest requests refused (or stream batches delayed) by the rate limiter.", labels=("action",)))
+DB_POOL_CONNECTIONS = registry.register(Gauge(
+    "db_pool_connections", "Connection pool state by bind: size, checked_out, checked_in, overflow, max_overflow.",
+    labels=("bind", "state")))
+DB_POOL_SATURATION = registry.register(Gauge(
+    "db_pool_saturation", "Checked out connections over pool_size + max_overflow.", labels=("bind",)))
+
+# Database queries of the request being handled, {"queries", "seconds"} or None. A ContextVar
+# rather than a thread local so each asyncio task of the ASGI app counts its own queries
+_request_db = ContextVar("request_db", default=None)
+
+def instrument_engine(engine, bind="default"):
+    """Count and time every query run on engine."""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        DB_QUERIES.inc(bind=bind)
+        DB_QUERY_SECONDS.observe(elapsed, bind=bind)
+        stats = _request_db.get()
+        if stats is not None:
+            stats["queries"] += 1
+            stats["seconds"] += elapsed
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+def track_request_db():
+    """
+    Count the database queries made from the current context (thread or asyncio task) from
+    now on.
+
+    Returns:
+        tuple: ({"queries", "seconds"} updated as queries run, token for ContextVar.reset)
+    """
+    stats = {"queries": 0, "seconds": 0.0}
+    return stats, _request_db.set(stats)
+
+def reset_request_db(token):
+    """Stop counting for a track_request_db token."""
+    _request_db.reset(token)
+
+def init_app(app, db):
+    """
+    Time every request by route, count its database queries, and report the connection
+    pools at scrape time. Call after db.init_app.
+    """
+    with app.app_context():
+        for key, engine in db.engines.items():
+            instrument_engine(engine, key or "default")
+
+    def pool_connections():
+        with app.app_context():
+            return {(bind, state): value for bind, stats in pool_status(db).items()
+                    for state, value in stats.items() if isinstance(value, int)}
+
+    def pool_saturation():
+        with app.app_context():
+            status = pool_status(db)
+        saturation = {}
+        for bind, stats in status.items():
+            capacity = (stats.get("size") or 0) + max(stats.get("max_overflow") or 0, 0)
+            if capacity and "checked_out" in stats:
+                saturation[(bind,)] = stats["checked_out"] / capacity
+        return saturation
+
+    DB_POOL_CONNECTIONS.callback = pool_connections
+    DB_POOL_SATURATION.callback = pool_saturation
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_started = time.perf_counter()
+        g.metrics_db, _ = track_request_db()
+
+    @app.after_request
+    def record_request_metrics(response):
+        # Streamed bodies are timed to the start of the response
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, method=request.method, route=route, status=response.status_code)
+            stats = g.get("metrics_db") or {"queries": 0, "seconds": 0.0}
+            HTTP_REQUEST_DB_QUERIES.observe(stats["queries"], route=route)
+            HTTP_REQUEST_DB_SECONDS.observe(stats["seconds"], route=route)
+        return response
+
+    @app.teardown_request
+    def stop_request_metrics(exc=None):
+        # after_request is skipped when a view raises, teardown always runs
+        _request_db.set(None)
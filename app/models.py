@@ -1,6 +1,7 @@
 from app.extensions import db
 from enum import Enum as PyEnum 
-from sqlalchemy import Enum as SQLEnum
+from sqlalchemy import Enum as SQLEnum, event
+from app import geo
 from datetime import datetime
 
 class SeverityLevel(PyEnum):
@@ -8,6 +9,11 @@ class SeverityLevel(PyEnum):
     WARNING = 'warning'
     CRITICAL = 'critical'
 
+class RuleType(PyEnum):
+    THRESHOLD = 'threshold'
+    RATE = 'rate'
+    NO_DATA = 'no_data'
+
 class Role(PyEnum):
     ENGINEER = 'engineer'
     ADMIN = 'admin'
@@ -56,6 +62,7 @@ class User(db.Model):
     email = db.Column(db.String(50), nullable=False, unique=True)
     password_hash = db.Column(db.String(128), default=False)
     role = db.Column(SQLEnum(Role, native_enum=False), nullable=False)
+    retention_days = db.Column(db.Integer)  # Default data retention for the user's sensors, None keeps forever
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
 
     def to_dict(self):
@@ -73,12 +80,17 @@ class User(db.Model):
     
 class Device(db.Model):
     __tablename__ = 'Devices'
+    __table_args__ = (
+        # Spatial lookups are geohash range scans within one user's devices
+        db.Index('ix_devices_user_geohash', 'user_id', 'geohash'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id', ondelete='CASCADE'), nullable=False)
     type = db.Column(db.String(50), nullable=False)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))  # set from latitude/longitude on save, see set_geohash
     is_active = db.Column(db.Boolean, default=True)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
@@ -93,6 +105,7 @@ class Device(db.Model):
             "type": self.type,
             "latitude": self.latitude,
             "longitude": self.longitude,
+            "geohash": self.geohash,
             "is_active": self.is_active,
             "description": self.description,
             "created_at": self.created_at.isoformat() if self.created_at else None
@@ -100,21 +113,29 @@ class Device(db.Model):
 
 class Sensor(db.Model):
     __tablename__ = 'Sensors'
+    __table_args__ = (
+        # Spatial lookups are geohash range scans within one user's sensors
+        db.Index('ix_sensors_user_geohash', 'user_id', 'geohash'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('Users.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('Users.id', ondelete='CASCADE'), nullable=False, index=True)
     device_id = db.Column(db.Integer, db.ForeignKey('Devices.id', ondelete='CASCADE'), nullable=False)
     type = db.Column(db.String(50), nullable=False)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))  # set from latitude/longitude on save, see set_geohash
     is_active = db.Column(db.Boolean, default=True)
     description = db.Column(db.Text)
+    retention_days = db.Column(db.Integer)  # Overrides the user's retention_days
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
 
     user = db.relationship("User", back_populates="sensors") 
-    device = db.relationship("User", back_populates="sensors") 
-    sensor_data = db.relationship("Sensor_Data", back_populates="sensor", cascade="all, delete-orphan")
+    device = db.relationship("Device", back_populates="sensors")
+    sensor_data = db.relationship("Sensor_Data", back_populates="sensor", cascade="all, delete-orphan", passive_deletes=True)
+    rollups = db.relationship("Sensor_Rollup", back_populates="sensor", cascade="all, delete-orphan")
     alerts = db.relationship("Alert", back_populates="sensor", cascade="all, delete-orphan")
+    alert_rules = db.relationship("Alert_Rule", back_populates="sensor", cascade="all, delete-orphan")
 
     def to_dict(self):
         return {
@@ -124,22 +145,39 @@ class Sensor(db.Model):
             "type": self.type,
             "latitude": self.latitude,
             "longitude": self.longitude,
+            "geohash": self.geohash,
             "is_active": self.is_active,
             "description": self.description,
+            "retention_days": self.retention_days,
             "created_at": self.created_at.isoformat() if self.created_at else None
         }
 
 
+@event.listens_for(Device, "before_insert")
+@event.listens_for(Device, "before_update")
+@event.listens_for(Sensor, "before_insert")
+@event.listens_for(Sensor, "before_update")
+def set_geohash(mapper, connection, target):
+    target.geohash = geo.encode(target.latitude, target.longitude)
+
 class Sensor_Data(db.Model):
     __tablename__ = 'Sensor_Data'
+    __table_args__ = (
+        # Every read filters on sensor_id and orders/filters on (created_at, id)
+        db.Index('ix_sensor_data_sensor_created', 'sensor_id', 'created_at', 'id'),
+        # A retried upload can't store the same client reading twice, NULL client_seqs never conflict
+        db.Index('uq_sensor_data_client_seq', 'sensor_id', 'client_seq', unique=True),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     sensor_id = db.Column(db.Integer, db.ForeignKey('Sensors.id', ondelete='CASCADE'), nullable=False)
     value = db.Column(db.Float, nullable=False)
     unit = db.Column(SQLEnum(Unit, native_enum=False), nullable=False)
-    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())  # device timestamp when the client sends one
+    client_seq = db.Column(db.String(64), nullable=True)  # client sequence number or UUID
 
     sensor = db.relationship("Sensor", back_populates="sensor_data")
+    alerts = db.relationship("Alert", back_populates="sensor_data")
 
     def to_dict(self):
         return {
@@ -147,11 +185,58 @@ class Sensor_Data(db.Model):
             "sensor_id": self.sensor_id,
             "value": self.value,
             "unit": self.unit.value,
-            "created_at": self.created_at.isoformat() if self.created_at else None
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "client_seq": self.client_seq,
         }
     
+class Ingest_Batch(db.Model):
+    """
+    Queue keys of ingest batches already written, so redelivered batches are skipped.
+    Client Idempotency-Keys are stored scoped to their user, see sensor_service.batch_key.
+    """
+    __tablename__ = 'Ingest_Batches'
+
+    key = db.Column(db.String(128), primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), index=True)
+
+class Sensor_Rollup(db.Model):
+    __tablename__ = 'Sensor_Rollups'
+    __table_args__ = (
+        db.UniqueConstraint('sensor_id', 'resolution', 'bucket_start', name='uq_sensor_rollup_bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    sensor_id = db.Column(db.Integer, db.ForeignKey('Sensors.id', ondelete='CASCADE'), nullable=False)
+    resolution = db.Column(db.String(4), nullable=False)  # '1m', '1h' or '1d'
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    sum_sq = db.Column(db.Float, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+    last_value = db.Column(db.Float, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+
+    sensor = db.relationship("Sensor", back_populates="rollups")
+
+    def to_dict(self):
+        return {
+            "sensor_id": self.sensor_id,
+            "resolution": self.resolution,
+            "bucket_start": self.bucket_start.isoformat(),
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "avg": self.sum / self.count,
+            "last": self.last_value,
+        }
+
 class Alert(db.Model):
     __tablename__ = "Alerts"
+    __table_args__ = (
+        db.Index('ix_alerts_sensor_created', 'sensor_id', 'created_at', 'id'),
+        db.Index('ix_alerts_ack_severity', 'ack', 'severity'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     sensor_id = db.Column(db.Integer, db.ForeignKey("Sensors.id", ondelete="CASCADE"), nullable=False)
@@ -180,3 +265,37 @@ class Alert(db.Model):
             "created_at": self.created_at.isoformat() if self.created_at else None
         }
 
+class Alert_Rule(db.Model):
+    __tablename__ = "Alert_Rules"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sensor_id = db.Column(db.Integer, db.ForeignKey("Sensors.id", ondelete="CASCADE"), nullable=False, index=True)
+    type = db.Column(SQLEnum(RuleType, native_enum=False), nullable=False)
+    severity = db.Column(SQLEnum(SeverityLevel, native_enum=False), nullable=False, default=SeverityLevel.WARNING)
+
+    min_value = db.Column(db.Float)  # threshold: fire below
+    max_value = db.Column(db.Float)  # threshold: fire above
+    max_rate = db.Column(db.Float)  # rate: fire when |change per second| exceeds
+    timeout_seconds = db.Column(db.Integer)  # no_data: fire after this many seconds without a reading
+    hysteresis = db.Column(db.Float, nullable=False, default=0.0)  # distance back inside the limit needed to clear
+    cooldown_seconds = db.Column(db.Integer, nullable=False, default=300)  # minimum time between alerts
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=db.func.now(), nullable=False)
+
+    sensor = db.relationship("Sensor", back_populates="alert_rules")
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "sensor_id": self.sensor_id,
+            "type": self.type.value,
+            "severity": self.severity.value,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "max_rate": self.max_rate,
+            "timeout_seconds": self.timeout_seconds,
+            "hysteresis": self.hysteresis,
+            "cooldown_seconds": self.cooldown_seconds,
+            "is_active": self.is_active,
+            "created_at": self.created_at.isoformat() if self.created_at else None
+        }
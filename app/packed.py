@@ -0,0 +1,145 @@
+"""
+Compact columnar wire format for readings, used for ingest and export as an
+alternative to JSON.
+
+A payload is the 4 byte magic b"TLM1" followed by blocks. Each block holds readings
+of one sensor in one unit, little-endian:
+
+    sensor_id   uint32
+    unit_len    uint8, then unit_len bytes of the unit's ASCII value (e.g. b"cm")
+    flags       uint8, FLOAT64 when values are float64 (else float32), TIMESTAMPS when times follow
+    count       uint32
+    base_ms     int64 epoch milliseconds               (TIMESTAMPS only)
+    deltas      count x int32 milliseconds, each relative to the previous reading,
+                the first relative to base_ms          (TIMESTAMPS only)
+    values      count x float32 or float64
+
+An optional trailing CLIENT_SEQ flag adds count x uint32 client sequence numbers
+after the values. A reading costs 4-12 bytes instead of ~50 as JSON.
+
+An ingest ack is accepted, rejected and duplicates as uint32, then rejected x
+(index uint32, reason uint8) using REASONS, 255 for any other reason.
+"""
+
+from array import array
+from datetime import datetime, timedelta
+import struct
+import sys
+
+CONTENT_TYPE = "application/x-telem-packed"
+MAGIC = b"TLM1"
+
+FLOAT64 = 0x01
+TIMESTAMPS = 0x02
+CLIENT_SEQ = 0x04
+
+# Rejection reasons in acks, by position
+REASONS = ["invalid_reading", "invalid_sensor_id", "invalid_value", "invalid_unit", "invalid_timestamp",
+           "invalid_client_seq", "duplicate_client_seq", "sensor_not_found"]
+_REASON_CODES = {reason: code for code, reason in enumerate(REASONS)}
+
+_BLOCK = struct.Struct("<I")
+_COUNT = struct.Struct("<BI")
+_BASE = struct.Struct("<q")
+_ACK = struct.Struct("<III")
+_ERROR = struct.Struct("<IB")
+_EPOCH = datetime(1970, 1, 1)
+_INT32 = (-2 ** 31, 2 ** 31 - 1)
+
+def _column(typecode, payload, offset, count):
+    values = array(typecode)
+    end = offset + values.itemsize * count
+    if end > len(payload):
+        raise ValueError("Truncated block")
+    values.frombytes(payload[offset:end])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, end
+
+def decode_readings(payload):
+    """
+    Decode a packed payload into reading dicts as accepted by log_sensor_data.
+
+    Raises:
+        ValueError: If the payload is malformed
+    """
+    if payload[:4] != MAGIC:
+        raise ValueError("Not a packed readings payload")
+    readings, offset = [], 4
+    while offset < len(payload):
+        try:
+            (sensor_id,) = _BLOCK.unpack_from(payload, offset)
+            unit_len = payload[offset + 4]
+            unit = payload[offset + 5:offset + 5 + unit_len].decode("ascii")
+            offset += 5 + unit_len
+            flags, count = _COUNT.unpack_from(payload, offset)
+            offset += _COUNT.size
+            times = None
+            if flags & TIMESTAMPS:
+                (base_ms,) = _BASE.unpack_from(payload, offset)
+                deltas, offset = _column("i", payload, offset + _BASE.size, count)
+                times, moment = [], base_ms
+                for delta in deltas:
+                    moment += delta
+                    times.append(moment / 1000)
+            values, offset = _column("d" if flags & FLOAT64 else "f", payload, offset, count)
+            seqs = None
+            if flags & CLIENT_SEQ:
+                seqs, offset = _column("I", payload, offset, count)
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"Malformed block at byte {offset}: {e}")
+
+        for i, value in enumerate(values):
+            reading = {"sensor_id": sensor_id, "unit": unit, "value": value}
+            if times is not None:
+                reading["timestamp"] = times[i]
+            if seqs is not None:
+                reading["client_seq"] = seqs[i]
+            readings.append(reading)
+    return readings
+
+def _epoch_ms(moment):
+    return (moment - _EPOCH) // timedelta(milliseconds=1)
+
+def _block(sensor_id, unit, times, values):
+    unit = unit.encode("ascii")
+    header = _BLOCK.pack(sensor_id) + bytes([len(unit)]) + unit + _COUNT.pack(FLOAT64 | TIMESTAMPS, len(values))
+    deltas, previous = array("i"), times[0]
+    for moment in times:
+        deltas.append(moment - previous)
+        previous = moment
+    values = array("d", values)
+    if sys.byteorder == "big":
+        deltas.byteswap()
+        values.byteswap()
+    return header + _BASE.pack(times[0]) + deltas.tobytes() + values.tobytes()
+
+def encode_rows(rows, block_size=1000):
+    """
+    Encode Sensor_Data rows (with sensor_id, unit, value, created_at) as a packed payload.
+
+    A new block starts whenever the sensor or unit changes, block_size readings have
+    been written, or the gap between readings doesn't fit in an int32 delta.
+
+    Yields:
+        bytes: The magic, then one encoded block at a time
+    """
+    yield MAGIC
+    key, times, values = None, [], []
+    for row in rows:
+        moment = _epoch_ms(row.created_at)
+        row_key = (row.sensor_id, row.unit.value)
+        if times and (row_key != key or len(values) >= block_size or not _INT32[0] <= moment - times[-1] <= _INT32[1]):
+            yield _block(key[0], key[1], times, values)
+            times, values = [], []
+        key = row_key
+        times.append(moment)
+        values.append(row.value)
+    if times:
+        yield _block(key[0], key[1], times, values)
+
+def encode_ack(result):
+    """Encode a log_sensor_data result as a packed ack."""
+    errors = result.get("errors", [])
+    ack = _ACK.pack(result["accepted"], result["rejected"], result.get("duplicates", 0))
+    return ack + b"".join(_ERROR.pack(error["index"], _REASON_CODES.get(error["reason"], 255)) for error in errors)
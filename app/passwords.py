@@ -0,0 +1,108 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import BoundedSemaphore, Lock
+import bcrypt
+
+class PasswordPoolBusy(Exception):
+    """
+    Raised when password work can't be done right now.
+
+    status is 429 when too many hashes are already pending and 503 when a hash
+    didn't finish within the pool's timeout. retry_after is in seconds.
+    """
+
+    def __init__(self, status, retry_after):
+        super().__init__(f"Password pool busy ({status})")
+        self.status = status
+        self.retry_after = retry_after
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds)).decode('utf-8')
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password, password_hash)
+
+
+class PasswordPool:
+    """
+    Runs bcrypt hashes on a small pool of worker processes so a burst of logins
+    can't tie up the threads serving every other route.
+
+    At most max_pending hashes are queued or running at once, beyond that calls
+    fail fast with PasswordPoolBusy instead of queueing behind each other. The
+    executor is created on first use so it's never inherited across a fork by
+    pre-forking servers, and replaced when a worker dies and breaks it. With
+    workers=0 hashes run inline on the calling thread.
+    """
+
+    def __init__(self, workers=2, max_pending=32, rounds=12, timeout=10):
+        self.workers = workers
+        self.rounds = rounds
+        self.timeout = timeout
+        self._slots = BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _discard(self, executor):
+        """Shut down a broken executor, the next call creates a new one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+        try:
+            return self._submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (OOM kill, segfault) and took the executor with it, retry once on a new one
+            try:
+                return self._submit(fn, *args)
+            except BrokenProcessPool:
+                raise PasswordPoolBusy(503, retry_after=1)
+
+    def _submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordPoolBusy(429, retry_after=1)
+
+        # The slot is freed when the hash actually finishes, not when we stop waiting on it
+        executor = self._get_executor()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._slots.release()
+            self._discard(executor)
+            raise
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise PasswordPoolBusy(503, retry_after=max(1, int(self.timeout)))
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+    def hash(self, password):
+        """Return the bcrypt hash of password (str) at the configured cost factor."""
+        return self._run(_hash, password.encode('utf-8'), self.rounds)
+
+    def check(self, password, password_hash):
+        """Return True if password (str) matches password_hash, at whatever cost it was hashed with."""
+        return self._run(_check, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
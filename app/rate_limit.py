@@ -0,0 +1,154 @@
+"""
+Token bucket rate limiting of ingest, so one misbehaving device can't take every worker
+and database connection from other tenants.
+
+Each budget is a bucket of up to burst tokens refilled at rate tokens per second. A
+request costs one token from its user's request bucket and each accepted reading one
+token from its user's and its sensor's row buckets. A request only goes through when every bucket
+it draws from can pay, otherwise nothing is charged and the caller is told how long to
+wait.
+
+A cost larger than a bucket's burst is let through once the bucket is full and leaves
+it in debt, so big batches are slowed to the same rows/sec as small ones rather than
+refused forever.
+"""
+
+from collections import OrderedDict
+from threading import Lock, local
+import math
+import sqlite3
+import time
+
+def _take(states, buckets, now):
+    """
+    Charge buckets given their current states, all or nothing.
+
+    Args:
+        states (dict): {key: (tokens, updated)} of buckets seen before, missing buckets are full
+        buckets (list): (key, rate, burst, cost) tuples
+        now (Float): Current time in the states' clock
+
+    Returns:
+        tuple: (seconds to wait, {key: (tokens, updated)} to store), nothing to store when waiting
+    """
+    wait, charged = 0.0, {}
+    for key, rate, burst, cost in buckets:
+        tokens, updated = states.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        needed = min(cost, burst)
+        if tokens < needed:
+            wait = max(wait, (needed - tokens) / rate)
+        charged[key] = (tokens - cost, now)
+    return (wait, {}) if wait else (0.0, charged)
+
+
+class MemoryStore:
+    """Buckets held in this process, the least recently used dropped (refilled) past maxsize."""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, buckets):
+        with self._lock:
+            wait, charged = _take(self._buckets, buckets, time.monotonic())
+            for key, state in charged.items():
+                self._buckets[key] = state
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SQLiteStore:
+    """
+    Buckets in an SQLite file shared by every worker process on the host, so budgets
+    hold per user rather than per worker. Any object with the same take(buckets) can
+    replace it, e.g. one backed by a networked store shared across hosts.
+
+    Buckets idle for an hour are full again and are purged every purge_every takes.
+    Buckets are read in chunks of at most 500 keys to stay under SQLite's variable limit.
+    """
+
+    def __init__(self, path, purge_every=10000):
+        self.path = path
+        self.purge_every = purge_every
+        self._takes = 0
+        self._local = local()
+        self._connect().execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")
+            self._local.connection = connection
+        return connection
+
+    def take(self, buckets):
+        connection = self._connect()
+        keys = [bucket[0] for bucket in buckets]
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            states = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = connection.execute(f"SELECT key, tokens, updated FROM buckets WHERE key IN ({','.join('?' * len(chunk))})", chunk)
+                states.update((key, (tokens, updated)) for key, tokens, updated in rows)
+            wait, charged = _take(states, buckets, time.time())
+            connection.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                                   [(key, tokens, updated) for key, (tokens, updated) in charged.items()])
+            self._takes += 1
+            if self._takes % self.purge_every == 0:
+                connection.execute("DELETE FROM buckets WHERE updated < ?", (time.time() - 3600,))
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return wait
+
+
+class RateLimiter:
+    """
+    Requests/sec per user, and rows/sec per user and per sensor, drawn from a store's
+    buckets. A rate of 0 disables that budget.
+    """
+
+    def __init__(self, store, requests_per_second=0, request_burst=0, rows_per_second=0, row_burst=0,
+                 sensor_rows_per_second=0, sensor_row_burst=0):
+        self.store = store
+        self.requests = (requests_per_second, request_burst or requests_per_second)
+        self.rows = (rows_per_second, row_burst or rows_per_second)
+        self.sensor_rows = (sensor_rows_per_second, sensor_row_burst or sensor_rows_per_second)
+
+    def check(self, user_id, rows=(), request=True):
+        """
+        Charge one request (unless request=False) and the given rows to their user and
+        sensors.
+
+        Rows must be validated rows on sensors the user owns (see sensor_service.owned_rows),
+        so the number of sensor buckets is bounded by the sensors that exist rather than by
+        whatever ids clients send.
+
+        Returns:
+            float: 0 if the budgets were charged, else seconds until they could be
+        """
+        buckets = []
+        if request and self.requests[0]:
+            buckets.append((f"requests:user:{user_id}", *self.requests, 1))
+        if rows and self.rows[0]:
+            buckets.append((f"rows:user:{user_id}", *self.rows, len(rows)))
+        if rows and self.sensor_rows[0]:
+            per_sensor = {}
+            for row in rows:
+                per_sensor[row["sensor_id"]] = per_sensor.get(row["sensor_id"], 0) + 1
+            # Keyed under the user too, so a sensor changing owner starts with a fresh budget
+            buckets.extend((f"rows:sensor:{user_id}:{sensor_id}", *self.sensor_rows, count) for sensor_id, count in per_sensor.items())
+        return self.store.take(buckets) if buckets else 0.0
+
+    @staticmethod
+    def retry_after(wait):
+        """Whole seconds for a Retry-After header."""
+        return max(1, math.ceil(wait))
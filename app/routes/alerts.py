@@ -1,18 +1,163 @@
-from flask import Blueprint
+from flask import Blueprint, jsonify, request, current_app, g
+from app.decorators import user_required
+from app.services import alert_service
+from app.models import RuleType, SeverityLevel
+from app.utils import *
 
 alert_bp = Blueprint('alert', __name__, url_prefix='/api/alerts')
 
+# POST
+@alert_bp.route('/rules', methods=['POST'])
+@user_required
+def create_rule():
+    user_id = g.user['id']
+
+    data = request.get_json() or {}
+    try:
+        type = RuleType(data.get('type'))
+        severity = SeverityLevel(data.get('severity', SeverityLevel.WARNING.value))
+    except ValueError:
+        return jsonify({'error': f'type must be one of {[t.value for t in RuleType]} and severity one of {[s.value for s in SeverityLevel]}'}), 400
+
+    sensor_id = to_int(data.get('sensor_id'))
+    is_valid_min, min_value = to_float(data.get('min_value'))
+    is_valid_max, max_value = to_float(data.get('max_value'))
+    is_valid_rate, max_rate = to_float(data.get('max_rate'))
+    is_valid_hysteresis, hysteresis = to_float(data.get('hysteresis', 0))
+    timeout_seconds = to_int(data.get('timeout_seconds'))
+    cooldown_seconds = to_int(data.get('cooldown_seconds', 300))
+
+    if not sensor_id:
+        return jsonify({'error': 'A valid sensor_id must be provided'}), 400
+    if not (is_valid_min and is_valid_max and is_valid_rate and is_valid_hysteresis) or timeout_seconds is None or cooldown_seconds is None:
+        return jsonify({'error': 'Rule limits must be valid numbers'}), 400
+
+    rule = alert_service.create_rule(user_id=user_id, sensor_id=sensor_id, type=type, severity=severity,
+                                     min_value=min_value, max_value=max_value, max_rate=max_rate,
+                                     timeout_seconds=timeout_seconds or None, hysteresis=hysteresis or 0.0,
+                                     cooldown_seconds=cooldown_seconds)
+    if 'error' in rule:
+        return jsonify(rule), rule['code']
+    return jsonify(rule)
+
+# GET
+@alert_bp.route('/rules', methods=['GET'])
+@user_required
+def get_rules():
+    user_id = g.user['id']
+
+    rules = alert_service.get_rules(user_id, sensor_id=request.args.get('sensor_id', type=int))
+    if rules is None:
+        return jsonify({'error': 'Error fetching alert rules'}), 500
+    return jsonify(rules)
+
+# DELETE
+@alert_bp.route('/rules/<rule_id>', methods=['DELETE'])
+@user_required
+def delete_rule(rule_id=None):
+    user_id = g.user['id']
+
+    if not alert_service.delete_rule(user_id, rule_id):
+        return jsonify({'error': 'Alert rule does not exist'}), 404
+    return jsonify({'msg': f'Alert rule {rule_id} has been deleted'})
+
+def get_alert_filters(source):
+    """
+    Parse alert filters from query args or a JSON object.
+
+    Returns:
+        dict: sensor_id, severity, ack, since, until and cursor, None where not provided
+        dict: {"error": str} if a filter is invalid
+    """
+    filters = {'cursor': source.get('cursor')}
+
+    filters['sensor_id'] = to_int(source.get('sensor_id')) or None
+    if source.get('sensor_id') is not None and not filters['sensor_id']:
+        return {'error': 'sensor_id must be an integer'}
+
+    try:
+        filters['severity'] = SeverityLevel(source['severity']) if source.get('severity') else None
+    except ValueError:
+        return {'error': f'severity must be one of {[s.value for s in SeverityLevel]}'}
+
+    ack = source.get('ack')
+    if ack is None or isinstance(ack, bool):
+        filters['ack'] = ack
+    elif str(ack).lower() in ('true', 'false'):
+        filters['ack'] = str(ack).lower() == 'true'
+    else:
+        return {'error': 'ack must be true or false'}
+
+    is_valid_since, filters['since'] = to_datetime(source.get('since'))
+    is_valid_until, filters['until'] = to_datetime(source.get('until'))
+    if not is_valid_since or not is_valid_until:
+        return {'error': 'since and until must be ISO 8601 timestamps'}
+    return filters
+
 # GET
-@alert_bp.route('')
+@alert_bp.route('', methods=['GET'])
+@user_required
 def get_alerts():
-    pass
+    user_id = g.user['id']
+
+    filters = get_alert_filters(request.args)
+    if 'error' in filters:
+        return jsonify(filters), 400
+    limit = to_int(request.args.get('limit'))
+    if limit is None:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    limit = min(limit or current_app.config['ALERT_PAGE_SIZE'], current_app.config['ALERT_MAX_PAGE_SIZE'])
+
+    alerts = alert_service.get_alerts(user_id, filters, limit=limit)
+    if 'error' in alerts:
+        return jsonify(alerts), alerts['code']
+    return jsonify(alerts)
+
+# POST
+@alert_bp.route('/ack', methods=['POST'])
+@user_required
+def ack_alerts():
+    user_id = g.user['id']
+
+    data = request.get_json() or {}
+    if 'ids' in data:
+        ids = data['ids']
+        if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+            return jsonify({'error': 'ids must be a list of alert ids'}), 400
+        result = alert_service.ack_alerts(user_id, alert_ids=ids)
+    else:
+        filters = get_alert_filters(data.get('filters') or {})
+        if 'error' in filters:
+            return jsonify(filters), 400
+        result = alert_service.ack_alerts(user_id, filters=filters)
+
+    if 'error' in result:
+        return jsonify(result), result['code']
+    return jsonify(result)
 
 # GET
-@alert_bp.route('/<id>')
+@alert_bp.route('/<id>', methods=['GET'])
+@user_required
 def get_alert(id=None):
-    pass
+    user_id = g.user['id']
+
+    alert = alert_service.get_alert(user_id, id)
+    if not alert:
+        return jsonify({'error': 'Alert does not exist'}), 404
+    return jsonify(alert)
 
 # PUT
-@alert_bp.route('/<id>/ack')
+@alert_bp.route('/<id>/ack', methods=['PUT'])
+@user_required
 def ack_alert(id=None):
-    pass
\ No newline at end of file
+    user_id = g.user['id']
+
+    if not id or not id.isnumeric():
+        return jsonify({'error': 'Invalid alert id'}), 400
+
+    result = alert_service.ack_alerts(user_id, alert_ids=[int(id)])
+    if 'error' in result:
+        return jsonify(result), result['code']
+    if not result['acknowledged'] and not alert_service.get_alert(user_id, id):
+        return jsonify({'error': 'Alert does not exist'}), 404
+    return jsonify(alert_service.get_alert(user_id, id))
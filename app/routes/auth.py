@@ -1,21 +1,21 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g
 from app.services import auth_service
 from app.extensions import jwt
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.decorators import user_required
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
 
+def busy_response(result):
+    """Response for when password hashing is saturated, telling the client when to retry."""
+    response = jsonify({'error': result['error']})
+    response.headers['Retry-After'] = str(result['retry_after'])
+    return response, result['code']
+
 # GET
 @auth_bp.route('/me')
-@jwt_required()
+@user_required
 def get_user():
-    id = get_jwt_identity()
-    user = auth_service.get_user(id)
-    
-    if not user:
-        return jsonify({'error': 'User does not exist'})
-    
-    return jsonify(user)
+    return jsonify(g.user)
 
 # POST
 @auth_bp.route('/login', methods=['POST'])
@@ -29,6 +29,8 @@ def login():
     
     # Verify account
     token = auth_service.authenticate_user(username, password)
+    if isinstance(token, dict) and 'retry_after' in token:
+        return busy_response(token)
     if 'error' in token:
         return jsonify({'error': 'Invalid email or password'}), 401
 
@@ -45,6 +47,8 @@ def register():
         return jsonify({'error': f'Email, username, and password are required'})
     
     error = auth_service.register_user(email=email, username=username, password=password)
+    if 'retry_after' in error:
+        return busy_response(error)
     if 'error' in error:
         return jsonify(error)
     return jsonify({'message': f'User has been registered successfully'})
\ No newline at end of file
@@ -0,0 +1,19 @@
+from flask import Blueprint, jsonify
+from app.extensions import db
+from app.database import pool_status
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+health_bp = Blueprint('health', __name__, url_prefix='/api/health')
+
+# GET
+@health_bp.route('', methods=['GET'])
+def health():
+    try:
+        db.session.execute(text('SELECT 1'))
+        database_ok = True
+    except SQLAlchemyError:
+        database_ok = False
+
+    status = {'status': 'ok' if database_ok else 'degraded', 'database': database_ok, 'pools': pool_status(db)}
+    return jsonify(status), 200 if database_ok else 503
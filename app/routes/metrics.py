@@ -0,0 +1,9 @@
+from flask import Blueprint, Response
+from app import metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+# GET
+@metrics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
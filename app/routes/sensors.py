@@ -1,21 +1,116 @@
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.services import auth_service, sensor_service
-from app.models import Sensor
+from flask import Blueprint, jsonify, request, Response, current_app, stream_with_context, g
+from app.decorators import user_required, sensor_owner_required
+from app.services import sensor_service, stream_service, rollup_service, export_service, geo_service
+from app import packed, compression
+from werkzeug.wsgi import get_input_stream
 from app.utils import *
 
 sensor_bp = Blueprint('sensors', __name__, url_prefix='/api/sensors/')
 
+@sensor_bp.before_request
+def use_read_replica():
+    """Serve reads from DATABASE_READ_URL when one is configured, see RoutingSession."""
+    if request.method == 'GET':
+        g.read_replica = True
+
+@sensor_bp.before_request
+def decode_request_body():
+    """Decompress gzip request bodies (Content-Encoding: gzip) as the route reads them."""
+    encoding = request.headers.get('Content-Encoding', '').strip().lower()
+    if encoding in ('', 'identity'):
+        return
+    if encoding not in compression.ENCODINGS:
+        return jsonify({'error': f'Unsupported Content-Encoding {encoding}'}), 415
+
+    # The compressed body is still bounded by MAX_CONTENT_LENGTH, the routes then see a body of unknown length
+    environ = request.environ
+    max_size = None if request.endpoint == 'sensors.stream_sensor_data' else current_app.config['MAX_DECOMPRESSED_LENGTH']
+    raw = get_input_stream(environ, max_content_length=request.max_content_length)
+    environ['wsgi.input'] = compression.decoded_stream(raw, max_size=max_size)
+    environ['wsgi.input_terminated'] = True
+    environ.pop('CONTENT_LENGTH', None)
+    environ.pop('HTTP_CONTENT_ENCODING', None)
+
+@sensor_bp.errorhandler(compression.EncodedBodyError)
+def encoded_body_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+def rate_limited_response(result):
+    """429 for a request over its ingest budget, telling the client when to retry."""
+    response = jsonify({'error': result['error'], 'retry_after': result['retry_after']})
+    response.headers['Retry-After'] = str(result['retry_after'])
+    return response, result['code']
+
+def parse_geo_filters(args):
+    """
+    Parse spatial filters: bbox=min_lat,min_lon,max_lat,max_lon, or lat and lon with
+    radius_km (within a radius) or k (k nearest).
+
+    Returns:
+        dict: {} when no spatial filter is given, else {"bbox": (...)}, {"near": (lat, lon), "radius_km": float}
+        or {"near": (lat, lon), "k": int}
+        dict: {"error": str} if a filter is invalid
+    """
+    if args.get('bbox'):
+        parts = str(args['bbox']).split(',')
+        values = [to_float(part.strip() or None) for part in parts]
+        if len(parts) != 4 or not all(is_valid and value is not None for is_valid, value in values):
+            return {'error': 'bbox must be min_lat,min_lon,max_lat,max_lon'}
+        min_lat, min_lon, max_lat, max_lon = (value for _, value in values)
+        if not -90 <= min_lat <= max_lat <= 90 or not -180 <= min_lon <= 180 or not -180 <= max_lon <= 180:
+            return {'error': 'bbox must be min_lat,min_lon,max_lat,max_lon in degrees'}
+        return {'bbox': (min_lat, min_lon, max_lat, max_lon)}
+
+    if args.get('lat') is None and args.get('lon') is None:
+        return {}
+    is_valid_lat, lat = to_float(args.get('lat'))
+    is_valid_lon, lon = to_float(args.get('lon'))
+    if not is_valid_lat or not is_valid_lon or lat is None or lon is None or not -90 <= lat <= 90 or not -180 <= lon <= 180:
+        return {'error': 'lat and lon must be coordinates in degrees'}
+
+    if args.get('radius_km') is not None:
+        is_valid, radius_km = to_float(args['radius_km'])
+        if not is_valid or not radius_km or radius_km <= 0:
+            return {'error': 'radius_km must be a positive number'}
+        return {'near': (lat, lon), 'radius_km': radius_km}
+
+    k = to_int(args.get('k'))
+    max_k = current_app.config['GEO_MAX_K']
+    if not k or not 0 < k <= max_k:
+        return {'error': f'lat and lon need radius_km, or k between 1 and {max_k}'}
+    return {'near': (lat, lon), 'k': k}
+
+def find_sensors_by_location(user_id, filters):
+    config = current_app.config
+    return geo_service.find_by_location(user_id, filters, start_km=config['GEO_KNN_START_KM'], max_cells=config['GEO_MAX_CELLS'])
+
+def get_data_filters():
+    """
+    Collect data filters from the JSON body's "filters" object, falling back to query args.
+
+    Returns:
+        dict: Filters with days/hours/mins/limit as integers
+        dict: {"error": str} if a numeric filter is invalid
+    """
+    data = request.get_json(silent=True) or {}
+    filters = request.args.to_dict()
+    filters.update(data.get('filters') or {})
+    return parse_data_filters(filters)
+
+def parse_data_filters(filters):
+    """Convert days/hours/mins/limit in a dict of raw filters to integers, see get_data_filters."""
+    for key in ('days', 'hours', 'mins', 'limit'):
+        filters[key] = to_int(filters.get(key, 0))
+        if filters[key] is None or filters[key] < 0:
+            return {'error': f'{key} must be a non-negative integer'}
+    return filters
+
 # POST 
 @sensor_bp.route('', methods=['POST'])
-@jwt_required()
+@user_required
 def create_sensor():
-    user_id = get_jwt_identity()
-    user = auth_service.get_user(user_id)
+    user_id = g.user['id']
 
-    if not user:
-        return jsonify({'error': 'User does not exist'})
-    
     data = request.get_json()
     type = data.get('type')
     is_valid_lat, latitude = to_float(data.get('latitude'))
@@ -40,14 +135,20 @@ def create_sensor():
 
 # GET
 @sensor_bp.route('', methods=['GET'])
-@jwt_required()
+@user_required
 def get_sensors():
-    user_id = get_jwt_identity()
-    user = auth_service.get_user(user_id)
+    user_id = g.user['id']
+
+    # Viewport (bbox), radius or nearest-k lookups go through the geohash index
+    geo_filters = parse_geo_filters(request.args)
+    if 'error' in geo_filters:
+        return jsonify(geo_filters), 400
+    if geo_filters:
+        sensors = find_sensors_by_location(user_id, geo_filters)
+        if isinstance(sensors, dict):
+            return jsonify(sensors), sensors['code']
+        return jsonify(sensors)
 
-    if not user:
-        return jsonify({'error': 'User does not exist'})    
-    
     sensors = sensor_service.get_sensors(user_id)
     if sensors is None:
         return jsonify({'error': f'Error fetching sensors'}), 500
@@ -56,40 +157,81 @@ def get_sensors():
 
 # GET
 @sensor_bp.route('/<sensor_id>', methods=['GET'])
-@jwt_required()
+@sensor_owner_required
 def get_sensor(sensor_id=None):
-    user_id = get_jwt_identity()
-    user = auth_service.get_user(user_id)
-    if not sensor_id or not sensor_id.isnumeric():
-        return jsonify({'error': f'Invalid sensor id'})
-
-    if not user:
-        return jsonify({'error': 'User does not exist'}) 
-    if not Sensor.query.filter_by(user_id=user_id, id=sensor_id).first():
-        return jsonify({'error': 'Sensor does not exist'})    
-    
-    sensor = sensor_service.get_sensor(user_id)
+    sensor = sensor_service.get_sensor(sensor_id)
     if not sensor:
         return jsonify({'error': f'Error fetching sensor'}), 500
     
     return jsonify(sensor)
 
-# TODO - GET all data for every sensor
+# GET
+@sensor_bp.route('/data', methods=['GET'])
+@user_required
+def get_many_sensor_data():
+    user_id = g.user['id']
+
+    filters = get_data_filters()
+    if 'error' in filters:
+        return jsonify(filters), 400
+    if not any(filters.get(key) for key in ('days', 'hours', 'mins')):
+        return jsonify({'error': 'A days, hours or mins window is required'}), 400
+
+    # sensor_ids in the JSON body or repeated sensor_id args, all of the user's sensors if neither is given
+    data = request.get_json(silent=True) or {}
+    sensor_ids = data.get('sensor_ids', request.args.getlist('sensor_id')) or None
+    if sensor_ids is not None:
+        if not isinstance(sensor_ids, list) or not all(str(sensor_id).isnumeric() for sensor_id in sensor_ids):
+            return jsonify({'error': 'sensor_ids must be a list of sensor ids'}), 400
+        sensor_ids = [int(sensor_id) for sensor_id in sensor_ids]
+
+    # Or the sensors in a bbox, radius or nearest k
+    geo_filters = parse_geo_filters(filters)
+    if 'error' in geo_filters:
+        return jsonify(geo_filters), 400
+    if geo_filters and sensor_ids is None:
+        sensors = find_sensors_by_location(user_id, geo_filters)
+        if isinstance(sensors, dict):
+            return jsonify(sensors), sensors['code']
+        sensor_ids = [sensor['id'] for sensor in sensors]
+
+    config = current_app.config
+    if sensor_ids and len(sensor_ids) > config['SENSOR_FANOUT_MAX_SENSORS']:
+        return jsonify({'error': f"At most {config['SENSOR_FANOUT_MAX_SENSORS']} sensors can be read at once"}), 400
+
+    limit = min(filters['limit'] or config['SENSOR_FANOUT_PAGE_SIZE'], config['SENSOR_DATA_MAX_PAGE_SIZE'])
+    sensor_data = sensor_service.get_many_sensor_data(user_id=user_id, sensor_ids=sensor_ids, filters=filters, limit=limit)
+    if 'error' in sensor_data:
+        return jsonify(sensor_data), sensor_data['code']
+    return jsonify(sensor_data)
+
+# GET
+@sensor_bp.route('/export', methods=['GET'])
+@user_required
+def export_sensor_data():
+    user_id = g.user['id']
+
+    sensor_ids = request.args.getlist('sensor_id', type=int)
+    is_valid_since, since = to_datetime(request.args.get('since'))
+    is_valid_until, until = to_datetime(request.args.get('until'))
+    if not is_valid_since or not is_valid_until:
+        return jsonify({'error': 'since and until must be ISO 8601 timestamps'}), 400
+
+    format = request.args.get('format', 'csv')
+    chunks = export_service.export_sensor_data(user_id=user_id, sensor_ids=sensor_ids, since=since, until=until,
+                                               format=format, chunk_size=current_app.config['EXPORT_CHUNK_SIZE'])
+    if isinstance(chunks, dict):
+        return jsonify(chunks), chunks['code']
+
+    extension = 'arrows' if format == 'arrow' else format
+    headers = {'Content-Disposition': f'attachment; filename=sensor-data.{extension}'}
+    return Response(stream_with_context(chunks), mimetype=export_service.FORMATS[format], headers=headers)
 
 # PUT
 @sensor_bp.route('/<sensor_id>', methods=['PUT'])
-@jwt_required()
+@sensor_owner_required
 def update_sensor(sensor_id):
-    id = get_jwt_identity()
-    user = auth_service.get_user(id)
     data = request.get_json()
-
-    if sensor_id is None or not sensor_id.isnumeric():
-        return jsonify({'error': f'Invalid sensor id'})
-    if not user:
-        return jsonify({'error': 'User does not exist'})   
-    if not sensor_id or not Sensor.query.filter_by(id=sensor_id, user_id=id).first():
-        return jsonify({'error': 'Sensor does not exist'})   
     
     type = data.get('type')
     is_valid_lat, latitude = to_float(data.get('latitude'))
@@ -101,8 +243,14 @@ def update_sensor(sensor_id):
         return jsonify({'error': 'Latitude ang longitude coordinates must be valid numbers'})
     if not is_valid_active:
         return jsonify({'error': 'is_active must be "true" or "false"'})
+
+    retention_days = data.get('retention_days')
+    if retention_days is not None:
+        retention_days = to_int(retention_days)
+        if retention_days is None or retention_days < 1:
+            return jsonify({'error': 'retention_days must be a positive integer'})
     
-    update_sensor_request = {'type': type, 'latitude': latitude, 'longitude': longitude, 'is_active': is_active, 'description': description}
+    update_sensor_request = {'type': type, 'latitude': latitude, 'longitude': longitude, 'is_active': is_active, 'description': description, 'retention_days': retention_days}
     updated_sensor = sensor_service.update_sensor(sensor_id, update_sensor_request)
 
     if not updated_sensor:
@@ -112,17 +260,9 @@ def update_sensor(sensor_id):
 
 # DELETE
 @sensor_bp.route('/<sensor_id>', methods=['DELETE'])
-@jwt_required()
+@sensor_owner_required
 def remove_sensor(sensor_id=None):
-    id = get_jwt_identity()
-    user = auth_service.get_user(id)
-
-    if not user:
-        return jsonify({'error': 'User does not exist'}) 
-    if not sensor_id or not Sensor.query.filter_by(id=sensor_id, user_id=id).first():
-        return jsonify({'error': 'Sensor does not exist'})
-    
-    deleted = sensor_service.delete_sensor(sensor_id)
+    deleted = sensor_service.delete_sensor(sensor_id, batch_size=current_app.config['SENSOR_DATA_DELETE_BATCH'])
     if not deleted:
         return jsonify('error' f'Error deleting sensor'), 500
     
@@ -130,68 +270,172 @@ def remove_sensor(sensor_id=None):
 
 # POST 
 @sensor_bp.route('/data', methods=['POST'])
-@jwt_required()
+@user_required
 def add_sensor_data():
-    user_id = get_jwt_identity()
-    user = auth_service.get_user(user_id)
+    user_id = g.user['id']
+    if request.mimetype == packed.CONTENT_TYPE:
+        return add_packed_sensor_data(user_id)
     data = request.get_json()
     
-    if not user:
-        return jsonify({'error': 'User does not exist'})
-    if not data['readings']:
+    if not data or not data.get('readings'):
         return jsonify({'error': 'No readings provided'})
+    if not isinstance(data['readings'], list):
+        return jsonify({'error': 'Readings must be a list'})
+
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 128:
+        return jsonify({'error': 'Idempotency-Key must be 1 to 128 characters'}), 400
+
+    # Rows are charged once parsed, so only sensors the user owns get a budget of their own
+    limited = sensor_service.check_rate_limit(user_id)
+    if limited:
+        return rate_limited_response(limited)
 
-    data_log = sensor_service.log_sensor_data(user_id=user_id, data=data['readings'])
+    data_log = sensor_service.log_sensor_data(user_id=user_id, data=data['readings'], idempotency_key=idempotency_key)
 
+    if data_log.get('code') == 429:
+        return rate_limited_response(data_log)
     if 'error' in data_log:
         return jsonify(data_log), 500
     
-    return jsonify(data_log)
+    return jsonify(data_log), 202 if data_log.get('queued') else 200
+
+def add_packed_sensor_data(user_id):
+    """Ingest a packed payload (see app/packed.py) and reply with a packed ack."""
+    try:
+        readings = packed.decode_readings(request.get_data())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not readings:
+        return jsonify({'error': 'No readings provided'}), 400
+
+    limited = sensor_service.check_rate_limit(user_id)
+    if limited:
+        return rate_limited_response(limited)
+
+    data_log = sensor_service.log_sensor_data(user_id=user_id, data=readings, idempotency_key=request.headers.get('Idempotency-Key'))
+    if data_log.get('code') == 429:
+        return rate_limited_response(data_log)
+    if 'error' in data_log:
+        return jsonify(data_log), 500
+    return Response(packed.encode_ack(data_log), status=202 if data_log.get('queued') else 200, mimetype=packed.CONTENT_TYPE)
+
+# POST
+@sensor_bp.route('/data/stream', methods=['POST'])
+@user_required
+def stream_sensor_data():
+    user_id = g.user['id']
+
+    # Opening a stream costs a request, its readings are paced to the row budgets as they arrive
+    limited = sensor_service.check_rate_limit(user_id)
+    if limited:
+        return rate_limited_response(limited)
+
+    config = current_app.config
+    acks = stream_service.ingest_stream(
+        user_id=user_id,
+        stream=request.stream,
+        batch_size=config['INGEST_STREAM_BATCH_SIZE'],
+        flush_interval=config['INGEST_STREAM_FLUSH_SECONDS'],
+        queue_size=config['INGEST_STREAM_QUEUE_SIZE'],
+        max_line=config['INGEST_STREAM_MAX_LINE'],
+    )
+    return Response(stream_with_context(acks), mimetype='application/x-ndjson')
 
 # GET
 @sensor_bp.route('/<sensor_id>/data', methods=['GET'])
-@jwt_required()
+@sensor_owner_required
 def get_sensor_data(sensor_id=None):
-    user_id = get_jwt_identity()
-    user = auth_service.get_user(user_id)
+    user_id = g.user['id']
     
-    if not user:
-        return jsonify({'error': 'User does not exist'})
-    filters = request.get_json()['filters']
-        
-    days = to_int(filters.get('days', 0))
-    hours = to_int(filters.get('hours', 0))
-    mins = to_int(filters.get('mins', 0))
-    
-    filters['days'] = days 
-    filters['hours'] = hours
-    filters['mins'] = mins 
-    
-    sensor_data = sensor_service.get_sensor_data(user_id=user_id, sensor_id=sensor_id, filters=filters)
+    filters = get_data_filters()
+    if 'error' in filters:
+        return jsonify(filters), 400
+
+    config = current_app.config
+    if str(filters.get('summary_only', '')).lower() in ('1', 'true'):
+        percentiles = []
+        for p in str(filters.get('percentiles', '50,90,99')).split(','):
+            is_valid, p = to_float(p.strip() or None)
+            if not is_valid or p is None or not 0 <= p <= 100:
+                return jsonify({'error': 'percentiles must be numbers between 0 and 100'}), 400
+            percentiles.append(p)
+        summary = sensor_service.summarize_sensor_data(user_id=user_id, sensor_id=sensor_id, filters=filters, percentiles=percentiles)
+        if 'error' in summary:
+            return jsonify(summary), summary['code']
+        return jsonify(summary)
+
+    if filters.get('format') == 'ndjson':
+        lines = sensor_service.stream_sensor_data(user_id=user_id, sensor_id=sensor_id, filters=filters, chunk_size=config['SENSOR_DATA_STREAM_CHUNK'])
+        if isinstance(lines, dict):
+            return jsonify(lines), lines['code']
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+
+    if filters.get('format') == 'packed' or request.accept_mimetypes.best == packed.CONTENT_TYPE:
+        blocks = sensor_service.stream_sensor_data(user_id=user_id, sensor_id=sensor_id, filters=filters, chunk_size=config['SENSOR_DATA_STREAM_CHUNK'], encoding='packed')
+        if isinstance(blocks, dict):
+            return jsonify(blocks), blocks['code']
+        return Response(stream_with_context(blocks), mimetype=packed.CONTENT_TYPE)
+
+    limit = filters['limit'] or config['SENSOR_DATA_PAGE_SIZE']
+    limit = min(limit, config['SENSOR_DATA_MAX_PAGE_SIZE'])
+    sensor_data = sensor_service.get_sensor_data(user_id=user_id, sensor_id=sensor_id, filters=filters, limit=limit)
+    if 'error' in sensor_data:
+        return jsonify(sensor_data), sensor_data['code']
     return jsonify(sensor_data)
 
+# GET
+@sensor_bp.route('/<sensor_id>/latest', methods=['GET'])
+@sensor_owner_required
+def get_latest_sensor_data(sensor_id=None):
+    user_id = g.user['id']
+
+    latest = sensor_service.get_latest_sensor_data(user_id=user_id, sensor_id=sensor_id)
+    if 'error' in latest:
+        return jsonify(latest), latest['code']
+    return jsonify(latest)
+
+# GET
+@sensor_bp.route('/<sensor_id>/data/rollup', methods=['GET'])
+@sensor_owner_required
+def get_sensor_data_rollup(sensor_id=None):
+    user_id = g.user['id']
+
+    filters = get_data_filters()
+    if 'error' in filters:
+        return jsonify(filters), 400
+
+    config = current_app.config
+    if filters.get('mode') == 'lttb':
+        points = to_int(filters.get('points')) or config['LTTB_DEFAULT_POINTS']
+        if points < 3:
+            return jsonify({'error': 'points must be an integer of at least 3'}), 400
+        points = min(points, config['LTTB_MAX_POINTS'])
+        rollup = rollup_service.get_downsampled(user_id=user_id, sensor_id=sensor_id, filters=filters, points=points, chunk_size=config['SENSOR_DATA_STREAM_CHUNK'])
+    else:
+        bucket = filters.get('bucket', '1m')
+        if bucket not in rollup_service.BUCKETS:
+            return jsonify({'error': f'bucket must be one of {list(rollup_service.BUCKETS)}'}), 400
+        rollup = rollup_service.get_rollup(user_id=user_id, sensor_id=sensor_id, filters=filters, bucket=bucket)
+
+    if 'error' in rollup:
+        return jsonify(rollup), rollup['code']
+    return jsonify(rollup)
+
 # DELETE
 @sensor_bp.route('/<sensor_id>/data/<data_id>', methods=['DELETE'])
-@jwt_required()
+@sensor_owner_required
 def remove_sensor_data(sensor_id=None, data_id=None):
-    user_id = get_jwt_identity()
-    user = auth_service.get_user(user_id)
-    
-    if not user:
-        return jsonify({'error': 'User does not exist'}) 
-    
+    user_id = g.user['id']
+
     deleted_data = sensor_service.remove_sensor_data(user_id=user_id, sensor_id=sensor_id, data_id=data_id)
     return jsonify(deleted_data)
 
 # DELETE
 @sensor_bp.route('/<sensor_id>/data', methods=['DELETE'])
-@jwt_required()
+@sensor_owner_required
 def remove_all_sensor_data(sensor_id=None):
-    user_id = get_jwt_identity()
-    user = auth_service.get_user(user_id)
-    
-    if not user:
-        return jsonify({'error': 'User does not exist'}) 
-    
-    deleted_data = sensor_service.remove_all_sensor_data(user_id=user_id, sensor_id=sensor_id)
+    user_id = g.user['id']
+
+    deleted_data = sensor_service.remove_all_sensor_data(user_id=user_id, sensor_id=sensor_id, batch_size=current_app.config['SENSOR_DATA_DELETE_BATCH'])
     return jsonify(deleted_data)
\ No newline at end of file
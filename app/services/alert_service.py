@@ -0,0 +1,316 @@
+from app.extensions import db
+from app.models import Sensor, Sensor_Data, Alert, Alert_Rule, RuleType, SeverityLevel
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from app.services import auth_service
+from app.services.sensor_service import encode_cursor, decode_cursor
+from sqlalchemy import insert, update, select, func, or_, and_, text, false
+from app.logger import logger
+from app.utils import *
+from flask import current_app
+from datetime import datetime, timedelta
+
+def create_rule(user_id, sensor_id, type, severity=SeverityLevel.WARNING, min_value=None, max_value=None,
+                max_rate=None, timeout_seconds=None, hysteresis=0.0, cooldown_seconds=300):
+    """
+    Create an alert rule on a sensor owned by user_id.
+
+    Returns:
+        dict: The created rule
+        dict: {"error": str, "code": int} on failure
+    """
+    if type == RuleType.THRESHOLD and min_value is None and max_value is None:
+        return {"error": "Threshold rules need min_value and/or max_value", "code": 400}
+    if type == RuleType.RATE and not max_rate:
+        return {"error": "Rate rules need a positive max_rate", "code": 400}
+    if type == RuleType.NO_DATA and not timeout_seconds:
+        return {"error": "No data rules need a positive timeout_seconds", "code": 400}
+
+    try:
+        if not auth_service.owns_sensor(user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+
+        rule = Alert_Rule(sensor_id=sensor_id, type=type, severity=severity, min_value=min_value, max_value=max_value,
+                          max_rate=max_rate, timeout_seconds=timeout_seconds, hysteresis=hysteresis,
+                          cooldown_seconds=cooldown_seconds)
+        db.session.add(rule)
+        db.session.commit()
+        logger.info(f"Created {type.value} alert rule {rule.id} on sensor {sensor_id}")
+        _reload_engine_rules()
+        return rule.to_dict()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error creating alert rule on sensor {sensor_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def get_rules(user_id, sensor_id=None):
+    """Return the alert rules on the user's sensors, or None on error."""
+    try:
+        query = Alert_Rule.query.join(Sensor).filter(Sensor.user_id == user_id)
+        if sensor_id is not None:
+            query = query.filter(Alert_Rule.sensor_id == sensor_id)
+        return [rule.to_dict() for rule in query.order_by(Alert_Rule.id)]
+    except SQLAlchemyError as e:
+        logger.error(f"Error fetching alert rules for user {user_id}: {e}")
+        return None
+
+def delete_rule(user_id, rule_id):
+    """Delete an alert rule on one of the user's sensors. Returns True if a rule was deleted."""
+    try:
+        rule = Alert_Rule.query.join(Sensor).filter(Alert_Rule.id == rule_id, Sensor.user_id == user_id).first()
+        if not rule:
+            return False
+        db.session.delete(rule)
+        db.session.commit()
+        logger.info(f"Deleted alert rule {rule_id}")
+        _reload_engine_rules()
+        return True
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error deleting alert rule {rule_id}: {e}")
+        return False
+
+def _user_alerts(user_id):
+    """Alerts on sensors owned by user_id."""
+    return Alert.query.filter(Alert.sensor_id.in_(select(Sensor.id).where(Sensor.user_id == user_id)))
+
+def _apply_alert_filters(query, filters):
+    if filters.get("sensor_id") is not None:
+        query = query.filter(Alert.sensor_id == filters["sensor_id"])
+    if filters.get("severity") is not None:
+        query = query.filter(Alert.severity == filters["severity"])
+    if filters.get("ack") is not None:
+        query = query.filter(Alert.ack == filters["ack"]) if filters["ack"] else query.filter(Alert.ack.isnot(True))
+    if filters.get("since") is not None:
+        query = query.filter(Alert.created_at >= filters["since"])
+    if filters.get("until") is not None:
+        query = query.filter(Alert.created_at < filters["until"])
+    return query
+
+def get_alerts(user_id, filters, limit=100):
+    """
+    Return one page of the user's alerts, newest first, keyset-paginated on (created_at, id).
+
+    Args:
+        user_id (Integer): ID of the user whose sensors' alerts are returned
+        filters (dict): Optional sensor_id, severity (SeverityLevel), ack (bool), since/until (datetime) and cursor
+        limit (Integer): Maximum alerts in the page
+
+    Returns:
+        dict: {"data": [...], "next_cursor": str or None}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        query = _apply_alert_filters(_user_alerts(user_id), filters)
+        if filters.get("cursor"):
+            cursor = decode_cursor(filters["cursor"])
+            if not cursor:
+                return {"error": "Invalid cursor", "code": 400}
+            created_at, alert_id = cursor
+            query = query.filter(or_(Alert.created_at < created_at, and_(Alert.created_at == created_at, Alert.id < alert_id)))
+
+        alerts = query.order_by(Alert.created_at.desc(), Alert.id.desc()).limit(limit + 1).all()
+        next_cursor = None
+        if len(alerts) > limit:
+            alerts = alerts[:limit]
+            next_cursor = encode_cursor(alerts[-1].created_at, alerts[-1].id)
+        return {"data": [alert.to_dict() for alert in alerts], "next_cursor": next_cursor}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error fetching alerts for user {user_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def get_alert(user_id, alert_id):
+    """Return an alert dict on one of the user's sensors, or None if it doesn't exist."""
+    try:
+        alert = _user_alerts(user_id).filter(Alert.id == alert_id).first()
+        return alert.to_dict() if alert else None
+    except SQLAlchemyError as e:
+        logger.error(f"Error fetching alert {alert_id}: {e}")
+        return None
+
+def ack_alerts(user_id, alert_ids=None, filters=None, chunk_size=5000):
+    """
+    Acknowledge alerts on the user's sensors with set-based UPDATEs, either by id or by
+    the same filters as get_alerts. Ids are applied chunk_size per statement to stay under
+    bind parameter limits, all in one transaction.
+
+    Returns:
+        dict: {"acknowledged": int}
+        dict: {"error": str, "code": int} on failure
+    """
+    owned = Alert.sensor_id.in_(select(Sensor.id).where(Sensor.user_id == user_id))
+    unacked = Alert.ack.isnot(True)
+    try:
+        acknowledged = 0
+        if alert_ids is not None:
+            for start in range(0, len(alert_ids), chunk_size):
+                statement = update(Alert).where(Alert.id.in_(alert_ids[start:start + chunk_size]), owned, unacked) \
+                    .values(ack=True, ack_by=user_id).execution_options(synchronize_session=False)
+                acknowledged += db.session.execute(statement).rowcount
+        else:
+            ids = _apply_alert_filters(Alert.query.filter(owned, unacked), filters or {}).with_entities(Alert.id)
+            statement = update(Alert).where(Alert.id.in_(ids.scalar_subquery())) \
+                .values(ack=True, ack_by=user_id).execution_options(synchronize_session=False)
+            acknowledged = db.session.execute(statement).rowcount
+        db.session.commit()
+        logger.info(f"User {user_id} acknowledged {acknowledged} alerts")
+        return {"acknowledged": acknowledged}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error acknowledging alerts for user {user_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def _reload_engine_rules():
+    engine = current_app.extensions.get("alert_engine")
+    if engine:
+        engine.reload_rules()
+
+def load_active_rules():
+    """Return {sensor_id: [rule dict, ...]} for every active rule."""
+    rules = {}
+    for rule in Alert_Rule.query.filter(Alert_Rule.is_active.isnot(False)):
+        rules.setdefault(rule.sensor_id, []).append(rule.to_dict())
+    return rules
+
+def new_state():
+    """Per-rule evaluation state kept in memory by the alert engine."""
+    return {"firing": False, "last_value": None, "last_at": None, "fired_at": None}
+
+def _fire(rule, state, at, message):
+    """Mark the rule as firing and return the alert unless it's still cooling down from the last one."""
+    state["firing"] = True
+    if state["fired_at"] and (at - state["fired_at"]).total_seconds() < rule["cooldown_seconds"]:
+        return None
+    state["fired_at"] = at
+    return {"sensor_id": rule["sensor_id"], "severity": SeverityLevel(rule["severity"]), "message": message, "created_at": at}
+
+def evaluate_reading(rule, state, value, at):
+    """
+    Evaluate one new reading against a threshold or rate rule, updating state in place.
+
+    A rule fires once when its condition becomes true and must move back inside the
+    limit by at least the rule's hysteresis before it can fire again, so a value
+    hovering around a limit yields a single alert.
+
+    Returns:
+        dict: Alert row to insert
+        None: If no alert should be raised
+    """
+    alert = None
+    hysteresis = rule["hysteresis"] or 0.0
+    if rule["type"] == RuleType.THRESHOLD.value:
+        low, high = rule["min_value"], rule["max_value"]
+        if (high is not None and value > high) or (low is not None and value < low):
+            if not state["firing"]:
+                bound = f"above {high}" if high is not None and value > high else f"below {low}"
+                alert = _fire(rule, state, at, f"Sensor {rule['sensor_id']} value {value} is {bound}")
+        elif state["firing"] and (high is None or value <= high - hysteresis) and (low is None or value >= low + hysteresis):
+            state["firing"] = False
+
+    elif rule["type"] == RuleType.RATE.value:
+        if state["last_at"] is not None and at > state["last_at"]:
+            rate = (value - state["last_value"]) / (at - state["last_at"]).total_seconds()
+            if abs(rate) > rule["max_rate"]:
+                if not state["firing"]:
+                    alert = _fire(rule, state, at, f"Sensor {rule['sensor_id']} changing at {rate:.3g}/s, limit {rule['max_rate']}/s")
+            elif state["firing"] and abs(rate) <= rule["max_rate"] - hysteresis:
+                state["firing"] = False
+
+    state["last_value"], state["last_at"] = value, at
+    return alert
+
+# PostgreSQL advisory lock key held by the process sweeping no_data rules
+NO_DATA_SWEEP_LOCK = 0x6e6f6461
+
+def _claim_sweep():
+    """
+    Take a lock held until the sweep's transaction ends, so sweeps in several processes
+    don't raise the same alert twice. False if another process is sweeping right now.
+    """
+    if db.engine.dialect.name == "postgresql":
+        return db.session.scalar(text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": NO_DATA_SWEEP_LOCK})
+    # SQLite has a single writer, a write matching no rows takes its lock until commit.
+    # A sweep waiting for it reads the alerts the previous one wrote
+    try:
+        db.session.execute(update(Alert_Rule).where(false()).values(id=Alert_Rule.id))
+        return True
+    except OperationalError as e:
+        if "locked" not in str(e.orig):
+            raise
+        return False
+
+def sweep_no_data(now=None):
+    """
+    Raise alerts for no_data rules whose sensor has been silent for longer than the rule's timeout.
+
+    Evaluated from the database rather than the engine's memory, so the result doesn't depend
+    on which process handled the sensor's readings: a sensor's last reading is its newest
+    Sensor_Data row (its rule's creation if it never sent one), and an alert of the rule's
+    severity newer than that reading means the rule already fired for this silence. Every
+    AlertEngine sweeps periodically, sweeps are serialized by a database lock and a sweep
+    finding another one running is skipped.
+
+    Returns:
+        int: Number of alerts raised, 0 if another process is sweeping
+        None: If the sweep failed
+    """
+    now = now or datetime.utcnow()
+    try:
+        if not _claim_sweep():
+            db.session.rollback()
+            logger.debug("no_data sweep skipped, another process is sweeping")
+            return 0
+        rules = Alert_Rule.query.filter(Alert_Rule.type == RuleType.NO_DATA, Alert_Rule.is_active.isnot(False)).all()
+        if not rules:
+            db.session.rollback()
+            return 0
+        sensor_ids = {rule.sensor_id for rule in rules}
+        seen = dict(db.session.execute(
+            select(Sensor_Data.sensor_id, func.max(Sensor_Data.created_at))
+            .where(Sensor_Data.sensor_id.in_(sensor_ids))
+            .group_by(Sensor_Data.sensor_id)
+        ).all())
+        since = min(min(seen.get(rule.sensor_id) or rule.created_at for rule in rules),
+                    now - timedelta(seconds=max(rule.cooldown_seconds or 0 for rule in rules)))
+        alerted = {(sensor_id, severity): at for sensor_id, severity, at in db.session.execute(
+            select(Alert.sensor_id, Alert.severity, func.max(Alert.created_at))
+            .where(Alert.sensor_id.in_(sensor_ids), Alert.created_at >= since)
+            .group_by(Alert.sensor_id, Alert.severity)
+        )}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error sweeping no_data rules: {e}")
+        return None
+
+    alerts = []
+    for rule in rules:
+        last_seen = seen.get(rule.sensor_id) or rule.created_at
+        silent = (now - last_seen).total_seconds()
+        if silent < rule.timeout_seconds:
+            continue
+        fired_at = alerted.get((rule.sensor_id, rule.severity))
+        if fired_at and (fired_at > last_seen or (now - fired_at).total_seconds() < (rule.cooldown_seconds or 0)):
+            continue
+        alerts.append({"sensor_id": rule.sensor_id, "severity": rule.severity, "created_at": now,
+                       "message": f"Sensor {rule.sensor_id} has sent no data for {int(silent)} seconds"})
+        # Another rule of the same severity on this sensor is covered by this alert
+        alerted[(rule.sensor_id, rule.severity)] = now
+    if not alerts:
+        # Release the sweep lock
+        db.session.rollback()
+        return 0
+    return len(alerts) if write_alerts(alerts) else None
+
+def write_alerts(alerts):
+    """Insert alerts raised by the engine in a single statement, False if that failed."""
+    if not alerts:
+        return True
+    try:
+        db.session.execute(insert(Alert), [dict(alert, ack=False) for alert in alerts])
+        db.session.commit()
+        logger.info(f"Raised {len(alerts)} alerts")
+        return True
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error writing {len(alerts)} alerts: {e}")
+        return False
@@ -0,0 +1,142 @@
+from app.models import User, Sensor, Sensor_Data
+from app.services import auth_service, sensor_service, rollup_service
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import select
+from app.logger import logger
+from app.utils import *
+import asyncio
+
+# Async counterparts of the sensor_service ingest and read paths, used by the ASGI app.
+# Validation, caching, rollups and alerting are shared with the sync services, only
+# the database round-trips differ. Each function takes an AsyncSession and must run
+# inside an app context.
+
+async def get_user(session, id):
+    """Async auth_service.get_user, sharing its cache."""
+    cache = current_app.extensions['identity_cache']
+    user = cache.get(('user', str(id)))
+    if user is None:
+        user = await session.get(User, to_int(id))
+        user = user.to_dict() if user else None
+        if user:
+            cache.set(('user', str(id)), user)
+    return user
+
+async def owned_sensor_ids(session, user_id, sensor_ids):
+    """Async auth_service.owned_sensor_ids, sharing its cache."""
+    owned, missing = auth_service.cached_sensor_ids(user_id, sensor_ids)
+    if missing:
+        owners = await session.execute(select(Sensor.id, Sensor.user_id).where(Sensor.id.in_(missing)))
+        auth_service.cache_sensor_owners(user_id, owners, owned)
+    return owned
+
+async def owns_sensor(session, user_id, sensor_id):
+    """Async auth_service.owns_sensor."""
+    sensor_id = to_int(sensor_id)
+    if not sensor_id:
+        return False
+    return sensor_id in await owned_sensor_ids(session, user_id, [sensor_id])
+
+async def log_sensor_data(session, user_id, data, idempotency_key=None, pace=False):
+    """
+    Async sensor_service.log_sensor_data, queueing on a worker thread when the ingest queue is enabled.
+
+    Returns:
+        dict: {"accepted": int, "rejected": int, "errors": [{"index", "reason"}]}
+        dict: {"error": str} if the insert fails
+        dict: {"error": str, "code": 429, "retry_after": int} when over budget
+    """
+    parsed, rejected = sensor_service.parse_readings(data)
+    try:
+        owned = await owned_sensor_ids(session, user_id, {row["sensor_id"] for _, row in parsed})
+        rows = sensor_service.owned_rows(parsed, rejected, owned)
+        if pace:
+            while wait := sensor_service.budget_wait(user_id, rows):
+                await asyncio.sleep(wait)
+        else:
+            limited = sensor_service.check_rate_limit(user_id, rows, request=False)
+            if limited:
+                return limited
+        if rows and current_app.config["INGEST_QUEUE_ENABLED"]:
+            app = current_app._get_current_object()
+            def queue():
+                with app.app_context():
+                    return sensor_service.queue_sensor_data(user_id, rows, idempotency_key)
+            queued = await asyncio.to_thread(queue)
+            if queued is None:
+                return {"error": "Error adding sensor data"}
+            if not queued:
+                sensor_service.record_ingest(len(data), rejected, duplicates=len(rows))
+                return {"accepted": len(rows), "rejected": len(rejected), "errors": rejected, "duplicates": len(rows)}
+            sensor_service.record_ingest(len(data), rejected, queued=len(rows))
+            return {"accepted": len(rows), "rejected": len(rejected), "errors": rejected, "queued": True}
+        written = []
+        if rows:
+            dialect = session.bind.dialect.name
+            result = await session.execute(sensor_service.sensor_data_insert(rows, dialect), rows)
+            written = sensor_service.written_rows(rows, result)
+            if written and current_app.config["ROLLUPS_ENABLED"]:
+                await session.execute(rollup_service.rollup_upsert(dialect), rollup_service.rollup_values(written))
+            await session.commit()
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Error adding sensor data rows for user {user_id}: {e}")
+        return {"error": "Error adding sensor data"}
+
+    sensor_service.publish_rows(written)
+
+    logger.debug(f"{len(rows)} out of {len(data)} requested data points were added for user {user_id}")
+    result = {"accepted": len(rows), "rejected": len(rejected), "errors": rejected}
+    if rows:
+        result["duplicates"] = len(rows) - len(written)
+    sensor_service.record_ingest(len(data), rejected, written=len(written), duplicates=len(rows) - len(written))
+    return result
+
+async def get_sensor_data(session, user_id, sensor_id, filters, limit=1000):
+    """
+    Async sensor_service.get_sensor_data, one keyset page newest first plus its summary.
+    Recent windows are served from the hot window, refreshed on a worker thread.
+
+    Returns:
+        dict: {"data": [...], "summary": {...}, "next_cursor": str or None}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        if not await owns_sensor(session, user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+
+        cursor = None
+        if filters.get("cursor"):
+            cursor = sensor_service.decode_cursor(filters["cursor"])
+            if not cursor:
+                return {"error": "Invalid cursor", "code": 400}
+
+        if current_app.extensions.get("hot_window") is not None and sensor_service.window_cutoff(filters) is not None:
+            app = current_app._get_current_object()
+            def hot_window_readings():
+                with app.app_context():
+                    return sensor_service.hot_window_readings(sensor_id, filters)
+            readings = await asyncio.to_thread(hot_window_readings)
+            if readings is not None:
+                return sensor_service._hot_window_page(readings, cursor, limit)
+
+        query = sensor_service.filtered_data_query(sensor_id, filters)
+        if cursor:
+            query = sensor_service._after_cursor(query, cursor)
+
+        page = query.order_by(Sensor_Data.created_at.desc(), Sensor_Data.id.desc()).limit(limit + 1).statement
+        data_rows = (await session.scalars(page)).all()
+        next_cursor = None
+        if len(data_rows) > limit:
+            data_rows = data_rows[:limit]
+            next_cursor = sensor_service.encode_cursor(data_rows[-1].created_at, data_rows[-1].id)
+
+        totals = sensor_service.filtered_data_query(sensor_id, filters).with_entities(*sensor_service.summary_columns()).order_by(None).statement
+        summary = sensor_service.summary_from_row((await session.execute(totals)).one())
+        return {"data": [d.to_dict() for d in data_rows], "summary": summary, "next_cursor": next_cursor}
+
+    except SQLAlchemyError as e:
+        await session.rollback()
+        logger.error(f"Error fetching sensor data for sensor {sensor_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
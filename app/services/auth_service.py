@@ -1,15 +1,30 @@
 from app.extensions import db
-from app.models import User, Role
+from app.models import User, Role, Sensor
+from flask import current_app
 from flask_jwt_extended import create_access_token
-import bcrypt
+from app.passwords import PasswordPoolBusy
 from app.utils import *
 from sqlalchemy.exc import SQLAlchemyError
 from app.logger import logger
 
+def _identity_cache():
+    return current_app.extensions['identity_cache']
+
+def _password_pool():
+    return current_app.extensions['password_pool']
+
+def _busy(e):
+    logger.warning(f'Password pool busy, rejecting request with {e.status}')
+    return {'error': 'Too many login requests, try again shortly', 'code': e.status, 'retry_after': e.retry_after}
+
 def get_user(id):
     """
     Get user information from databse
 
+    Results are kept in a short-TTL process-wide cache, so repeated requests from the
+    same user don't each cost a query. Users are never updated or deleted through the
+    API, a change made directly in the database shows up within IDENTITY_CACHE_TTL.
+
     Args:
         id (Integer): ID of user which is the Primary key for Users table
 
@@ -18,8 +33,64 @@ def get_user(id):
         None: Returns None if user isn't found 
     
     """
-    user = User.query.get(id)
-    return user.to_dict() if user else None
+    cache = _identity_cache()
+    user = cache.get(('user', str(id)))
+    if user is None:
+        user = User.query.get(id)
+        user = user.to_dict() if user else None
+        if user:
+            cache.set(('user', str(id)), user)
+    return user
+
+def sensor_owner(sensor_id):
+    """Return the user id owning sensor_id, or None if the sensor doesn't exist. Cached."""
+    cache = _identity_cache()
+    owner = cache.get(('sensor', sensor_id))
+    if owner is None:
+        owner = db.session.query(Sensor.user_id).filter(Sensor.id == sensor_id).scalar()
+        if owner is not None:
+            cache.set(('sensor', sensor_id), owner)
+    return owner
+
+def owns_sensor(user_id, sensor_id):
+    """Return True if sensor_id exists and belongs to user_id."""
+    sensor_id = to_int(sensor_id)
+    if not sensor_id:
+        return False
+    owner = sensor_owner(sensor_id)
+    return owner is not None and str(owner) == str(user_id)
+
+def cached_sensor_ids(user_id, sensor_ids):
+    """Split sensor_ids into (owned, missing) using only the ownership cache."""
+    cache = _identity_cache()
+    owned, missing = set(), []
+    for sensor_id in sensor_ids:
+        owner = cache.get(('sensor', sensor_id))
+        if owner is None:
+            missing.append(sensor_id)
+        elif str(owner) == str(user_id):
+            owned.add(sensor_id)
+    return owned, missing
+
+def cache_sensor_owners(user_id, owners, owned):
+    """Cache (sensor_id, owner) pairs looked up for cache misses, adding user_id's sensors to owned."""
+    cache = _identity_cache()
+    for sensor_id, owner in owners:
+        cache.set(('sensor', sensor_id), owner)
+        if str(owner) == str(user_id):
+            owned.add(sensor_id)
+    return owned
+
+def owned_sensor_ids(user_id, sensor_ids):
+    """Return the subset of sensor_ids owned by user_id, querying only ids missing from the cache."""
+    owned, missing = cached_sensor_ids(user_id, sensor_ids)
+    if missing:
+        cache_sensor_owners(user_id, db.session.query(Sensor.id, Sensor.user_id).filter(Sensor.id.in_(missing)), owned)
+    return owned
+
+def invalidate_sensor(sensor_id):
+    """Drop a sensor's cached ownership, call after it is updated or deleted."""
+    _identity_cache().delete(('sensor', to_int(sensor_id)))
 
 # Validate credentials and return JWT
 def authenticate_user(username, password):
@@ -28,8 +99,11 @@ def authenticate_user(username, password):
     if not user:
         logger.info(f'Authentication of user with email: {username} as failed since email DNE')
         return {'error': f'User with email {username} does not exist, plaese register'}
-    if username != user.username or not bcrypt.checkpw(password.encode('utf-8'), user.password_hash.encode('utf-8')):
-        print(f'Provided pw: {password.encode("utf-8")} Stored PW: {user.password_hash}')
+    try:
+        is_valid = username == user.username and _password_pool().check(password, user.password_hash)
+    except PasswordPoolBusy as e:
+        return _busy(e)
+    if not is_valid:
         logger.info(f'Authentication of user with email: {username} as failed')
         return {'error': f'Email or password is incorrect'}
     
@@ -61,7 +135,10 @@ def register_user(email, username, password, role=Role.ENGINEER):
         logger.info(f'Failed to register user with email: {email}, due to password restrictions')
         return msg
     
-    password_hash = bcrypt.hashpw(password=password.encode('utf-8'), salt=bcrypt.gensalt()).decode('utf-8')
+    try:
+        password_hash = _password_pool().hash(password)
+    except PasswordPoolBusy as e:
+        return _busy(e)
     user = User(email=email, username=username, password_hash=password_hash, role=role)
     try:
         db.session.add(user)
@@ -0,0 +1,151 @@
+from app.extensions import db
+from app.models import Sensor, Sensor_Data
+from sqlalchemy.exc import SQLAlchemyError
+from app.logger import logger
+import csv
+import io
+
+# Export formats and their content types, arrow and parquet need pyarrow installed
+FORMATS = {
+    "csv": "text/csv",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+COLUMNS = ["id", "sensor_id", "created_at", "value", "unit", "client_seq"]
+
+def export_query(user_id, sensor_ids=None, since=None, until=None, chunk_size=10000):
+    """
+    Readings on the user's sensors ordered by (sensor_id, created_at, id), which walks
+    ix_sensor_data_sensor_created, fetched from a server-side cursor chunk_size rows at a time.
+
+    Args:
+        user_id (Integer): Owner of the sensors to export
+        sensor_ids (list): Restrict the export to these sensors
+        since (datetime): Inclusive start of the time range
+        until (datetime): Exclusive end of the time range
+
+    Returns:
+        Query: Iterable of (id, sensor_id, created_at, value, unit, client_seq) rows
+    """
+    query = db.session.query(Sensor_Data.id, Sensor_Data.sensor_id, Sensor_Data.created_at, Sensor_Data.value,
+                             Sensor_Data.unit, Sensor_Data.client_seq) \
+        .join(Sensor, Sensor.id == Sensor_Data.sensor_id).filter(Sensor.user_id == user_id)
+    if sensor_ids:
+        query = query.filter(Sensor_Data.sensor_id.in_(sensor_ids))
+    if since is not None:
+        query = query.filter(Sensor_Data.created_at >= since)
+    if until is not None:
+        query = query.filter(Sensor_Data.created_at < until)
+    return query.order_by(Sensor_Data.sensor_id, Sensor_Data.created_at, Sensor_Data.id).yield_per(chunk_size)
+
+def _chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _csv(rows, chunk_size):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows((row.id, row.sensor_id, row.created_at.isoformat(), row.value, row.unit.value, row.client_seq) for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+class _Sink:
+    """Write-only file object that hands back whatever pyarrow wrote since the last drain."""
+
+    def __init__(self):
+        self._parts = []
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+def _arrow_schema(pa):
+    return pa.schema([
+        ("id", pa.int64()),
+        ("sensor_id", pa.int64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("value", pa.float64()),
+        ("unit", pa.dictionary(pa.int8(), pa.string())),
+        ("client_seq", pa.string()),
+    ])
+
+def _record_batch(pa, schema, chunk):
+    columns = list(zip(*chunk))
+    columns[4] = [unit.value for unit in columns[4]]
+    arrays = [pa.array(values, type=field.type) if i != 4 else pa.array(values).dictionary_encode().cast(field.type)
+              for i, (values, field) in enumerate(zip(columns, schema))]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _arrow(rows, chunk_size, parquet=False):
+    import pyarrow as pa
+    schema = _arrow_schema(pa)
+    sink = _Sink()
+    if parquet:
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression="zstd")
+        write = lambda batch: writer.write_table(pa.Table.from_batches([batch]))
+    else:
+        writer = pa.ipc.new_stream(sink, schema)
+        write = writer.write_batch
+
+    for chunk in _chunks(rows, chunk_size):
+        write(_record_batch(pa, schema, chunk))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def export_sensor_data(user_id, sensor_ids=None, since=None, until=None, format="csv", chunk_size=10000):
+    """
+    Stream a user's readings in a columnar format without holding the result set in
+    memory, one chunk_size batch of rows (a CSV chunk, an Arrow record batch or a
+    Parquet row group) at a time.
+
+    Returns:
+        generator: Yields str (csv) or bytes (arrow, parquet)
+        dict: {"error": str, "code": int} if the export can't be started
+    """
+    if format not in FORMATS:
+        return {"error": f"format must be one of {list(FORMATS)}", "code": 400}
+    if format != "csv":
+        try:
+            import pyarrow
+        except ImportError:
+            return {"error": f"{format} export requires pyarrow to be installed", "code": 400}
+
+    rows = export_query(user_id, sensor_ids, since, until, chunk_size)
+
+    def generate():
+        try:
+            if format == "csv":
+                yield from _csv(rows, chunk_size)
+            else:
+                yield from _arrow(rows, chunk_size, parquet=format == "parquet")
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Error exporting sensor data for user {user_id}: {e}")
+    logger.info(f"Exporting {format} sensor data for user {user_id}, sensors {sensor_ids or 'all'}")
+    return generate()
@@ -0,0 +1,101 @@
+from app.extensions import db
+from app.models import Sensor
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import SQLAlchemyError
+from app.logger import logger
+from app import geo
+import math
+
+def _in_bbox(model, min_lat, min_lon, max_lat, max_lon, max_cells):
+    """Criteria for rows of model inside a bounding box, led by geohash ranges on (user_id, geohash)."""
+    bounds = geo.bbox_ranges(min_lat, min_lon, max_lat, max_lon, max_cells)
+    ranges = [model.geohash >= start if end is None else and_(model.geohash >= start, model.geohash < end) for start, end in bounds]
+    if min_lon <= max_lon:
+        # The overall span bounds the index scan even where the planner doesn't split the OR into ranges
+        span = [model.geohash >= bounds[0][0]] + ([model.geohash < bounds[-1][1]] if bounds[-1][1] is not None else [])
+        longitude = model.longitude.between(min_lon, max_lon)
+    else:
+        # Across the antimeridian the ranges of the two halves sit at opposite ends of the geohash order
+        span = []
+        longitude = or_(model.longitude >= min_lon, model.longitude <= max_lon)
+    return span + [or_(*ranges), model.latitude.between(min_lat, max_lat), longitude]
+
+def _located(user_id, model, criteria):
+    return model.query.filter(model.user_id == user_id, model.geohash.isnot(None), *criteria).all()
+
+def _within_radius(user_id, model, latitude, longitude, radius_km, max_cells):
+    """(distance_km, row) of rows within radius_km, nearest first."""
+    candidates = _located(user_id, model, _in_bbox(model, *geo.radius_bbox(latitude, longitude, radius_km), max_cells))
+    nearby = [(geo.distance_km(latitude, longitude, row.latitude, row.longitude), row) for row in candidates]
+    return sorted((pair for pair in nearby if pair[0] <= radius_km), key=lambda pair: (pair[0], pair[1].id))
+
+def _with_distances(nearby):
+    return [dict(row.to_dict(), distance_km=round(distance, 6)) for distance, row in nearby]
+
+def find_in_bbox(user_id, min_lat, min_lon, max_lat, max_lon, model=Sensor, max_cells=32):
+    """
+    Return the user's sensors (or devices with model=Device) inside a bounding box. A box
+    with min_lon > max_lon crosses the antimeridian.
+
+    Returns:
+        list: Row dicts
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        return [row.to_dict() for row in _located(user_id, model, _in_bbox(model, min_lat, min_lon, max_lat, max_lon, max_cells))]
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error finding {model.__tablename__} in bbox for user {user_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def find_in_radius(user_id, latitude, longitude, radius_km, model=Sensor, max_cells=32):
+    """
+    Return the user's sensors (or devices) within radius_km of a point, nearest first,
+    each with its "distance_km".
+
+    The circle's bounding box selects candidates through the geohash index and the
+    great-circle distance drops the corners.
+
+    Returns:
+        list: Row dicts
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        return _with_distances(_within_radius(user_id, model, latitude, longitude, radius_km, max_cells))
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error finding {model.__tablename__} near ({latitude}, {longitude}) for user {user_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def find_nearest(user_id, latitude, longitude, k, model=Sensor, start_km=5, max_cells=32):
+    """
+    Return the user's k sensors (or devices) nearest to a point, nearest first, each with
+    its "distance_km".
+
+    Searches a radius of start_km and doubles it until it holds k rows or covers the
+    whole globe, so sparse areas cost a few more index range scans rather than a scan
+    of every row.
+
+    Returns:
+        list: Row dicts
+        dict: {"error": str, "code": int} on failure
+    """
+    radius_km = start_km
+    try:
+        while True:
+            nearby = _within_radius(user_id, model, latitude, longitude, radius_km, max_cells)
+            if len(nearby) >= k or radius_km >= math.pi * geo.EARTH_RADIUS_KM:
+                return _with_distances(nearby[:k])
+            radius_km *= 2
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error finding {model.__tablename__} nearest ({latitude}, {longitude}) for user {user_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def find_by_location(user_id, filters, model=Sensor, start_km=5, max_cells=32):
+    """Dispatch parsed spatial filters ("bbox", or "near" with "radius_km" or "k") to the finders above."""
+    if "bbox" in filters:
+        return find_in_bbox(user_id, *filters["bbox"], model=model, max_cells=max_cells)
+    if "radius_km" in filters:
+        return find_in_radius(user_id, *filters["near"], filters["radius_km"], model=model, max_cells=max_cells)
+    return find_nearest(user_id, *filters["near"], filters["k"], model=model, start_km=start_km, max_cells=max_cells)
@@ -0,0 +1,383 @@
+from app.extensions import db
+from app.models import Sensor_Data, Sensor_Rollup
+from app.services import auth_service, sensor_service
+from app.utils import dialect_insert
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import func, cast, case, insert, BigInteger
+from app.logger import logger
+from datetime import datetime, timedelta, timezone
+
+# Supported bucket widths in seconds
+BUCKETS = {"1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+
+# Resolutions maintained in Sensor_Rollups as readings are ingested
+ROLLUP_RESOLUTIONS = {"1m": 60, "1h": 3600, "1d": 86400}
+
+def epoch_seconds(column):
+    """SQL expression for a DateTime column as whole seconds since the Unix epoch."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return cast(func.floor(func.extract("epoch", column)), BigInteger)
+    if dialect == "sqlite":
+        return cast(func.strftime("%s", column), BigInteger)
+    return func.unix_timestamp(column)
+
+def _to_datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc).replace(tzinfo=None)
+
+def _to_seconds(created_at):
+    return created_at.replace(tzinfo=timezone.utc).timestamp()
+
+def rollup_values(rows):
+    """
+    Aggregate a batch of new Sensor_Data rows in memory into one row per
+    (sensor, resolution, bucket), ready for rollup_upsert.
+
+    Args:
+        rows (list): Dicts with sensor_id, value and created_at
+
+    Returns:
+        list: Sensor_Rollups rows
+    """
+    buckets = {}
+    for row in rows:
+        value, created_at = row["value"], row["created_at"]
+        seconds = _to_seconds(created_at)
+        for resolution, width in ROLLUP_RESOLUTIONS.items():
+            key = (row["sensor_id"], resolution, int(seconds // width * width))
+            bucket = buckets.get(key)
+            if bucket is None:
+                buckets[key] = {"count": 1, "sum": value, "sum_sq": value * value, "min": value, "max": value,
+                                "last_value": value, "last_at": created_at}
+                continue
+            bucket["count"] += 1
+            bucket["sum"] += value
+            bucket["sum_sq"] += value * value
+            bucket["min"] = min(bucket["min"], value)
+            bucket["max"] = max(bucket["max"], value)
+            if created_at >= bucket["last_at"]:
+                bucket["last_value"], bucket["last_at"] = value, created_at
+
+    return [dict(bucket, sensor_id=sensor_id, resolution=resolution, bucket_start=_to_datetime(start))
+            for (sensor_id, resolution, start), bucket in buckets.items()]
+
+def rollup_upsert(dialect=None):
+    """INSERT for rollup_values rows that merges each one into its existing bucket."""
+    statement = dialect_insert(Sensor_Rollup, dialect)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=["sensor_id", "resolution", "bucket_start"],
+        set_={
+            "count": Sensor_Rollup.count + excluded["count"],
+            "sum": Sensor_Rollup.sum + excluded["sum"],
+            "sum_sq": Sensor_Rollup.sum_sq + excluded.sum_sq,
+            "min": case((excluded["min"] < Sensor_Rollup.min, excluded["min"]), else_=Sensor_Rollup.min),
+            "max": case((excluded["max"] > Sensor_Rollup.max, excluded["max"]), else_=Sensor_Rollup.max),
+            "last_value": case((excluded.last_at >= Sensor_Rollup.last_at, excluded.last_value), else_=Sensor_Rollup.last_value),
+            "last_at": case((excluded.last_at >= Sensor_Rollup.last_at, excluded.last_at), else_=Sensor_Rollup.last_at),
+        },
+    )
+
+def update_rollups(rows):
+    """
+    Fold a batch of new Sensor_Data rows into Sensor_Rollups for every resolution.
+
+    The batch is aggregated in memory first so each (sensor, resolution, bucket) costs
+    one upsert no matter how many readings fall into it. Runs in the caller's
+    transaction, the caller commits.
+
+    Args:
+        rows (list): Dicts with sensor_id, value and created_at
+    """
+    values = rollup_values(rows)
+    if values:
+        db.session.execute(rollup_upsert(), values)
+
+def _newest_rank(*partition):
+    """Row number of each Sensor_Data row within its partition, 1 for the newest by (created_at, id) like the reads."""
+    return func.row_number().over(partition_by=partition, order_by=(Sensor_Data.created_at.desc(), Sensor_Data.id.desc()))
+
+def _rebuild(resolution, width, start, end=None, sensor_ids=None):
+    """Replace one resolution's buckets in [start, end) with aggregates of the raw readings, returns the bucket count."""
+    bucket_start = (epoch_seconds(Sensor_Data.created_at) // width * width).label("bucket_start")
+
+    readings = db.session.query(
+        Sensor_Data.sensor_id,
+        bucket_start,
+        Sensor_Data.value,
+        Sensor_Data.created_at,
+        _newest_rank(Sensor_Data.sensor_id, bucket_start).label("newest"),
+    ).filter(Sensor_Data.created_at >= start)
+    stale = Sensor_Rollup.query.filter(Sensor_Rollup.resolution == resolution, Sensor_Rollup.bucket_start >= start)
+    if end is not None:
+        readings = readings.filter(Sensor_Data.created_at < end)
+        stale = stale.filter(Sensor_Rollup.bucket_start < end)
+    if sensor_ids:
+        readings = readings.filter(Sensor_Data.sensor_id.in_(sensor_ids))
+        stale = stale.filter(Sensor_Rollup.sensor_id.in_(sensor_ids))
+    readings = readings.subquery()
+
+    value = readings.c.value
+    rows = db.session.query(
+        readings.c.sensor_id,
+        readings.c.bucket_start,
+        func.count().label("count"),
+        func.sum(value).label("sum"),
+        func.sum(value * value).label("sum_sq"),
+        func.min(value).label("min"),
+        func.max(value).label("max"),
+        func.max(case((readings.c.newest == 1, value))).label("last_value"),
+        func.max(readings.c.created_at).label("last_at"),
+    ).group_by(readings.c.sensor_id, readings.c.bucket_start).all()
+    values = [{
+        "sensor_id": row.sensor_id,
+        "resolution": resolution,
+        "bucket_start": _to_datetime(row.bucket_start),
+        "count": row.count,
+        "sum": row.sum,
+        "sum_sq": row.sum_sq,
+        "min": row.min,
+        "max": row.max,
+        "last_value": row.last_value,
+        "last_at": row.last_at,
+    } for row in rows]
+
+    stale.delete(synchronize_session=False)
+    if values:
+        db.session.execute(insert(Sensor_Rollup), values)
+    return len(values)
+
+def rebuild_rollups(since, sensor_ids=None):
+    """
+    Recompute every rollup bucket from `since` onwards from the raw readings, replacing
+    whatever was maintained incrementally. Used to repair drift after deletes or failed
+    writes and to backfill history ingested before rollups existed.
+
+    Args:
+        since (datetime): Start of the window, aligned down to each resolution's bucket
+        sensor_ids (list): Restrict the rebuild to these sensors
+
+    Returns:
+        int: Number of buckets written
+    """
+    written = 0
+    for resolution, width in ROLLUP_RESOLUTIONS.items():
+        written += _rebuild(resolution, width, _to_datetime(_to_seconds(since) // width * width), sensor_ids=sensor_ids)
+    db.session.commit()
+    return written
+
+def rebuild_buckets(sensor_id, created_at):
+    """
+    Recompute the sensor's buckets holding created_at at every resolution, e.g. after
+    one of its readings was deleted. Runs in the caller's transaction, the caller commits.
+    """
+    for resolution, width in ROLLUP_RESOLUTIONS.items():
+        start = _to_seconds(created_at) // width * width
+        _rebuild(resolution, width, _to_datetime(start), _to_datetime(start + width), sensor_ids=[sensor_id])
+
+def purge_rollups(resolution, before):
+    """Delete rollups of one resolution whose bucket starts before `before`. Returns the row count."""
+    deleted = Sensor_Rollup.query.filter(Sensor_Rollup.resolution == resolution, Sensor_Rollup.bucket_start < before) \
+        .delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def _rollup_source(width, cutoff):
+    """
+    Pick the coarsest maintained resolution that evenly divides the bucket width and
+    still covers the window, or None if the window must be read from raw rows.
+    """
+    retention = {
+        "1m": current_app.config["ROLLUP_MINUTE_RETENTION_DAYS"],
+        "1h": current_app.config["ROLLUP_HOUR_RETENTION_DAYS"],
+    }
+    candidates = []
+    for resolution, resolution_width in ROLLUP_RESOLUTIONS.items():
+        if width % resolution_width:
+            continue
+        days = retention.get(resolution)
+        if days and (cutoff is None or cutoff < datetime.utcnow() - timedelta(days=days)):
+            continue
+        candidates.append((resolution_width, resolution))
+    return max(candidates)[1] if candidates else None
+
+def _read_rollups(sensor_id, resolution, width, cutoff):
+    """Read pre-aggregated buckets and merge them into buckets of the requested width."""
+    query = Sensor_Rollup.query.filter_by(sensor_id=sensor_id, resolution=resolution)
+    if cutoff is not None:
+        query = query.filter(Sensor_Rollup.bucket_start >= cutoff)
+
+    merged = []
+    for rollup in query.order_by(Sensor_Rollup.bucket_start):
+        start = int(_to_seconds(rollup.bucket_start) // width * width)
+        if merged and merged[-1]["start"] == start:
+            bucket = merged[-1]
+            bucket["count"] += rollup.count
+            bucket["sum"] += rollup.sum
+            bucket["min"] = min(bucket["min"], rollup.min)
+            bucket["max"] = max(bucket["max"], rollup.max)
+            if rollup.last_at >= bucket["last_at"]:
+                bucket["last"], bucket["last_at"] = rollup.last_value, rollup.last_at
+            continue
+        merged.append({"start": start, "count": rollup.count, "sum": rollup.sum, "min": rollup.min,
+                       "max": rollup.max, "last": rollup.last_value, "last_at": rollup.last_at})
+
+    return [{
+        "bucket_start": _to_datetime(bucket["start"]).isoformat(),
+        "count": bucket["count"],
+        "min": bucket["min"],
+        "max": bucket["max"],
+        "avg": bucket["sum"] / bucket["count"],
+        "last": bucket["last"],
+    } for bucket in merged]
+
+def get_rollup(user_id, sensor_id, filters, bucket):
+    """
+    Group a sensor's filtered readings into fixed time buckets in the database.
+
+    Served from Sensor_Rollups when a maintained resolution covers the window, in which
+    case the window start is aligned down to a bucket boundary. Otherwise the raw rows
+    are grouped with a single GROUP BY.
+
+    Args:
+        user_id (Integer): ID of the user that must own the sensor
+        sensor_id (Integer): ID of the sensor to read
+        filters (dict): days/hours/mins window and unit filters
+        bucket (String): One of BUCKETS
+
+    Returns:
+        dict: {"bucket": str, "data": [{"bucket_start", "count", "min", "max", "avg", "last"}]}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        if not auth_service.owns_sensor(user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+
+        width = BUCKETS[bucket]
+        # Unit-filtered reads need the raw rows since rollups are kept per sensor, not per unit
+        if current_app.config["ROLLUPS_ENABLED"] and not filters.get("unit"):
+            window = timedelta(days=filters.get("days") or 0, hours=filters.get("hours") or 0, minutes=filters.get("mins") or 0)
+            cutoff = None
+            if window.total_seconds() > 0:
+                cutoff = _to_datetime((_to_seconds(datetime.utcnow() - window)) // width * width)
+            resolution = _rollup_source(width, cutoff)
+            if resolution:
+                return {"bucket": bucket, "source": "rollup", "data": _read_rollups(sensor_id, resolution, width, cutoff)}
+
+        bucket_start = (epoch_seconds(Sensor_Data.created_at) // width * width).label("bucket_start")
+
+        readings = sensor_service.filtered_data_query(sensor_id, filters).with_entities(
+            bucket_start,
+            Sensor_Data.value,
+            _newest_rank(bucket_start).label("newest"),
+        ).subquery()
+
+        # "last" is the newest reading by (created_at, id), as in stored rollups, picked in the same pass
+        value = readings.c.value
+        rows = db.session.query(
+            readings.c.bucket_start,
+            func.count().label("count"),
+            func.min(value).label("min"),
+            func.max(value).label("max"),
+            func.avg(value).label("avg"),
+            func.max(case((readings.c.newest == 1, value))).label("last"),
+        ).group_by(readings.c.bucket_start).order_by(readings.c.bucket_start).all()
+
+        return {
+            "bucket": bucket,
+            "source": "raw",
+            "data": [{
+                "bucket_start": _to_datetime(row.bucket_start).isoformat(),
+                "count": row.count,
+                "min": row.min,
+                "max": row.max,
+                "avg": row.avg,
+                "last": row.last,
+            } for row in rows],
+        }
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error building rollup for sensor {sensor_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def lttb(points, count, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling over a stream of (x, y) points.
+
+    Only the current and next bucket are held in memory, so points can come straight
+    from a database cursor.
+
+    Args:
+        points (iterable): (x, y) pairs ordered by x
+        count (Integer): Number of points the iterable will produce
+        threshold (Integer): Number of points to keep
+
+    Yields:
+        tuple: The selected (x, y) points, always including the first and last
+    """
+    points = iter(points)
+    if threshold >= count or threshold < 3:
+        yield from points
+        return
+
+    every = (count - 2) / (threshold - 2)
+    consumed = 0
+
+    def take(end):
+        nonlocal consumed
+        taken = []
+        for point in points:
+            taken.append(point)
+            consumed += 1
+            if consumed >= end:
+                break
+        return taken
+
+    a = take(1)[0]
+    yield a
+    bucket = take(int(every) + 1)
+    for i in range(threshold - 2):
+        following = take(min(int((i + 2) * every) + 1, count))
+        if following:
+            avg_x = sum(p[0] for p in following) / len(following)
+            avg_y = sum(p[1] for p in following) / len(following)
+        else:
+            avg_x, avg_y = a
+
+        if bucket:
+            a_x, a_y = a
+            a = max(bucket, key=lambda p: abs((a_x - avg_x) * (p[1] - a_y) - (a_x - p[0]) * (avg_y - a_y)))
+            yield a
+        bucket = following
+
+    if bucket:
+        yield bucket[-1]
+
+def get_downsampled(user_id, sensor_id, filters, points, chunk_size=1000):
+    """
+    Visually downsample a sensor's filtered readings to at most `points` points with LTTB.
+
+    Returns:
+        dict: {"mode": "lttb", "count": int, "data": [{"created_at", "value"}]}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        if not auth_service.owns_sensor(user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+
+        query = sensor_service.filtered_data_query(sensor_id, filters)
+        count = query.with_entities(func.count(Sensor_Data.id)).order_by(None).scalar()
+        rows = query.with_entities(Sensor_Data.created_at, Sensor_Data.value) \
+            .order_by(Sensor_Data.created_at, Sensor_Data.id).yield_per(chunk_size)
+
+        sampled = lttb(((_to_seconds(row.created_at), row.value) for row in rows), count, points)
+        return {
+            "mode": "lttb",
+            "count": count,
+            "data": [{"created_at": _to_datetime(x).isoformat(), "value": y} for x, y in sampled],
+        }
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error downsampling data for sensor {sensor_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
@@ -1,9 +1,25 @@
 from app.extensions import db
-from app.models import Sensor, Sensor_Data, Unit
+from app.models import Sensor, Sensor_Data, Sensor_Rollup, Unit
+from app.services import auth_service, rollup_service
+from app import packed, metrics
+from app.hot_window import Reading
+from flask import current_app
 from sqlalchemy.exc import SQLAlchemyError
-from app.logger import logger
+from app.logger import logger, LogSummary
 from app.utils import *
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, timezone
+from sqlalchemy import insert, delete, select, or_, and_, func
+import base64
+import bisect
+import hashlib
+import json
+import math
+import sqlite3
+import time
+import uuid
+
+# Ingest is logged as periodic totals rather than a line per batch
+ingest_log = LogSummary("Sensor data ingested")
 
 def create_sensor(user_id, type, latitude=None,
                   longitude=None, is_active=True,
@@ -52,7 +68,7 @@ def get_sensor(sensor_id):
 
 def update_sensor(sensor_id, fields):
     """Update allowed sensor fields and return the updated dict, or None on not found/error."""
-    allowed = {"type", "latitude", "longitude", "is_active", "description"}
+    allowed = {"type", "latitude", "longitude", "is_active", "description", "retention_days"}
     try:
         sensor = Sensor.query.get(sensor_id)
         if not sensor:
@@ -67,6 +83,7 @@ def update_sensor(sensor_id, fields):
                 setattr(sensor, key, value)
 
         db.session.commit()
+        auth_service.invalidate_sensor(sensor_id)
         logger.info(f'Successfully updated sensor {sensor_id}')
         return sensor.to_dict()
     except SQLAlchemyError as e:
@@ -74,14 +91,33 @@ def update_sensor(sensor_id, fields):
         logger.error(f"Error updating sensor {sensor_id}: {e}")
         return None
 
-def delete_sensor(sensor_id):
+def delete_sensor_data_in_batches(*criteria, batch_size=5000):
+    """
+    Delete Sensor_Data rows matching criteria in batches of batch_size, committing after
+    each batch so a large delete never holds locks on the table for long.
+
+    Returns:
+        int: Number of rows deleted
+    """
+    total = 0
+    while True:
+        ids = select(Sensor_Data.id).where(*criteria).limit(batch_size).scalar_subquery()
+        deleted = db.session.execute(delete(Sensor_Data).where(Sensor_Data.id.in_(ids))).rowcount
+        db.session.commit()
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+def delete_sensor(sensor_id, batch_size=5000):
     """Delete sensor by id. Returns True on success, False otherwise."""
     try:
         sensor = Sensor.query.get(sensor_id)
         if not sensor:
             return False
+        delete_sensor_data_in_batches(Sensor_Data.sensor_id == sensor_id, batch_size=batch_size)
         db.session.delete(sensor)
         db.session.commit()
+        auth_service.invalidate_sensor(sensor_id)
         logger.error(f"Successfully deleted sensor {sensor_id}")
         return True
     except SQLAlchemyError as e:
@@ -89,83 +125,545 @@ def delete_sensor(sensor_id):
         logger.error(f"Error deleting sensor {sensor_id}: {e}")
         return False
 
-def log_sensor_data(user_id, data):
-    readings_added = []
-    for reading in data:
-        sensor_id = reading.get("sensor_id")
-        unit = reading.get("unit")
-        value = reading.get("value") 
-        sensor = Sensor.query.filter_by(id=sensor_id, user_id=user_id).first()
-        if not sensor:
-            logger.info(f"Sensor {sensor_id} not found for user {user_id} when attempting to log data")
-            continue
+_UNITS = {unit.value: unit for unit in Unit}
 
-        is_valid_value, value = to_float(value)
-        if not is_valid_value:
-            return {"error": "Invalid value"}
+def _parse_timestamp(timestamp):
+    """Parse a reading's optional device timestamp, ISO 8601 or Unix epoch seconds, as (is_valid, naive UTC datetime)."""
+    if isinstance(timestamp, (int, float)) and not isinstance(timestamp, bool):
+        if not math.isfinite(timestamp):
+            return False, None
         try:
-            unit=Unit(unit)
-        except ValueError:
-            logger.info(f"Unable to log sensor data because unit {unit} isn't valid")
-            return {"error": f"Unable to log sensor data because unit {unit} isn't valid. Unit must be one of the following units: {[type.value for type in Unit]}"}
+            return True, datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None)
+        except (OverflowError, OSError, ValueError):
+            return False, None
+    return to_datetime(timestamp)
+
+def parse_readings(readings):
+    """
+    Validate the shape, value and unit of every reading in a single pass.
+
+    Readings may carry a device "timestamp" (ISO 8601 or epoch seconds) used as
+    created_at, and a "client_seq" (sequence number or UUID) that makes re-uploading
+    the same reading a no-op.
+
+    Args:
+        readings (list): Raw reading dicts as posted by the client
+
+    Returns:
+        tuple: (parsed, rejected) where parsed is a list of (index, row) pairs ready for insert
+        and rejected is a list of {"index", "reason"} dicts
+    """
+    parsed, rejected = [], []
+    latest = datetime.utcnow() + timedelta(seconds=current_app.config["INGEST_MAX_CLOCK_SKEW_SECONDS"])
+    seen = set()
+    for index, reading in enumerate(readings):
+        if not isinstance(reading, dict):
+            rejected.append({"index": index, "reason": "invalid_reading"})
+            continue
+
+        sensor_id = to_int(reading.get("sensor_id"))
+        if not sensor_id:
+            rejected.append({"index": index, "reason": "invalid_sensor_id"})
+            continue
+
+        is_valid_value, value = to_float(reading.get("value"))
+        if not is_valid_value or value is None or not math.isfinite(value):
+            rejected.append({"index": index, "reason": "invalid_value"})
+            continue
+
+        unit = _UNITS.get(reading.get("unit"))
+        if unit is None:
+            rejected.append({"index": index, "reason": "invalid_unit"})
+            continue
+
+        is_valid_timestamp, created_at = _parse_timestamp(reading.get("timestamp"))
+        if not is_valid_timestamp or (created_at and created_at > latest):
+            rejected.append({"index": index, "reason": "invalid_timestamp"})
+            continue
+
+        client_seq = reading.get("client_seq")
+        if client_seq is not None:
+            if isinstance(client_seq, bool) or not isinstance(client_seq, (int, str)) or not 0 < len(str(client_seq)) <= 64:
+                rejected.append({"index": index, "reason": "invalid_client_seq"})
+                continue
+            client_seq = str(client_seq)
+            if (sensor_id, client_seq) in seen:
+                rejected.append({"index": index, "reason": "duplicate_client_seq"})
+                continue
+            seen.add((sensor_id, client_seq))
+
+        parsed.append((index, {"sensor_id": sensor_id, "value": value, "unit": unit, "created_at": created_at, "client_seq": client_seq}))
+    return parsed, rejected
+
+def owned_rows(parsed, rejected, owned):
+    """
+    Keep the parsed readings on sensors in owned, stamping those without a device
+    timestamp with one created_at for the batch, and add the rest to rejected as
+    sensor_not_found.
+
+    Returns:
+        list: Rows ready for insert, rejected is sorted by index in place
+    """
+    rows = []
+    created_at = datetime.utcnow()
+    for index, row in parsed:
+        if row["sensor_id"] not in owned:
+            rejected.append({"index": index, "reason": "sensor_not_found"})
+            continue
+        row["created_at"] = row["created_at"] or created_at
+        rows.append(row)
+    rejected.sort(key=lambda error: error["index"])
+    return rows
+
+def _has_client_seq(rows):
+    return any(row["client_seq"] is not None for row in rows)
+
+def client_seq_key():
+    """Columns of the client_seq unique index, which must include the partition key on a partitioned Sensor_Data."""
+    if current_app.config["SENSOR_DATA_PARTITIONED"]:
+        return ["sensor_id", "client_seq", "created_at"]
+    return ["sensor_id", "client_seq"]
+
+def sensor_data_insert(rows, dialect=None):
+    """
+    INSERT for rows into Sensor_Data returning the new ids in parameter order. When any
+    row has a client_seq, rows already stored under the same client_seq_key() are
+    skipped by the database and left out of the result, see written_rows.
+    """
+    returning = (Sensor_Data.id, Sensor_Data.sensor_id, Sensor_Data.client_seq)
+    if not _has_client_seq(rows):
+        return insert(Sensor_Data).returning(*returning, sort_by_parameter_order=True)
+    return dialect_insert(Sensor_Data, dialect).on_conflict_do_nothing(index_elements=client_seq_key()) \
+        .returning(*returning, sort_by_parameter_order=True)
+
+def written_rows(rows, result):
+    """
+    The rows a sensor_data_insert actually wrote, given its result, with their "id" set.
+
+    The result lists the written rows in parameter order. Only rows with a client_seq
+    can be skipped, so each row either matches the next result row or wasn't written.
+    """
+    written, returned = [], iter(result)
+    next_row = next(returned, None)
+    for row in rows:
+        if next_row is None:
+            break
+        if row["client_seq"] is None or (next_row.sensor_id, next_row.client_seq) == (row["sensor_id"], row["client_seq"]):
+            row["id"] = next_row.id
+            written.append(row)
+            next_row = next(returned, None)
+    return written
+
+def write_sensor_data(rows):
+    """
+    Insert rows into Sensor_Data, skipping client readings that are already stored, and
+    fold the new ones into the rollups. Runs in the caller's transaction, the caller commits.
+
+    Returns:
+        list: The rows written
+    """
+    rows = written_rows(rows, db.session.execute(sensor_data_insert(rows), rows))
+    if rows and current_app.config["ROLLUPS_ENABLED"]:
+        rollup_service.update_rollups(rows)
+    return rows
+
+def submit_alerts(rows):
+    """Hand newly committed rows to the alert engine, if it is enabled."""
+    alert_engine = current_app.extensions.get("alert_engine")
+    if rows and alert_engine:
+        alert_engine.submit(rows)
+
+def publish_rows(rows):
+    """Hand rows returned by write_sensor_data to the hot window and the alert engine once committed."""
+    hot_window = current_app.extensions.get("hot_window")
+    if rows and hot_window:
+        hot_window.add([Reading.from_dict(row) for row in rows])
+    submit_alerts(rows)
+
+def queued_row(row):
+    """JSON-safe copy of a row for the ingest queue, see unqueued_row."""
+    return {"sensor_id": row["sensor_id"], "value": row["value"], "unit": row["unit"].value,
+            "created_at": row["created_at"].isoformat(), "client_seq": row["client_seq"]}
+
+def unqueued_row(row):
+    """Row ready for write_sensor_data from a queued_row."""
+    return {"sensor_id": row["sensor_id"], "value": row["value"], "unit": Unit(row["unit"]),
+            "created_at": datetime.fromisoformat(row["created_at"]), "client_seq": row.get("client_seq")}
+
+def batch_key(user_id, idempotency_key=None):
+    """Queue key of a batch: the client's Idempotency-Key scoped to its user, or a random key without one."""
+    if idempotency_key is None:
+        return uuid.uuid4().hex
+    # Hashed so the user prefix can't push a 128 character client key past Ingest_Batches.key
+    return f"{user_id}:{hashlib.sha256(idempotency_key.encode('utf-8')).hexdigest()}"
+
+def queue_sensor_data(user_id, rows, idempotency_key=None):
+    """
+    Append validated rows to the durable ingest queue instead of writing them, the
+    ingest drainer writes them to Sensor_Data shortly after. Idempotency keys are per
+    user and checked against the queue's own client keys only, so batches keep being
+    acknowledged while the main database is unavailable.
+
+    Returns:
+        bool: True once the rows are durably queued, False if the user already sent a batch with this key
+        None: If the queue couldn't be written
+    """
+    ingest_queue = current_app.extensions["ingest_queue"]
+    key = batch_key(user_id, idempotency_key)
+    try:
+        queued = ingest_queue.append(key, user_id, [queued_row(row) for row in rows], client_key=idempotency_key is not None)
+    except sqlite3.Error as e:
+        logger.error(f"Error queueing {len(rows)} sensor data rows for user {user_id}: {e}")
+        return None
+    drainer = current_app.extensions.get("ingest_drainer")
+    if queued and drainer:
+        drainer.start()
+    return queued
+
+def record_ingest(readings, rejected, written=0, duplicates=0, queued=0):
+    """Count an ingest batch in the ingest log summary and the ingest metrics."""
+    ingest_log.add(batches=1, readings=readings, rejected=len(rejected), written=written, duplicates=duplicates, queued=queued)
+    metrics.INGEST_BATCHES.inc()
+    for outcome, count in (("written", written), ("duplicate", duplicates), ("queued", queued)):
+        if count:
+            metrics.INGEST_READINGS.inc(count, outcome=outcome)
+    for error in rejected:
+        metrics.INGEST_REJECTED.inc(reason=error["reason"])
+
+# Rate limited ingest is logged as periodic totals too
+rate_limit_log = LogSummary("Ingest rate limited")
+
+def budget_wait(user_id, rows=(), request=False, action="delayed"):
+    """
+    Charge a request and rows to the user's and their sensors' budgets, see RateLimiter.
+
+    Args:
+        user_id (Integer): ID of the user
+        rows (list): Rows from owned_rows, only sensors the user owns get a budget of their own
+        request (Boolean): Whether to charge one request
+        action (String): rate_limited_total label when over budget
+
+    Returns:
+        float: 0 once charged (or with rate limiting disabled), else seconds until the budgets could be
+    """
+    limiter = current_app.extensions.get('rate_limiter')
+    wait = limiter.check(user_id, rows, request=request) if limiter else 0
+    if wait:
+        metrics.RATE_LIMITED.inc(action=action)
+    return wait
+
+def check_rate_limit(user_id, rows=(), request=True):
+    """
+    Charge an ingest request (unless request=False) and its accepted rows, see budget_wait.
+
+    Returns:
+        None: Within budget, or rate limiting is disabled
+        dict: {"error": str, "code": 429, "retry_after": int} when over budget, nothing is charged
+    """
+    wait = budget_wait(user_id, rows, request=request, action="refused")
+    if not wait:
+        return None
+    rate_limit_log.add(refused=1, readings=len(rows))
+    retry_after = current_app.extensions['rate_limiter'].retry_after(wait)
+    return {"error": f"Rate limit exceeded, retry in {retry_after}s", "code": 429, "retry_after": retry_after}
+
+def log_sensor_data(user_id, data, idempotency_key=None, pace=False):
+    """
+    Validate and insert a batch of readings.
+
+    Ownership is checked once per distinct sensor in the batch and accepted rows are
+    written with a single multi-row INSERT. Invalid readings are rejected individually
+    instead of failing the whole batch. When the ingest queue is enabled accepted rows
+    are queued durably instead and written in the background.
+
+    Accepted rows are charged to the user's and sensors' row budgets before they are
+    written, refusing the whole batch when over budget.
+
+    Args:
+        user_id (Integer): ID of the user posting the readings
+        data (list): Reading dicts of the form {"sensor_id", "unit", "value"}
+        idempotency_key (String): Client key for the batch, a queued batch is only written once per key and user
+        pace (Boolean): Wait for the row budgets instead of refusing the batch, for streams
+
+    Returns:
+        dict: {"accepted": int, "rejected": int, "errors": [{"index", "reason"}]}, plus "queued": True if
+        queued, or "duplicates": int, the accepted readings that were already stored under their client_seq
+        (all of them when the user already sent a batch with this idempotency_key)
+        dict: {"error": str} if the insert fails
+        dict: {"error": str, "code": 429, "retry_after": int} when over budget, see check_rate_limit
+    """
+    parsed, rejected = parse_readings(data)
+    owned = auth_service.owned_sensor_ids(user_id, {row["sensor_id"] for _, row in parsed})
+    rows = owned_rows(parsed, rejected, owned)
+    if pace:
+        while wait := budget_wait(user_id, rows):
+            time.sleep(wait)
+    else:
+        limited = check_rate_limit(user_id, rows, request=False)
+        if limited:
+            return limited
+    result = {"accepted": len(rows), "rejected": len(rejected), "errors": rejected}
+
+    if rows and current_app.config["INGEST_QUEUE_ENABLED"]:
+        queued = queue_sensor_data(user_id, rows, idempotency_key)
+        if queued is None:
+            return {"error": "Error adding sensor data"}
+        if not queued:
+            logger.debug(f"Skipped a repeated batch of {len(rows)} data points for user {user_id}")
+            record_ingest(len(data), rejected, duplicates=len(rows))
+            return dict(result, duplicates=len(rows))
+        logger.debug(f"{len(rows)} out of {len(data)} requested data points were queued for user {user_id}")
+        record_ingest(len(data), rejected, queued=len(rows))
+        return dict(result, queued=True)
+
+    if rows:
         try:
-            sensor_data = Sensor_Data(sensor_id=sensor_id, value=value, unit=unit)
-            db.session.add(sensor_data)
-            readings_added.append(sensor_data)
-            logger.info(f'Successfully added sensor data for sesor {sensor_id}')
-        except SQLAlchemyError:
-            logger.error(f"Error adding sensor data for sensor {sensor_id}")
+            written = write_sensor_data(rows)
+            db.session.commit()
+        except SQLAlchemyError as e:
             db.session.rollback()
+            logger.error(f"Error adding {len(rows)} sensor data rows for user {user_id}: {e}")
             return {"error": "Error adding sensor data"}
-    logger.info(f"{len(readings_added)} out of {len(data)} requested data were points added for {user_id}")
-    db.session.commit()
-    return [reading.to_dict() for reading in readings_added]
+        publish_rows(written)
+        result["duplicates"] = len(rows) - len(written)
+
+    logger.debug(f"{len(rows)} out of {len(data)} requested data points were added for user {user_id}")
+    record_ingest(len(data), rejected, written=len(rows) - result.get("duplicates", 0), duplicates=result.get("duplicates", 0))
+    return result
+
+def encode_cursor(created_at, data_id):
+    """Encode the (created_at, id) keyset position of a row as an opaque string."""
+    raw = f"{created_at.isoformat()}|{data_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
 
-def get_sensor_data(user_id, sensor_id, filters):
+def decode_cursor(cursor):
+    """Decode a cursor from encode_cursor, returning (created_at, id) or None if it is malformed."""
     try:
-        sensor = Sensor.query.filter_by(id=sensor_id, user_id=user_id).first()
-        if not sensor:
-            return {"error": "Sensor not found", "code": 404}
+        created_at, data_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(data_id)
+    except (ValueError, UnicodeError, AttributeError):
+        return None
+
+def window_cutoff(filters):
+    """Start of the days/hours/mins window in filters, or None when no window is set."""
+    time_delta = timedelta(days=filters.get("days") or 0, hours=filters.get("hours") or 0, minutes=filters.get("mins") or 0)
+    if time_delta.total_seconds() > 0:
+        return datetime.utcnow() - time_delta
+    return None
+
+def filter_window(query, filters):
+    """Apply the time window and unit filters to a Sensor_Data query."""
+    cutoff = window_cutoff(filters)
+    if cutoff is not None:
+        query = query.filter(Sensor_Data.created_at >= cutoff)
+
+    unit = filters.get("unit")
+    if unit:
+        query = query.filter(Sensor_Data.unit == _UNITS.get(unit, unit))
+    return query
+
+def filtered_data_query(sensor_id, filters):
+    """Build the Sensor_Data query for a sensor with the time window and unit filters applied."""
+    return filter_window(Sensor_Data.query.filter_by(sensor_id=sensor_id), filters)
+
+def _after_cursor(query, cursor):
+    """Restrict a newest-first query to rows strictly older than the cursor position."""
+    created_at, data_id = cursor
+    return query.filter(or_(
+        Sensor_Data.created_at < created_at,
+        and_(Sensor_Data.created_at == created_at, Sensor_Data.id < data_id),
+    ))
 
-        # --- Time delta unpack ---
-        days = filters.get("days")
-        hours = filters.get("hours")   
-        mins = filters.get("mins")
-        time_delta = timedelta(days=days, hours=hours, minutes=mins)
+def _percentile(query, count, fraction):
+    """Linearly interpolated percentile using ORDER BY/OFFSET, for databases without percentile_cont."""
+    position = fraction * (count - 1)
+    lower = math.floor(position)
+    values = [row.value for row in query.with_entities(Sensor_Data.value).order_by(Sensor_Data.value).offset(lower).limit(2)]
+    if len(values) == 1:
+        return values[0]
+    return values[0] + (values[1] - values[0]) * (position - lower)
 
+def _newest_first(query):
+    return query.order_by(Sensor_Data.created_at.desc(), Sensor_Data.id.desc())
+
+def _sync_hot_window(hot_window, sensor_id):
+    """Seed or refresh a sensor's hot window series from the database when it is due."""
+    due, after_id = hot_window.due(sensor_id)
+    if due == "seed":
+        cutoff = datetime.utcnow() - timedelta(seconds=hot_window.max_age)
         query = Sensor_Data.query.filter_by(sensor_id=sensor_id)
+        readings = [Reading.from_row(row) for row in _newest_first(query.filter(Sensor_Data.created_at >= cutoff)).limit(hot_window.max_readings + 1)]
+        latest = None
+        if not readings:
+            row = _newest_first(query).first()
+            latest = Reading.from_row(row) if row else None
+        hot_window.seed(sensor_id, cutoff, readings, latest)
+    elif due == "refresh":
+        rows = Sensor_Data.query.filter(Sensor_Data.sensor_id == sensor_id, Sensor_Data.id > after_id).order_by(Sensor_Data.id)
+        hot_window.refresh(sensor_id, [Reading.from_row(row) for row in rows])
 
-        # --- Time-based filter ---
-        if time_delta.total_seconds() > 0:
-            cutoff = datetime.utcnow() - time_delta
-            query = query.filter(Sensor_Data.created_at >= cutoff)
+def hot_window_readings(sensor_id, filters):
+    """
+    A sensor's readings in the filters' time window and unit from the hot window, oldest
+    first, or None when the window isn't cached (no hot window, no time window, or a
+    window reaching further back than HOT_WINDOW_SECONDS) and the database must be read.
+    """
+    hot_window = current_app.extensions.get("hot_window")
+    cutoff = window_cutoff(filters)
+    if hot_window is None or cutoff is None or cutoff < datetime.utcnow() - timedelta(seconds=hot_window.max_age):
+        return None
+    sensor_id = to_int(sensor_id)
+    _sync_hot_window(hot_window, sensor_id)
+    readings = hot_window.window(sensor_id, cutoff)
+    unit = filters.get("unit")
+    if readings is not None and unit:
+        unit = getattr(_UNITS.get(unit), "value", unit)
+        readings = [reading for reading in readings if reading.unit == unit]
+    return readings
 
-        # --- Optional filters from params ---
-        unit = filters.get("unit")
-        if unit:
-            query = query.filter(Sensor_Data.unit == unit)
+def discard_hot_window(sensor_id):
+    """Drop a sensor's cached readings after some were deleted."""
+    hot_window = current_app.extensions.get("hot_window")
+    if hot_window:
+        hot_window.discard(to_int(sensor_id))
 
-        # --- Execute filtered query ---
-        data_rows = query.order_by(Sensor_Data.created_at.desc()).all()
-        data_dicts = [d.to_dict() for d in data_rows]
+def summarize_readings(readings, percentiles=()):
+    """_summarize over readings already in memory, e.g. from the hot window."""
+    values = sorted(reading.value for reading in readings)
+    count = len(values)
+    summary = summary_from_row((count, sum(values) / count, values[0], values[-1], sum(v * v for v in values) / count) if count else (0, None, None, None, None))
+    if percentiles:
+        summary["percentiles"] = {f"p{p:g}": _interpolate(values, p / 100) if count else "n/a" for p in percentiles}
+    return summary
+
+def _interpolate(values, fraction):
+    position = fraction * (len(values) - 1)
+    lower = math.floor(position)
+    if lower + 1 >= len(values):
+        return values[lower]
+    return values[lower] + (values[lower + 1] - values[lower]) * (position - lower)
+
+def summary_columns():
+    """Aggregate columns read by summary_from_row."""
+    value = Sensor_Data.value
+    return [func.count(value), func.avg(value), func.min(value), func.max(value), func.avg(value * value)]
+
+def summary_from_row(row):
+    """Build the count/average/min/max/stddev summary from a row of summary_columns()."""
+    count, stat_avg, stat_min, stat_max, mean_square = row[:5]
+    if not count:
+        return {"average": "n/a", "min": "n/a", "max": "n/a", "stddev": "n/a", "count": 0}
+    return {
+        "average": stat_avg,
+        "min": stat_min,
+        "max": stat_max,
+        "stddev": math.sqrt(max(mean_square - stat_avg * stat_avg, 0.0)),
+        "count": count,
+    }
+
+def _summarize(query, percentiles=()):
+    """
+    Compute count/average/min/max/stddev (and optional percentiles) of a filtered
+    Sensor_Data query with SQL aggregates, without fetching any rows.
+
+    Args:
+        query (Query): Filtered Sensor_Data query
+        percentiles (iterable): Percentiles between 0 and 100 to compute
+
+    Returns:
+        dict: Summary statistics, with 'n/a' in place of stats when there are no rows
+    """
+    value = Sensor_Data.value
+    columns = summary_columns()
 
-        # --- Compute stats ---        
-        values = [data['value'] for data in data_dicts]
-        if len(values) == 0:
-            stat_avg = stat_max = stat_min = 'n/a'
+    # PostgreSQL can compute every percentile in the same round-trip
+    is_postgres = db.session.get_bind().dialect.name == "postgresql"
+    if is_postgres:
+        columns += [func.percentile_cont(p / 100).within_group(value) for p in percentiles]
+
+    row = query.with_entities(*columns).order_by(None).one()
+    summary = summary_from_row(row)
+    if not summary["count"]:
+        if percentiles:
+            summary["percentiles"] = {f"p{p:g}": "n/a" for p in percentiles}
+        return summary
+
+    if percentiles:
+        if is_postgres:
+            values = row[5:]
         else:
-            stat_avg = sum(values)/len(values)
-            stat_min = min(values)
-            stat_max = min(values), max(values)
+            values = [_percentile(query, summary["count"], p / 100) for p in percentiles]
+        summary["percentiles"] = {f"p{p:g}": v for p, v in zip(percentiles, values)}
+    return summary
+
+def summarize_sensor_data(user_id, sensor_id, filters, percentiles=(50, 90, 99)):
+    """
+    Return only the summary statistics for a sensor's filtered readings.
+
+    Returns:
+        dict: {"summary": {...}}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        if not auth_service.owns_sensor(user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+        readings = hot_window_readings(sensor_id, filters)
+        if readings is not None:
+            return {"summary": summarize_readings(readings, percentiles)}
+        return {"summary": _summarize(filtered_data_query(sensor_id, filters), percentiles)}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error summarizing sensor data for sensor {sensor_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def get_sensor_data(user_id, sensor_id, filters, limit=1000):
+    """
+    Return one page of a sensor's readings, newest first.
+
+    Pages are keyed on (created_at, id) so fetching page N costs the same as page 1
+    regardless of how much history the sensor has.
+
+    Args:
+        user_id (Integer): ID of the user that must own the sensor
+        sensor_id (Integer): ID of the sensor to read
+        filters (dict): days/hours/mins window, unit, and an optional cursor from a previous page
+        limit (Integer): Maximum rows in the page
+
+    Returns:
+        dict: {"data": [...], "summary": {...}, "next_cursor": str or None}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        if not auth_service.owns_sensor(user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+
+        cursor = None
+        if filters.get("cursor"):
+            cursor = decode_cursor(filters["cursor"])
+            if not cursor:
+                return {"error": "Invalid cursor", "code": 400}
+
+        # Recent windows are served from memory
+        readings = hot_window_readings(sensor_id, filters)
+        if readings is not None:
+            return _hot_window_page(readings, cursor, limit)
+
+        query = filtered_data_query(sensor_id, filters)
+        if cursor:
+            query = _after_cursor(query, cursor)
+
+        # --- Fetch one extra row to know whether another page exists ---
+        data_rows = _newest_first(query).limit(limit + 1).all()
+        next_cursor = None
+        if len(data_rows) > limit:
+            data_rows = data_rows[:limit]
+            next_cursor = encode_cursor(data_rows[-1].created_at, data_rows[-1].id)
+        data_dicts = [d.to_dict() for d in data_rows]
 
         return {
             "data": data_dicts,
-            "summary": {
-                "average": stat_avg,
-                "min": stat_min,
-                "max": stat_max,
-                "count": len(data_dicts),
-            },
+            "summary": _summarize(filtered_data_query(sensor_id, filters)),
+            "next_cursor": next_cursor,
         }
 
     except SQLAlchemyError as e:
@@ -173,14 +671,168 @@ def get_sensor_data(user_id, sensor_id, filters):
         logger.error(f"Error fetching sensor data for sensor {sensor_id}: {e}")
         return {"error": "Internal service error", "code": 500}
 
+def _hot_window_page(readings, cursor, limit):
+    """get_sensor_data's page built from hot window readings (oldest first)."""
+    end = bisect.bisect_left(readings, cursor) if cursor else len(readings)
+    page = readings[max(end - limit, 0):end][::-1]
+    next_cursor = encode_cursor(page[-1].created_at, page[-1].id) if end > limit else None
+    return {
+        "data": [reading.to_dict() for reading in page],
+        "summary": summarize_readings(readings),
+        "next_cursor": next_cursor,
+    }
+
+def get_many_sensor_data(user_id, sensor_ids, filters, limit=100):
+    """
+    Return the newest readings and the summary of many sensors in one query, instead of
+    one get_sensor_data call per sensor.
+
+    Readings are ranked per sensor with ROW_NUMBER() and summarized with the summary
+    aggregates as window functions partitioned by sensor_id, so a fleet of sensors costs
+    one round-trip and one pass over ix_sensor_data_sensor_created.
+
+    Args:
+        user_id (Integer): ID of the user that must own the sensors
+        sensor_ids (list): IDs of the sensors to read, or None for all of the user's sensors
+        filters (dict): days/hours/mins window and unit
+        limit (Integer): Maximum readings per sensor, newest first
+
+    Returns:
+        dict: {"sensors": {sensor_id: {"data": [...], "summary": {...}}}, "missing": [ids not found]}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        if sensor_ids is None:
+            owned, missing = set(db.session.scalars(select(Sensor.id).where(Sensor.user_id == user_id))), []
+        else:
+            owned = auth_service.owned_sensor_ids(user_id, set(sensor_ids))
+            missing = sorted(set(sensor_ids) - owned)
+
+        sensors = {sensor_id: {"data": [], "summary": summary_from_row((0, None, None, None, None))} for sensor_id in sorted(owned)}
+        if owned:
+            over = {"partition_by": Sensor_Data.sensor_id}
+            rank = func.row_number().over(order_by=(Sensor_Data.created_at.desc(), Sensor_Data.id.desc()), **over).label("rank")
+            aggregates = [column.over(**over).label(f"summary_{i}") for i, column in enumerate(summary_columns())]
+            ranked = filter_window(
+                db.session.query(Sensor_Data.id, Sensor_Data.sensor_id, Sensor_Data.value, Sensor_Data.unit, Sensor_Data.created_at,
+                                 Sensor_Data.client_seq, rank, *aggregates).filter(Sensor_Data.sensor_id.in_(owned)),
+                filters,
+            ).subquery()
+
+            rows = db.session.query(ranked).filter(ranked.c.rank <= limit).order_by(ranked.c.sensor_id, ranked.c.rank)
+            for row in rows:
+                sensor = sensors[row.sensor_id]
+                if row.rank == 1:
+                    sensor["summary"] = summary_from_row([getattr(row, f"summary_{i}") for i in range(len(aggregates))])
+                sensor["data"].append({
+                    "id": row.id,
+                    "sensor_id": row.sensor_id,
+                    "value": row.value,
+                    "unit": row.unit.value,
+                    "created_at": row.created_at.isoformat(),
+                    "client_seq": row.client_seq,
+                })
+
+        logger.info(f"Fetched sensor data for {len(sensors)} sensors of user {user_id}")
+        return {"sensors": sensors, "missing": missing}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error fetching sensor data for sensors of user {user_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def get_latest_sensor_data(user_id, sensor_id):
+    """
+    Return a sensor's newest reading, from the hot window when it is enabled.
+
+    Returns:
+        dict: {"data": {...} or None if the sensor has no readings}
+        dict: {"error": str, "code": int} on failure
+    """
+    try:
+        if not auth_service.owns_sensor(user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+
+        hot_window = current_app.extensions.get("hot_window")
+        if hot_window:
+            _sync_hot_window(hot_window, to_int(sensor_id))
+            found, latest = hot_window.latest(to_int(sensor_id))
+            if found:
+                return {"data": latest.to_dict() if latest else None}
+
+        row = _newest_first(Sensor_Data.query.filter_by(sensor_id=sensor_id)).first()
+        return {"data": row.to_dict() if row else None}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error fetching latest sensor data for sensor {sensor_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+def sensor_data_rows(user_id, sensor_id, filters, chunk_size=1000):
+    """
+    Query for a sensor's filtered readings newest first, fetched from a server-side
+    cursor chunk_size rows at a time so memory stays bounded by the chunk size rather
+    than the length of the sensor's history.
+
+    Returns:
+        Query: Iterable of Sensor_Data rows
+        dict: {"error": str, "code": int} if the sensor can't be read
+    """
+    try:
+        if not auth_service.owns_sensor(user_id, sensor_id):
+            return {"error": "Sensor not found", "code": 404}
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"Error fetching sensor data for sensor {sensor_id}: {e}")
+        return {"error": "Internal service error", "code": 500}
+
+    query = filtered_data_query(sensor_id, filters)
+    if filters.get("cursor"):
+        cursor = decode_cursor(filters["cursor"])
+        if not cursor:
+            return {"error": "Invalid cursor", "code": 400}
+        query = _after_cursor(query, cursor)
+    return query.order_by(Sensor_Data.created_at.desc(), Sensor_Data.id.desc()).yield_per(chunk_size)
+
+def stream_sensor_data(user_id, sensor_id, filters, chunk_size=1000, encoding="ndjson"):
+    """
+    Stream a sensor's readings newest first, see sensor_data_rows.
+
+    Args:
+        encoding (String): "ndjson" for one JSON document per line, or "packed" for
+        the binary format in app/packed.py
+
+    Returns:
+        generator: Yields encoded chunks
+        dict: {"error": str, "code": int} if the sensor can't be read
+    """
+    query = sensor_data_rows(user_id, sensor_id, filters, chunk_size)
+    if isinstance(query, dict):
+        return query
+
+    def generate():
+        try:
+            if encoding == "packed":
+                yield from packed.encode_rows(query, block_size=chunk_size)
+            else:
+                for row in query:
+                    yield json.dumps(row.to_dict()) + "\n"
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Error streaming sensor data for sensor {sensor_id}: {e}")
+            if encoding != "packed":
+                yield json.dumps({"error": "Internal service error"}) + "\n"
+    return generate()
+
 def remove_sensor_data(user_id, sensor_id, data_id):
     try:
-        sensor = Sensor.query.filter_by(id=sensor_id, user_id=user_id).first()
-        if not sensor:
+        if not auth_service.owns_sensor(user_id, sensor_id):
             return {"error": "Sensor not found", "code": 404}
 
-        deleted = Sensor_Data.query.filter_by(id=data_id).delete()
+        reading = Sensor_Data.query.filter_by(id=data_id, sensor_id=sensor_id).first()
+        deleted = Sensor_Data.query.filter_by(id=data_id, sensor_id=sensor_id).delete()
+        if deleted and current_app.config["ROLLUPS_ENABLED"]:
+            rollup_service.rebuild_buckets(sensor_id, reading.created_at)
         db.session.commit()
+        discard_hot_window(sensor_id)
         logger.info(f"Deleted {deleted} data rows for sensor {sensor_id}")
         if deleted:
             return {"msg": f"Successfully removed sensor data ID {data_id} for sensor {sensor_id}"}
@@ -192,15 +844,16 @@ def remove_sensor_data(user_id, sensor_id, data_id):
         return {"error": "Internal service error", "code": 500}
 
 
-def remove_all_sensor_data(user_id, sensor_id):
+def remove_all_sensor_data(user_id, sensor_id, batch_size=5000):
     try:
-        sensor = Sensor.query.filter_by(id=sensor_id, user_id=user_id).first()
-        if not sensor:
+        if not auth_service.owns_sensor(user_id, sensor_id):
             return {"error": "Sensor not found", "code": 404}
         
-        deleted = Sensor_Data.query.filter_by(sensor_id=sensor_id).delete()
+        deleted = delete_sensor_data_in_batches(Sensor_Data.sensor_id == sensor_id, batch_size=batch_size)
+        Sensor_Rollup.query.filter_by(sensor_id=sensor_id).delete()
 
         db.session.commit()
+        discard_hot_window(sensor_id)
         logger.info(f"Deleted all data rows for sensor {sensor_id}")
         if deleted:
             return {"msg": f"Successfully removed sensor data for sensor {sensor_id}"}
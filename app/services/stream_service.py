@@ -0,0 +1,192 @@
+from app.services import sensor_service
+from app import metrics, compression
+from app.logger import logger
+from threading import Thread, Event
+import json
+import queue
+import time
+
+_EOF = object()
+
+class ReadingBuffer:
+    """
+    Bounded buffer of streamed readings that is written through log_sensor_data
+    once it holds max_size readings or its oldest reading is max_age seconds old.
+
+    A batch over the user's row budgets waits for them before being written (log_sensor_data
+    with pace=True), which stops reads from the stream and so slows the client down.
+    """
+
+    def __init__(self, user_id, max_size, max_age):
+        self.user_id = user_id
+        self.max_size = max_size
+        self.max_age = max_age
+        self.seq = 0
+        self.accepted = 0
+        self.rejected = 0
+        self._readings = []
+        self._indexes = []
+        self._errors = []
+        self._opened_at = None
+
+    def __len__(self):
+        return len(self._readings) + len(self._errors)
+
+    @property
+    def full(self):
+        return len(self) >= self.max_size
+
+    def time_until_due(self):
+        """Seconds until the buffer must be flushed, or None if it is empty."""
+        if self._opened_at is None:
+            return None
+        return max(0.0, self._opened_at + self.max_age - time.monotonic())
+
+    def add(self, index, reading):
+        if self._opened_at is None:
+            self._opened_at = time.monotonic()
+        self._readings.append(reading)
+        self._indexes.append(index)
+
+    def reject(self, index, reason):
+        if self._opened_at is None:
+            self._opened_at = time.monotonic()
+        self._errors.append({"index": index, "reason": reason})
+        metrics.INGEST_REJECTED.inc(reason=reason)
+
+    def take(self):
+        """Empty the buffer, returning the (readings, indexes, errors) to be written and acknowledged."""
+        batch = self._readings, self._indexes, self._errors
+        self._readings, self._indexes, self._errors = [], [], []
+        self._opened_at = None
+        self.seq += 1
+        return batch
+
+    def flush(self):
+        """
+        Write the buffered readings and return an ack.
+
+        Returns:
+            dict: {"seq", "accepted", "rejected", "errors"} where error indexes refer to line numbers in the stream
+            dict: {"seq", "error"} if the write failed, in which case the buffered readings are dropped
+        """
+        readings, indexes, errors = self.take()
+        result = sensor_service.log_sensor_data(user_id=self.user_id, data=readings, pace=True) if readings else {"accepted": 0, "errors": []}
+        return self.acknowledge(readings, indexes, errors, result)
+
+    def acknowledge(self, readings, indexes, errors, result):
+        """Build the ack for a batch from take() given the result of writing its readings."""
+        if "error" in result:
+            self.rejected += len(readings) + len(errors)
+            return {"seq": self.seq, "error": result["error"], "rejected": len(readings) + len(errors)}
+
+        errors.extend({"index": indexes[error["index"]], "reason": error["reason"]} for error in result["errors"])
+        errors.sort(key=lambda error: error["index"])
+        self.accepted += result["accepted"]
+        self.rejected += len(errors)
+        return {"seq": self.seq, "accepted": result["accepted"], "rejected": len(errors), "errors": errors}
+
+    def summary(self, lines, error=None):
+        """The stream's last line, {"done": true} and its totals, or {"error"} and the totals if the body couldn't be decoded."""
+        end = {"error": str(error)} if error else {"done": True}
+        return dict(end, lines=lines, accepted=self.accepted, rejected=self.rejected)
+
+
+def _put(lines, item, stop):
+    """Put onto the bounded queue, waiting while it is full until the consumer has gone away."""
+    while not stop.is_set():
+        try:
+            lines.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _read_lines(stream, lines, max_line, stop):
+    """
+    Push raw lines from the request stream onto a bounded queue, blocking while it is full until
+    stop is set. A body that can't be decoded is pushed as its EncodedBodyError, ahead of _EOF.
+    """
+    try:
+        while not stop.is_set():
+            line = stream.readline(max_line)
+            if not line:
+                break
+            if len(line) >= max_line and not line.endswith(b"\n"):
+                # Oversized line, discard the remainder so the next read starts on a fresh line
+                while line and not line.endswith(b"\n"):
+                    line = stream.readline(max_line)
+                line = None
+            if not _put(lines, line, stop):
+                break
+    except compression.EncodedBodyError as e:
+        _put(lines, e, stop)
+    except Exception as e:
+        logger.info(f"Ingest stream closed by client: {e}")
+    finally:
+        _put(lines, _EOF, stop)
+
+def ingest_stream(user_id, stream, batch_size=500, flush_interval=0.25, queue_size=10000, max_line=4096):
+    """
+    Consume newline-delimited JSON readings from a long-lived request body.
+
+    Lines are read on a helper thread into a bounded queue so a slow database applies
+    backpressure to the client instead of growing memory. Readings are written through
+    a ReadingBuffer which flushes on size or age, and one NDJSON ack is yielded per flush.
+
+    Args:
+        user_id (Integer): ID of the authenticated user
+        stream (file-like): Request body stream
+        batch_size (Integer): Maximum readings per write
+        flush_interval (Float): Maximum seconds a reading may wait in the buffer
+        queue_size (Integer): Maximum raw lines held between the socket and the buffer
+        max_line (Integer): Maximum bytes per line, longer lines are rejected
+
+    Yields:
+        str: One JSON ack per flush followed by a final {"done": true} summary, or an
+            {"error": str} summary if the gzip body couldn't be decoded
+    """
+    lines = queue.Queue(maxsize=queue_size)
+    # Set when the generator finishes or is closed (client gone), so the reader can't block forever on a full queue
+    stop = Event()
+    Thread(target=_read_lines, args=(stream, lines, max_line, stop), daemon=True).start()
+    try:
+        buffer = ReadingBuffer(user_id=user_id, max_size=batch_size, max_age=flush_interval)
+        index = 0
+        error = None
+        while True:
+            try:
+                line = lines.get(timeout=buffer.time_until_due())
+            except queue.Empty:
+                yield json.dumps(buffer.flush()) + "\n"
+                continue
+
+            if line is _EOF:
+                break
+            if isinstance(line, compression.EncodedBodyError):
+                error = line
+                break
+            if line is None:
+                buffer.reject(index, "line_too_long")
+            elif line.strip():
+                try:
+                    buffer.add(index, json.loads(line))
+                except ValueError:
+                    buffer.reject(index, "invalid_json")
+            else:
+                continue
+            index += 1
+
+            if buffer.full or buffer.time_until_due() == 0:
+                yield json.dumps(buffer.flush()) + "\n"
+
+        if len(buffer):
+            yield json.dumps(buffer.flush()) + "\n"
+
+        if error:
+            logger.warning(f"Ingest stream for user {user_id} ended on a bad body after {index} lines: {error}")
+        else:
+            logger.info(f"Ingest stream for user {user_id} closed after {index} lines, {buffer.accepted} accepted")
+        yield json.dumps(buffer.summary(index, error)) + "\n"
+    finally:
+        stop.set()
@@ -0,0 +1,28 @@
+import os
+
+def init_app(app):
+    """
+    Register background job commands with the Flask CLI and attach the ingest drainer and alert engine.
+
+    Usage:
+        flask --app wsgi sensors repair-rollups --hours 24
+    """
+    from app.tasks import sensor_jobs
+    app.cli.add_command(sensor_jobs.sensor_cli)
+    sensor_jobs.init_app(app)
+
+    from app.tasks import alert_jobs
+    alert_jobs.init_app(app)
+
+
+def start_when_serving(app, worker):
+    """
+    Start a background worker (anything with an idempotent start()) in this process now,
+    and check it on every request so it is started again in a worker forked after it.
+
+    Not started now under the `flask` CLI: commands don't serve requests and may run before
+    the tables exist. `flask run` starts it on its first request instead.
+    """
+    if os.environ.get("FLASK_RUN_FROM_CLI") != "true":
+        worker.start()
+    app.before_request(worker.start)
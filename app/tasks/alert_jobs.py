@@ -0,0 +1,276 @@
+"""
+Alert rule evaluation.
+
+Threshold and rate rules are evaluated by an AlertEngine holding each rule's state
+(firing, last value, cooldown) in memory, so every reading of a sensor must reach the same
+engine. Either run the engine inside the web process (ALERT_ENGINE_IN_PROCESS, only correct
+when a single process handles all ingest) or, with several workers, turn that off and run
+exactly one `flask alerts run`, which reads new readings back from the database.
+
+no_data rules are evaluated from the database by sweep_no_data, which every engine runs
+every ALERT_SWEEP_SECONDS. A database lock lets one sweep run at a time, the others skip.
+
+Usage:
+    flask --app wsgi alerts run
+    flask --app wsgi alerts sweep-no-data
+"""
+
+from app.extensions import db
+from app.models import Sensor_Data, Alert_Rule
+from app.services import alert_service
+from app.logger import logger
+from app.tasks import start_when_serving
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import select, func
+from sqlalchemy.exc import SQLAlchemyError
+from threading import Thread, Lock
+import click
+import queue
+import time
+import os
+
+alert_cli = AppGroup('alerts', help='Alert rule evaluation jobs.')
+
+class AlertEngine:
+    """
+    Evaluates alert rules against ingested readings off the request path.
+
+    Readings are sharded by sensor_id onto a fixed pool of worker threads, each with its
+    own bounded queue, so every sensor's readings are evaluated in order by a single
+    thread and rule state needs no locking. Rules are cached in memory and refreshed
+    periodically, so the cost per reading is O(rules on that sensor). The refresh thread
+    also sweeps no_data rules.
+
+    submit() never blocks, when a shard's queue is full the readings are dropped and
+    counted rather than slowing ingest down.
+    """
+
+    def __init__(self, app, workers=2, queue_size=10000, refresh_seconds=30, sweep_seconds=5):
+        self.app = app
+        self.refresh_seconds = refresh_seconds
+        self.sweep_seconds = sweep_seconds
+        self.dropped = 0
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._rules = {}
+        self._states = {}
+        self._pid = None
+        self._running = False
+        self._lock = Lock()
+        self._tables = False
+
+    def start(self):
+        """Start the worker threads, again in a process forked after they were started."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads don't survive fork, and inherited queues may hold locks of threads that no longer exist
+            if self._pid is not None:
+                self._queues = [queue.Queue(maxsize=inbox.maxsize) for inbox in self._queues]
+                self._states = {}
+            self._pid = os.getpid()
+            self._running = True
+        self.reload_rules()
+        for shard in range(len(self._queues)):
+            Thread(target=self._work, args=(shard,), name=f"alert-worker-{shard}", daemon=True).start()
+        Thread(target=self._refresh, name="alert-rule-refresh", daemon=True).start()
+        logger.info(f"Alert engine started with {len(self._queues)} workers")
+
+    def stop(self):
+        self._running = False
+
+    def tables_exist(self):
+        """Whether the alert tables exist, the engine can start before db.create_all() ran."""
+        if not self._tables:
+            try:
+                with self.app.app_context():
+                    self._tables = db.inspect(db.engine).has_table(Alert_Rule.__tablename__)
+            except SQLAlchemyError as e:
+                logger.error(f"Error checking for alert tables: {e}")
+            if not self._tables:
+                logger.debug("Alert tables don't exist yet, not evaluating rules")
+        return self._tables
+
+    def reload_rules(self):
+        """Reload active rules from the database, swapping the cache in one assignment."""
+        if not self.tables_exist():
+            return
+        try:
+            with self.app.app_context():
+                self._rules = alert_service.load_active_rules()
+        except SQLAlchemyError as e:
+            logger.error(f"Error loading alert rules: {e}")
+
+    def sweep(self):
+        """Raise alerts for silent sensors, see alert_service.sweep_no_data."""
+        if self.tables_exist():
+            with self.app.app_context():
+                alert_service.sweep_no_data()
+
+    def sensor_ids(self):
+        """Sensors with at least one active rule."""
+        return list(self._rules)
+
+    def submit(self, rows):
+        """Queue newly committed readings (dicts with sensor_id, value, created_at) for evaluation."""
+        self.start()
+        by_sensor = {}
+        for row in rows:
+            if row["sensor_id"] in self._rules:
+                by_sensor.setdefault(row["sensor_id"], []).append((row["value"], row["created_at"]))
+
+        for sensor_id, readings in by_sensor.items():
+            try:
+                self._queues[sensor_id % len(self._queues)].put_nowait((sensor_id, readings))
+            except queue.Full:
+                self.dropped += len(readings)
+                logger.warning(f"Alert queue full, dropped {len(readings)} readings for sensor {sensor_id}")
+
+    def _evaluate(self, item):
+        sensor_id, readings = item
+        alerts = []
+        for rule in self._rules.get(sensor_id, ()):
+            state = self._states.get(rule["id"])
+            if state is None:
+                state = self._states[rule["id"]] = alert_service.new_state()
+            for value, at in readings:
+                alert = alert_service.evaluate_reading(rule, state, value, at)
+                if alert:
+                    alerts.append(alert)
+        return alerts
+
+    def _work(self, shard):
+        inbox = self._queues[shard]
+        while self._running:
+            try:
+                items = [inbox.get(timeout=1)]
+            except queue.Empty:
+                continue
+            # Drain whatever else is waiting so alerts are written in one insert
+            while len(items) < 500:
+                try:
+                    items.append(inbox.get_nowait())
+                except queue.Empty:
+                    break
+
+            alerts = []
+            for item in items:
+                alerts.extend(self._evaluate(item))
+            if alerts:
+                with self.app.app_context():
+                    alert_service.write_alerts(alerts)
+
+    def _refresh(self):
+        """Periodically sweep no_data rules and pick up rules created or changed by other processes."""
+        reloaded_at = time.monotonic()
+        while self._running:
+            time.sleep(self.sweep_seconds)
+            try:
+                if time.monotonic() - reloaded_at >= self.refresh_seconds:
+                    self.reload_rules()
+                    reloaded_at = time.monotonic()
+                self.sweep()
+            except Exception as e:
+                # Keep the thread alive, the next pass retries
+                logger.error(f"Alert refresh pass failed: {e!r}")
+
+
+class ReadingTail:
+    """
+    Readings committed since the last poll, read back from Sensor_Data for an engine running
+    apart from the web workers.
+
+    Ids are allocated before commit, so a concurrent transaction can commit a lower id after
+    a higher one was read. Each poll re-reads the last `overlap` ids and skips the ones
+    already returned, so such rows are still seen if they commit within that many ids.
+    """
+
+    def __init__(self, overlap=1000, batch_size=5000):
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.cursor = None
+        self._seen = set()
+
+    def poll(self, sensor_ids):
+        """Return new rows (dicts with sensor_id, value, created_at) of the given sensors."""
+        if self.cursor is None:
+            # Start at the current end of the table rather than replaying history
+            self.cursor = db.session.scalar(select(func.max(Sensor_Data.id))) or 0
+            self._seen = set(db.session.scalars(select(Sensor_Data.id).where(Sensor_Data.id > self.cursor - self.overlap)))
+            db.session.rollback()
+            return []
+        if not sensor_ids:
+            return []
+        floor = self.cursor - self.overlap
+        # At most `overlap` of these were seen already, so every poll makes progress
+        result = db.session.execute(
+            select(Sensor_Data.id, Sensor_Data.sensor_id, Sensor_Data.value, Sensor_Data.created_at)
+            .where(Sensor_Data.id > floor, Sensor_Data.sensor_id.in_(sensor_ids))
+            .order_by(Sensor_Data.id)
+            .limit(self.overlap + self.batch_size)
+        ).all()
+        db.session.rollback()
+
+        rows = []
+        for id, sensor_id, value, created_at in result:
+            if id in self._seen:
+                continue
+            self._seen.add(id)
+            self.cursor = max(self.cursor, id)
+            rows.append({"sensor_id": sensor_id, "value": value, "created_at": created_at})
+        floor = self.cursor - self.overlap
+        self._seen = {id for id in self._seen if id > floor}
+        return rows
+
+
+def init_app(app):
+    """Register the alerts commands and start an AlertEngine in this process if ALERT_ENGINE_IN_PROCESS is set."""
+    app.cli.add_command(alert_cli)
+    if not app.config["ALERTS_ENABLED"] or not app.config["ALERT_ENGINE_IN_PROCESS"]:
+        return
+    engine = app.extensions["alert_engine"] = AlertEngine(
+        app,
+        workers=app.config["ALERT_WORKERS"],
+        queue_size=app.config["ALERT_QUEUE_SIZE"],
+        refresh_seconds=app.config["ALERT_RULE_REFRESH_SECONDS"],
+        sweep_seconds=app.config["ALERT_SWEEP_SECONDS"],
+    )
+    start_when_serving(app, engine)
+
+@alert_cli.command('sweep-no-data')
+def sweep_no_data_command():
+    raised = alert_service.sweep_no_data()
+    click.echo(f'{raised} no_data alerts raised' if raised is not None else 'no_data sweep failed, see logs')
+
+@alert_cli.command('run')
+def run_command():
+    """Evaluate every alert rule in this process, the single evaluator when web workers don't."""
+    config = current_app.config
+    if not config['ALERTS_ENABLED']:
+        click.echo('Alerts are disabled, set ALERTS_ENABLED=true')
+        return
+    if current_app.extensions.get('alert_engine'):
+        click.echo('Alert engine already runs in the web processes, set ALERT_ENGINE_IN_PROCESS=false')
+        return
+    engine = AlertEngine(
+        current_app._get_current_object(),
+        workers=config['ALERT_WORKERS'],
+        queue_size=config['ALERT_QUEUE_SIZE'],
+        refresh_seconds=config['ALERT_RULE_REFRESH_SECONDS'],
+        sweep_seconds=config['ALERT_SWEEP_SECONDS'],
+    )
+    engine.start()
+    tail = ReadingTail(overlap=config['ALERT_TAIL_OVERLAP'])
+    while True:
+        try:
+            rows = tail.poll(engine.sensor_ids()) if engine.tables_exist() else []
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Error reading new readings for alerts: {e}")
+            rows = []
+        if rows:
+            engine.submit(rows)
+        if len(rows) < tail.batch_size:
+            time.sleep(config['ALERT_SWEEP_SECONDS'])
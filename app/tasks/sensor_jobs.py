@@ -0,0 +1,527 @@
+from app.extensions import db
+from app.models import User, Device, Sensor, Sensor_Data, Ingest_Batch
+from app.services import rollup_service, sensor_service, export_service
+from app.ingest_queue import IngestQueue
+from app.logger import logger, LogSummary
+from app import geo, metrics
+from app.tasks import start_when_serving
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, text, select, insert, update, delete
+from sqlalchemy.exc import SQLAlchemyError, OperationalError, InterfaceError
+from threading import Thread, Lock
+from datetime import datetime, timedelta
+import sqlite3
+import click
+import os
+import time
+import re
+
+sensor_cli = AppGroup('sensors', help='Sensor data maintenance jobs.')
+
+def repair_rollups(hours=24, sensor_ids=None):
+    """
+    Rebuild the last `hours` hours of rollups from raw readings.
+
+    Meant to run periodically (e.g. hourly from cron) to correct drift from deleted
+    readings or failed ingest writes, or once with a large window to backfill.
+    """
+    since = datetime.utcnow() - timedelta(hours=hours)
+    try:
+        written = rollup_service.rebuild_rollups(since=since, sensor_ids=sensor_ids)
+    except SQLAlchemyError as e:
+        logger.error(f"Error repairing rollups since {since}: {e}")
+        return None
+    logger.info(f"Repaired {written} rollup buckets since {since}")
+    return written
+
+def compact_rollups():
+    """Drop fine-grained rollups past their retention, coarser resolutions keep covering that history."""
+    config = current_app.config
+    retention = {"1m": config["ROLLUP_MINUTE_RETENTION_DAYS"], "1h": config["ROLLUP_HOUR_RETENTION_DAYS"]}
+    deleted = {}
+    for resolution, days in retention.items():
+        if not days:
+            continue
+        before = datetime.utcnow() - timedelta(days=days)
+        try:
+            deleted[resolution] = rollup_service.purge_rollups(resolution, before)
+        except SQLAlchemyError as e:
+            logger.error(f"Error compacting {resolution} rollups before {before}: {e}")
+            continue
+        logger.info(f"Compacted {deleted[resolution]} {resolution} rollups older than {before}")
+    return deleted
+
+def create_indexes():
+    """
+    Create any index declared on the models that is missing from the database.
+
+    db.create_all() only creates indexes for new tables, this brings databases created
+    before an index was added up to date. Indexes on columns the table doesn't have yet
+    are left to the upgrade command adding those columns. Returns the names of the
+    indexes created.
+    """
+    inspector = db.inspect(db.engine)
+    partitioned = _sensor_data_partitions() is not None
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            # A unique index on a partitioned table needs the partition key, see upgrade_client_seq
+            if partitioned and table.name == "Sensor_Data" and index.unique and "created_at" not in index.columns:
+                continue
+            if index.name not in existing and {column.name for column in index.columns} <= columns:
+                index.create(db.engine)
+                created.append(index.name)
+    logger.info(f"Created indexes: {created}")
+    return created
+
+def add_missing_columns(model, columns):
+    """
+    ALTER TABLE ADD COLUMN each of columns ({name: SQL type}) missing from model's table,
+    for tables created before the column was added to the model. Returns the names added.
+    """
+    existing = {column["name"] for column in db.inspect(db.engine).get_columns(model.__tablename__)}
+    added = [name for name in columns if name not in existing]
+    for name in added:
+        db.session.execute(text(f'ALTER TABLE "{model.__tablename__}" ADD COLUMN {name} {columns[name]}'))
+    db.session.commit()
+    return added
+
+def upgrade_retention():
+    """
+    Add the retention_days columns to Users and Sensors tables created before per-user
+    and per-sensor retention existed, plus the index on Sensors.user_id. Safe to rerun.
+
+    Returns:
+        dict: {table name: columns added}
+    """
+    added = {model.__tablename__: add_missing_columns(model, {"retention_days": "INTEGER"}) for model in (User, Sensor)}
+    create_indexes()
+    logger.info(f"Retention columns added: {added}")
+    return added
+
+def upgrade_client_seq():
+    """
+    Add the client_seq column to a Sensor_Data table created before it existed, and its
+    unique index. On a partitioned PostgreSQL table the index also covers created_at, as
+    every unique index there must, and SENSOR_DATA_PARTITIONED must be set so inserts
+    use the same conflict target. Safe to rerun.
+
+    Returns:
+        dict: {"columns": columns added, "index": indexed columns}
+    """
+    added = add_missing_columns(Sensor_Data, {"client_seq": "VARCHAR(64)"})
+    partitioned = _sensor_data_partitions() is not None
+    columns = ["sensor_id", "client_seq"] + (["created_at"] if partitioned else [])
+    db.session.execute(text(
+        f'CREATE UNIQUE INDEX IF NOT EXISTS uq_sensor_data_client_seq ON "Sensor_Data" ({", ".join(columns)})'
+    ))
+    db.session.commit()
+    if partitioned != current_app.config["SENSOR_DATA_PARTITIONED"]:
+        logger.warning(f"Sensor_Data is {'' if partitioned else 'not '}partitioned, set SENSOR_DATA_PARTITIONED={str(partitioned).lower()}")
+    logger.info(f"Upgraded Sensor_Data client_seq, columns added: {added}, unique on {columns}")
+    return {"columns": added, "index": columns}
+
+def backfill_geohashes(batch_size=5000):
+    """
+    Add the geohash column to Sensors and Devices tables created before it existed, create
+    its indexes, and fill it in for located rows saved without one.
+
+    Returns:
+        dict: {table name: rows updated}
+    """
+    for model in (Sensor, Device):
+        add_missing_columns(model, {"geohash": "VARCHAR(12)"})
+    create_indexes()
+
+    updated = {}
+    for model in (Sensor, Device):
+        updated[model.__tablename__], last_id = 0, 0
+        while True:
+            rows = db.session.execute(
+                select(model.id, model.latitude, model.longitude)
+                .where(model.geohash.is_(None), model.latitude.isnot(None), model.longitude.isnot(None), model.id > last_id)
+                .order_by(model.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            # Out of range coordinates have no geohash and stay NULL
+            values = [{"id": id, "geohash": geo.encode(latitude, longitude)} for id, latitude, longitude in rows]
+            values = [value for value in values if value["geohash"]]
+            if values:
+                db.session.execute(update(model), values)
+                db.session.commit()
+            updated[model.__tablename__] += len(values)
+            last_id = rows[-1].id
+    logger.info(f"Backfilled geohashes: {updated}")
+    return updated
+
+_PARTITION_NAME = re.compile(r"^Sensor_Data_p(\d{4})(\d{2})$")
+
+def _month_start(moment, offset=0):
+    month = moment.year * 12 + moment.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+def _sensor_data_partitions():
+    """
+    Return {partition name: (range start, range end)} for a PostgreSQL Sensor_Data table
+    partitioned by month, or None when the table isn't partitioned.
+    """
+    if db.engine.dialect.name != "postgresql":
+        return None
+    is_partitioned = db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'Sensor_Data'"
+    )).first()
+    if not is_partitioned:
+        return None
+
+    names = db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'Sensor_Data'"
+    )).scalars()
+    partitions = {}
+    for name in names:
+        match = _PARTITION_NAME.match(name)
+        if match:
+            start = datetime(int(match.group(1)), int(match.group(2)), 1)
+            partitions[name] = (start, _month_start(start, 1))
+    return partitions
+
+def ensure_partitions(months_ahead=2):
+    """
+    Create monthly Sensor_Data partitions from the current month to months_ahead.
+
+    Only applies on PostgreSQL when "Sensor_Data" has been created as a partitioned table,
+    e.g. PARTITION BY RANGE (created_at) with a (id, created_at) primary key. On any other
+    database this is a no-op. Returns the names of the partitions created.
+    """
+    partitions = _sensor_data_partitions()
+    if partitions is None:
+        return []
+
+    created = []
+    now = datetime.utcnow()
+    for offset in range(months_ahead + 1):
+        start, end = _month_start(now, offset), _month_start(now, offset + 1)
+        name = f"Sensor_Data_p{start:%Y%m}"
+        if name in partitions:
+            continue
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "Sensor_Data" '
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+        created.append(name)
+    db.session.commit()
+    logger.info(f"Created Sensor_Data partitions: {created}")
+    return created
+
+def enforce_retention(batch_size=5000):
+    """
+    Remove readings older than each sensor's effective retention (sensor, then user,
+    then SENSOR_DATA_RETENTION_DAYS).
+
+    On a partitioned PostgreSQL table, monthly partitions entirely older than the
+    longest retention in use are dropped whole. Everything else is deleted per sensor in
+    batches of batch_size with a commit between batches, so the table is never locked
+    for the duration of the cleanup.
+
+    Returns:
+        dict: {"partitions_dropped": [...], "rows_deleted": int}
+    """
+    default_days = current_app.config["SENSOR_DATA_RETENTION_DAYS"]
+    retention = db.session.query(Sensor.id, func.coalesce(Sensor.retention_days, User.retention_days, default_days)) \
+        .join(User, User.id == Sensor.user_id).all()
+    now = datetime.utcnow()
+
+    dropped = []
+    partitions = _sensor_data_partitions()
+    if partitions and retention and all(days for _, days in retention):
+        drop_before = now - timedelta(days=max(days for _, days in retention))
+        for name, (start, end) in sorted(partitions.items()):
+            if end <= drop_before:
+                db.session.execute(text(f'DROP TABLE "{name}"'))
+                dropped.append(name)
+        db.session.commit()
+
+    deleted = 0
+    for sensor_id, days in retention:
+        if not days:
+            continue
+        cutoff = now - timedelta(days=days)
+        deleted += sensor_service.delete_sensor_data_in_batches(
+            Sensor_Data.sensor_id == sensor_id, Sensor_Data.created_at < cutoff, batch_size=batch_size
+        )
+    purge_ingest_keys(current_app.config["INGEST_KEY_RETENTION_HOURS"])
+    logger.info(f"Retention removed {deleted} readings and dropped partitions {dropped}")
+    return {"partitions_dropped": dropped, "rows_deleted": deleted}
+
+# Drained batches are logged as periodic totals, the drainer runs up to twice a second
+drain_log = LogSummary("Ingest queue drained")
+
+def _write_batches(batches):
+    """
+    Write queued batches and their idempotency keys in the current transaction, skipping
+    batches whose key is already in Ingest_Batches.
+
+    Returns:
+        tuple: (rows written, number of batches skipped)
+    """
+    written = set(db.session.scalars(select(Ingest_Batch.key).where(Ingest_Batch.key.in_([batch[1] for batch in batches]))))
+    keys, rows = [], []
+    for _, key, _, batch_rows, _ in batches:
+        if key in written:
+            continue
+        keys.append({"key": key})
+        rows.extend(sensor_service.unqueued_row(row) for row in batch_rows)
+
+    if keys:
+        db.session.execute(insert(Ingest_Batch), keys)
+    if rows:
+        rows = sensor_service.write_sensor_data(rows)
+    return rows, len(batches) - len(keys)
+
+def _unavailable(error):
+    """Whether a write failed because of the database (down, locked, restarting) rather than the batch."""
+    return isinstance(error, (OperationalError, InterfaceError)) or getattr(error, "connection_invalidated", False)
+
+def _fail_batches(ingest_queue, batches, error, max_attempts):
+    """Return batches whose write failed to the queue, counting the failure against each unless the database was unavailable."""
+    if _unavailable(error):
+        ingest_queue.release([batch[0] for batch in batches])
+        logger.error(f"Error draining {len(batches)} ingest batches: {error}")
+        return
+    for id, key, user_id, _, attempts in batches:
+        if ingest_queue.fail(id, str(error), max_attempts):
+            metrics.INGEST_DEAD_BATCHES.inc()
+            logger.error(f"Moved ingest batch {key} of user {user_id} to dead_batches after {attempts + 1} failed writes: {error}")
+        else:
+            logger.error(f"Error draining ingest batch {key} of user {user_id}: {error}")
+
+def drain_ingest_queue(ingest_queue, max_batches=200, max_attempts=5):
+    """
+    Write up to max_batches queued ingest batches to Sensor_Data in one transaction.
+
+    Each batch's idempotency key is recorded in Ingest_Batches in the same transaction
+    as its rows, so a batch delivered again after a crash or an expired lease is
+    skipped instead of written twice. Batches are only removed from the queue once
+    the transaction has committed.
+
+    When the transaction fails for a reason other than the database being unavailable,
+    the batches are written again one per transaction, so a single bad batch (e.g. rows
+    of a sensor deleted while they were queued) doesn't hold back the others. A batch
+    that fails max_attempts times is moved to the queue's dead_batches table.
+
+    Returns:
+        int: Number of rows written
+        None: If nothing could be written
+    """
+    try:
+        batches = ingest_queue.claim(max_batches)
+    except sqlite3.Error as e:
+        logger.error(f"Error claiming ingest batches: {e}")
+        return None
+    if not batches:
+        return 0
+
+    try:
+        rows, skipped = _write_batches(batches)
+        db.session.commit()
+    except (SQLAlchemyError, ValueError, KeyError) as e:
+        db.session.rollback()
+        if len(batches) == 1 or _unavailable(e):
+            _fail_batches(ingest_queue, batches, e, max_attempts)
+            return None
+        return _drain_one_by_one(ingest_queue, batches, max_attempts)
+
+    ingest_queue.ack([batch[0] for batch in batches])
+    sensor_service.publish_rows(rows)
+    drain_log.add(batches=len(batches), rows=len(rows), duplicate_batches=skipped)
+    return len(rows)
+
+def _drain_one_by_one(ingest_queue, batches, max_attempts):
+    """drain_ingest_queue for claimed batches that failed together, one transaction each."""
+    total, failed = 0, 0
+    for position, batch in enumerate(batches):
+        try:
+            rows, _ = _write_batches([batch])
+            db.session.commit()
+        except (SQLAlchemyError, ValueError, KeyError) as e:
+            db.session.rollback()
+            if _unavailable(e):
+                _fail_batches(ingest_queue, batches[position:], e, max_attempts)
+                return total or None
+            _fail_batches(ingest_queue, [batch], e, max_attempts)
+            failed += 1
+            continue
+        ingest_queue.ack([batch[0]])
+        sensor_service.publish_rows(rows)
+        total += len(rows)
+    drain_log.add(batches=len(batches) - failed, rows=total, failed_batches=failed)
+    return total if failed < len(batches) else None
+
+def purge_ingest_keys(hours):
+    """Forget idempotency keys of batches written more than hours ago."""
+    before = datetime.utcnow() - timedelta(hours=hours)
+    deleted = db.session.execute(delete(Ingest_Batch).where(Ingest_Batch.created_at < before)).rowcount
+    db.session.commit()
+    ingest_queue = current_app.extensions.get("ingest_queue")
+    if ingest_queue:
+        ingest_queue.purge_client_keys(time.time() - hours * 3600)
+    return deleted
+
+
+class IngestDrainer:
+    """
+    Background thread that keeps draining the ingest queue into the database. While the
+    database is unavailable batches stay queued and the drainer retries with backoff,
+    so ingest keeps acknowledging clients through maintenance windows.
+    """
+
+    def __init__(self, app, ingest_queue, max_batches=200, interval=0.5, max_attempts=5):
+        self.app = app
+        self.ingest_queue = ingest_queue
+        self.max_batches = max_batches
+        self.max_attempts = max_attempts
+        self.interval = interval
+        self._pid = None
+        self._running = False
+        self._lock = Lock()
+
+    def start(self):
+        """Start the drain thread, again in a process forked after it was started."""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._running = True
+        Thread(target=self._drain, name="ingest-drainer", daemon=True).start()
+        logger.info("Ingest drainer started")
+
+    def stop(self):
+        self._running = False
+
+    def _drain(self):
+        backoff = self.interval
+        while self._running:
+            try:
+                with self.app.app_context():
+                    written = drain_ingest_queue(self.ingest_queue, self.max_batches, self.max_attempts)
+            except Exception as e:
+                # e.g. the queue file failing on ack, the thread must outlive it or nothing drains
+                logger.error(f"Ingest drainer pass failed: {e!r}")
+                written = None
+            if written is None:
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = self.interval
+            if not written:
+                time.sleep(self.interval)
+
+
+def init_app(app):
+    """Open the ingest queue and attach its drainer when INGEST_QUEUE_ENABLED is set."""
+    config = app.config
+    if not config["INGEST_QUEUE_ENABLED"]:
+        return
+    ingest_queue = IngestQueue(config["INGEST_QUEUE_PATH"], lease_seconds=config["INGEST_QUEUE_LEASE_SECONDS"])
+    app.extensions["ingest_queue"] = ingest_queue
+    # Otherwise drained by a separate `flask sensors drain-ingest-queue` process
+    if config["INGEST_QUEUE_DRAIN_IN_PROCESS"]:
+        app.extensions["ingest_drainer"] = IngestDrainer(
+            app,
+            ingest_queue,
+            max_batches=config["INGEST_QUEUE_DRAIN_BATCHES"],
+            interval=config["INGEST_QUEUE_DRAIN_INTERVAL"],
+            max_attempts=config["INGEST_QUEUE_MAX_ATTEMPTS"],
+        )
+        # Started now rather than on the next ingest, so a backlog left by a restart drains
+        start_when_serving(app, app.extensions["ingest_drainer"])
+
+@sensor_cli.command('repair-rollups')
+@click.option('--hours', default=24, show_default=True, help='Size of the window to rebuild.')
+@click.option('--sensor-id', 'sensor_ids', multiple=True, type=int, help='Only rebuild these sensors.')
+def repair_rollups_command(hours, sensor_ids):
+    written = repair_rollups(hours=hours, sensor_ids=list(sensor_ids) or None)
+    click.echo(f'{written} rollup buckets rebuilt' if written is not None else 'Rollup repair failed, see logs')
+
+@sensor_cli.command('compact-rollups')
+def compact_rollups_command():
+    for resolution, deleted in compact_rollups().items():
+        click.echo(f'{deleted} {resolution} rollups removed')
+
+@sensor_cli.command('create-indexes')
+def create_indexes_command():
+    created = create_indexes()
+    click.echo(f'Created indexes: {", ".join(created)}' if created else 'All indexes already exist')
+
+@sensor_cli.command('upgrade-retention')
+def upgrade_retention_command():
+    for table, columns in upgrade_retention().items():
+        click.echo(f'{table}: {", ".join(columns) or "up to date"}')
+
+@sensor_cli.command('upgrade-client-seq')
+def upgrade_client_seq_command():
+    result = upgrade_client_seq()
+    click.echo(f'Sensor_Data: {", ".join(result["columns"]) or "up to date"}, unique on ({", ".join(result["index"])})')
+
+@sensor_cli.command('backfill-geohash')
+def backfill_geohash_command():
+    for table, updated in backfill_geohashes(batch_size=current_app.config['SENSOR_DATA_DELETE_BATCH']).items():
+        click.echo(f'{updated} {table} rows geohashed')
+
+@sensor_cli.command('create-partitions')
+@click.option('--months-ahead', default=2, show_default=True, help='Number of future months to create.')
+def create_partitions_command(months_ahead):
+    created = ensure_partitions(months_ahead=months_ahead)
+    click.echo(f'Created partitions: {", ".join(created)}' if created else 'No partitions created')
+
+@sensor_cli.command('enforce-retention')
+def enforce_retention_command():
+    result = enforce_retention(batch_size=current_app.config['SENSOR_DATA_DELETE_BATCH'])
+    click.echo(f'{result["rows_deleted"]} readings deleted, {len(result["partitions_dropped"])} partitions dropped')
+
+@sensor_cli.command('drain-ingest-queue')
+@click.option('--once', is_flag=True, help='Drain what is queued now and exit.')
+def drain_ingest_queue_command(once):
+    ingest_queue = current_app.extensions.get('ingest_queue')
+    if ingest_queue is None:
+        click.echo('Ingest queue is disabled, set INGEST_QUEUE_ENABLED=true')
+        return
+    config = current_app.config
+    total = 0
+    while True:
+        written = drain_ingest_queue(ingest_queue, max_batches=config['INGEST_QUEUE_DRAIN_BATCHES'],
+                                     max_attempts=config['INGEST_QUEUE_MAX_ATTEMPTS'])
+        total += written or 0
+        if once and not written:
+            break
+        if not written:
+            time.sleep(config['INGEST_QUEUE_DRAIN_INTERVAL'])
+    stats = ingest_queue.stats()
+    click.echo(f'{total} readings written, {stats["batches"]} batches still queued, {stats["dead"]} dead')
+
+@sensor_cli.command('export')
+@click.option('--user-id', required=True, type=int, help='Owner of the sensors to export.')
+@click.option('--sensor-id', 'sensor_ids', multiple=True, type=int, help='Only export these sensors.')
+@click.option('--since', type=click.DateTime(), help='Start of the time range (UTC).')
+@click.option('--until', type=click.DateTime(), help='End of the time range (UTC).')
+@click.option('--format', 'format', default='csv', show_default=True, type=click.Choice(list(export_service.FORMATS)))
+@click.option('--output', required=True, type=click.Path(dir_okay=False, writable=True), help='File to write.')
+def export_command(user_id, sensor_ids, since, until, format, output):
+    chunks = export_service.export_sensor_data(user_id=user_id, sensor_ids=list(sensor_ids) or None, since=since, until=until,
+                                               format=format, chunk_size=current_app.config['EXPORT_CHUNK_SIZE'])
+    if isinstance(chunks, dict):
+        raise click.ClickException(chunks['error'])
+    written = 0
+    with open(output, 'w' if format == 'csv' else 'wb') as file:
+        for chunk in chunks:
+            written += file.write(chunk)
+    click.echo(f'Wrote {written} {"characters" if format == "csv" else "bytes"} to {output}')
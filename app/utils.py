@@ -1,5 +1,8 @@
 import re
+from datetime import datetime, timezone
+from app.extensions import db
 from app.models import User
+from sqlalchemy.dialects import postgresql, sqlite
 
 def is_email_valid(email):
     user = User.query.filter_by(email=email).first()
@@ -52,4 +55,27 @@ def to_int(value):
     try:
         return int(value)
     except (TypeError, ValueError):
-        return None
\ No newline at end of file
+        return None
+
+def to_datetime(value):
+    if value is None:
+        return True, None
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return False, None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return True, moment
+
+def dialect_insert(model, dialect=None):
+    """
+    Return an INSERT for model that supports on_conflict_do_update/do_nothing
+    on the bound database (PostgreSQL or SQLite), or on the named dialect.
+    """
+    dialect = dialect or db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    raise NotImplementedError(f'Upserts are not supported on {dialect}')
@@ -0,0 +1,6 @@
+from app.asgi import create_asgi_app
+
+# Create the ASGI app, ingest and reads run on asyncio and everything else through Flask
+app = create_asgi_app()
+
+# Example: uvicorn asgi:app --workers 4
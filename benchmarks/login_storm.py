@@ -0,0 +1,128 @@
+"""
+Login storm benchmark.
+
+Serves the app on a local threaded server, then measures latency of POST
+/api/sensors/data while a pool of clients hammers /api/auth/login, the
+pattern seen when a fleet of CLIs re-authenticates after a restart. Ingest
+latency is measured once on its own as a baseline and once during the storm.
+
+Usage:
+    python benchmarks/login_storm.py --logins 200 --login-clients 32
+    PASSWORD_POOL_WORKERS=0 python benchmarks/login_storm.py   # bcrypt inline, for comparison
+
+Prints one JSON object with p50/p95/p99 ingest latencies (ms) and login
+status counts, so runs can be diffed or collected by CI.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Event
+import argparse
+import http.client
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def request(port, method, path, body=None, token=None):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    start = time.perf_counter()
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    payload = response.read()
+    elapsed = time.perf_counter() - start
+    connection.close()
+    return response.status, payload, elapsed
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    samples = sorted(samples)
+    pick = lambda p: round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000, 2)
+    return {'count': len(samples), 'p50_ms': pick(50), 'p95_ms': pick(95), 'p99_ms': pick(99), 'max_ms': round(samples[-1] * 1000, 2)}
+
+def setup(app):
+    """Create a user with one sensor and return (token, sensor_id)."""
+    from app.extensions import db
+    from app.models import Device, Sensor
+
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        client.post('/api/auth/register', json={'email': 'bench@example.com', 'username': 'bench', 'password': 'Benchmark1!'})
+        token = client.post('/api/auth/login', json={'username': 'bench', 'password': 'Benchmark1!'}).json['access_token']
+        device = Device(user_id=1, type='bench')
+        db.session.add(device)
+        db.session.commit()
+        sensor = Sensor(user_id=1, device_id=device.id, type='bench', latitude=0.0, longitude=0.0)
+        db.session.add(sensor)
+        db.session.commit()
+        return token, sensor.id
+
+def ingest(port, token, sensor_id, batch, stop=None, count=None):
+    readings = [{'sensor_id': sensor_id, 'value': float(i), 'unit': 'cm'} for i in range(batch)]
+    samples = []
+    while (stop is None or not stop.is_set()) and (count is None or len(samples) < count):
+        status, _, elapsed = request(port, 'POST', '/api/sensors/data', {'readings': readings}, token)
+        if status == 200:
+            samples.append(elapsed)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=200, help='Total login attempts in the storm')
+    parser.add_argument('--login-clients', type=int, default=32, help='Concurrent login clients')
+    parser.add_argument('--baseline-requests', type=int, default=200, help='Ingest requests measured without a storm')
+    parser.add_argument('--batch', type=int, default=50, help='Readings per ingest request')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{tempfile.mkdtemp()}/login_storm.db')
+    os.environ.setdefault('ALERTS_ENABLED', 'false')
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')  # measure the app, not the ingest budgets
+    from app import create_app
+    from werkzeug.serving import make_server
+
+    app = create_app()
+    token, sensor_id = setup(app)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    baseline = ingest(port, token, sensor_id, args.batch, count=args.baseline_requests)
+
+    stop = Event()
+    storm_samples = []
+    ingest_thread = Thread(target=lambda: storm_samples.extend(ingest(port, token, sensor_id, args.batch, stop=stop)))
+    ingest_thread.start()
+
+    statuses = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.login_clients) as clients:
+        login = lambda _: request(port, 'POST', '/api/auth/login', {'username': 'bench', 'password': 'Benchmark1!'})
+        for status, _, _ in clients.map(login, range(args.logins)):
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    storm_seconds = time.perf_counter() - start
+    stop.set()
+    ingest_thread.join()
+    server.shutdown()
+
+    print(json.dumps({
+        'config': {
+            'bcrypt_rounds': app.config['BCRYPT_ROUNDS'],
+            'password_pool_workers': app.config['PASSWORD_POOL_WORKERS'],
+            'password_pool_max_pending': app.config['PASSWORD_POOL_MAX_PENDING'],
+            'logins': args.logins,
+            'login_clients': args.login_clients,
+            'batch': args.batch,
+        },
+        'ingest_baseline': percentiles(baseline),
+        'ingest_during_storm': percentiles(storm_samples),
+        'logins': {'seconds': round(storm_seconds, 2), 'per_second': round(args.logins / storm_seconds, 1), 'status': statuses},
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()